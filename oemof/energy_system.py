@@ -5,18 +5,222 @@ Created on Mon Jul 20 15:53:14 2015
 @author: uwe
 """
 
-from functools import partial
+from contextlib import contextmanager
+from io import BytesIO
 from warnings import warn
+import hashlib
 import logging
 import os
+import struct
 
 import dill as pickle
+import numpy as np
 
-from oemof.network import Entity
-from oemof.groupings import DEFAULT as BY_UID, Grouping, Nodes
+from oemof.network import Edges, Entity, _connect, flow
+from oemof.groupings import DEFAULT as BY_UID, Grouping, Nodes, fuse
 from oemof.network import Node
 
 
+def _equal(a, b):
+    """ Whether the arrays `a` and `b` are equal, treating NaNs as equal.
+    """
+    if a.shape != b.shape:
+        return False
+    if a.dtype.kind in 'fc':
+        return bool(((a == b) | (np.isnan(a) & np.isnan(b))).all())
+    return bool((a == b).all())
+
+
+class SequencePool:
+    """ Interns NumPy arrays by content, so equal arrays share one buffer.
+
+    Arrays are looked up by a hash of their dtype, shape and contents. The
+    first array with a given content becomes the canonical one and is made
+    read-only, as it might be shared. All arrays with the same content
+    interned later on are replaced by the canonical one.
+
+    Only arrays owning their data are interned. Views, e.g. of arrays or
+    Series passed to :func:`~oemof.solph.plumbing.Sequence`, share the
+    buffer of their caller, which may still change it, so they are neither
+    made read-only nor shared with other sequences.
+
+    Attributes
+    ----------
+    saved : int
+        The number of bytes saved by not keeping duplicates around.
+
+    Examples
+    --------
+    >>> pool = SequencePool()
+    >>> a = pool.intern(np.ones(8760))
+    >>> pool.intern(np.ones(8760)) is a, a.flags.writeable
+    (True, False)
+    >>> pool.saved, len(pool)
+    (70080, 1)
+    """
+    def __init__(self):
+        self._arrays = {}
+        self.saved = 0
+
+    def intern(self, array):
+        """ Return the canonical array with the contents of `array`.
+
+        Arrays of `object` dtype can't be hashed by content and views don't
+        own their data, so both are returned unchanged.
+        """
+        if array.dtype.hasobject or not array.flags.owndata:
+            return array
+        contents = np.ascontiguousarray(array)
+        key = (array.dtype.str, array.shape,
+               hashlib.sha1(contents.data).digest())
+        canonical = self._arrays.get(key)
+        if canonical is not None and _equal(canonical, array):
+            if canonical is not array:
+                self.saved += array.nbytes
+            return canonical
+        array.flags.writeable = False
+        self._arrays[key] = array
+        return array
+
+    def __len__(self):
+        return len(self._arrays)
+
+
+_SNAPSHOT_MAGIC = b'OEMOFSS\x01'
+_ALIGNMENT = 64
+
+# Attributes which aren't stored in snapshots, because they are either
+# stored separately, or belong to the energy system restoring the snapshot.
+_NOT_DUMPED = frozenset(['entities', 'edges', 'sequences', '_groups',
+                         '_groupings', '_ungrouped', '_deferred'])
+
+
+class _SnapshotPickler(pickle.Pickler):
+    """ Pickles references to tabled nodes and moves arrays out of band.
+
+    Nodes in `nodes` are pickled as their position in the node table.
+    One dimensional arrays which don't hold Python objects are pickled as
+    a reference to a block of raw data, aligned to :const:`_ALIGNMENT`
+    bytes, starting at `offset`. The blocks which need to be written are
+    collected in :attr:`arrays` as `(offset, array)` pairs.
+    """
+    def __init__(self, file, nodes, offset=_ALIGNMENT):
+        super().__init__(file)
+        self.nodes = {id(n): i for i, n in enumerate(nodes)}
+        self.offset = offset
+        self.arrays = []
+        self._blocks = {}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Node):
+            position = self.nodes.get(id(obj))
+            return None if position is None else ('node', position)
+        if (not isinstance(obj, np.ndarray) or obj.ndim != 1 or
+                obj.dtype.hasobject):
+            return None
+        if id(obj) not in self._blocks:
+            self.offset += -self.offset % _ALIGNMENT
+            self._blocks[id(obj)] = ('array', obj.dtype.str, self.offset,
+                                     len(obj))
+            self.arrays.append((self.offset, obj))
+            self.offset += obj.nbytes
+        return self._blocks[id(obj)]
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    """ Resolves the references pickled by :class:`_SnapshotPickler`.
+
+    Arrays become read-only views into `buffer`, which is expected to be a
+    memory map of the whole snapshot, so they are only read when accessed.
+    """
+    def __init__(self, file, buffer):
+        super().__init__(file)
+        self.buffer = buffer
+        self.nodes = []
+
+    def persistent_load(self, pid):
+        if pid[0] == 'node':
+            return self.nodes[pid[1]]
+        dtype, offset, length = np.dtype(pid[1]), pid[2], pid[3]
+        return self.buffer[offset:offset + length * dtype.itemsize].view(
+            dtype)
+
+
+def write_snapshot(path, entities, flows, attributes):
+    """ Write `entities`, `flows` and `attributes` to a snapshot at `path`.
+
+    The snapshot consists of a table of the types and labels of the
+    `entities`, the table of `flows`, i.e. of `(source, target, flow)`
+    triples, and the dictionary of `attributes`. All one dimensional NumPy
+    arrays, e.g. the data of sequences, are moved out of these tables and
+    stored as contiguous blocks of raw data instead. Arrays shared by
+    multiple objects are only stored once.
+    """
+    tables = BytesIO()
+    pickler = _SnapshotPickler(tables, entities)
+    pickler.dump([(type(e), (e._label,) if hasattr(e, '_label') else ())
+                  if isinstance(e, Node) else None
+                  for e in entities])
+    pickler.dump({
+        'entities': [getattr(e, '__dict__', None) if isinstance(e, Node)
+                     else e for e in entities],
+        'flows': list(flows),
+        'attributes': attributes})
+    tables_offset = pickler.offset + (-pickler.offset % _ALIGNMENT)
+
+    with open(path, 'wb') as snapshot:
+        snapshot.write(_SNAPSHOT_MAGIC)
+        snapshot.write(struct.pack('<Q', tables_offset))
+        for offset, array in pickler.arrays:
+            snapshot.write(b'\0' * (offset - snapshot.tell()))
+            snapshot.write(np.ascontiguousarray(array).view(np.uint8).data)
+        snapshot.write(b'\0' * (tables_offset - snapshot.tell()))
+        snapshot.write(tables.getbuffer())
+
+
+def read_snapshot(path, edges):
+    """ Read the entities and attributes stored in the snapshot at `path`.
+
+    The flows stored in the snapshot are recorded in the :class:`Edges
+    <oemof.network.Edges>` index `edges`, which also becomes the index of
+    the restored nodes. Arrays are memory mapped, i.e. they are read-only
+    and only read from disk when they are accessed.
+
+    Returns
+    -------
+    tuple
+        The list of entities and the dictionary of attributes.
+    """
+    with open(path, 'rb') as snapshot:
+        header = snapshot.read(len(_SNAPSHOT_MAGIC) + 8)
+        if header[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+            raise ValueError(
+                "{} is not an energy system snapshot.".format(path))
+        snapshot.seek(struct.unpack('<Q', header[-8:])[0])
+        unpickler = _SnapshotUnpickler(
+            snapshot, np.memmap(path, dtype=np.uint8, mode='r'))
+
+        for row in unpickler.load():
+            node = None
+            if row is not None:
+                node = row[0].__new__(row[0])
+                node._edges = edges
+                if row[1]:
+                    node._label = row[1][0]
+            unpickler.nodes.append(node)
+        state = unpickler.load()
+
+    entities = unpickler.nodes
+    for position, attributes in enumerate(state['entities']):
+        if entities[position] is None:
+            entities[position] = attributes
+        elif attributes:
+            entities[position].__dict__.update(attributes)
+    for source, target, f in state['flows']:
+        _connect(source, target, f)
+    return entities, state['attributes']
+
+
 class EnergySystem:
     r"""Defining an energy supply system to use oemof's solver libraries.
 
@@ -44,6 +248,9 @@ class EnergySystem:
         By default, there'll always be one group for each :attr:`uid
         <oemof.core.network.Entity.uid>` containing exactly the entity with the
         given :attr:`uid <oemof.core.network.Entity.uid>`.
+        :class:`FlowsWithNodes <oemof.groupings.FlowsWithNodes>` groupings
+        are :func:`fused <oemof.groupings.fuse>`, so the flows of each node
+        are only enumerated once for all of them.
         See the :ref:`examples <energy-system-examples>` for more information.
 
     Attributes
@@ -57,6 +264,16 @@ class EnergySystem:
         <oemof.core.network.Entity>` are automatically added to this list on
         construction.
     groups : dict
+    edges : :class:`Edges <oemof.network.Edges>`
+        The adjacency index holding the flows between the :class:`nodes
+        <oemof.network.Node>` created while this energy system is their
+        :attr:`registry <oemof.network.Node.registry>`.
+    sequences : :class:`SequencePool`
+        The pool used to intern the time series of the flows and nodes
+        created while this energy system is their :attr:`registry
+        <oemof.network.Node.registry>`. Its :attr:`saved
+        <SequencePool.saved>` attribute tells how many bytes the
+        deduplication saved.
     results : dictionary
         A dictionary holding the results produced by the energy system.
         Is `None` while no results are produced.
@@ -107,35 +324,150 @@ class EnergySystem:
         for attribute in ['entities']:
             setattr(self, attribute, kwargs.get(attribute, []))
 
+        self.edges = Edges()
+        self.sequences = SequencePool()
         Entity.registry = self
         Node.registry = self
         self._groups = {}
-        self._groupings = ( [BY_UID] +
-                            [ g if isinstance(g, Grouping) else Nodes(g)
-                              for g in kwargs.get('groupings', [])])
-        for e in self.entities:
-            for g in self._groupings:
-                g(e, self.groups)
+        self._groupings = fuse( [BY_UID] +
+                                [ g if isinstance(g, Grouping) else Nodes(g)
+                                  for g in kwargs.get('groupings', [])])
+        self._ungrouped = list(self.entities)
+        self._deferred = None
         self.results = kwargs.get('results')
         self.timeindex = kwargs.get('timeindex')
 
-    @staticmethod
-    def _regroup(entity, groups, groupings):
-        for g in groupings:
-            g(entity, groups)
-        return groups
+    def _regroup(self):
+        """ Run all groupings on the entities which haven't been grouped yet.
+
+        The entities are processed in one batch, i.e. each grouping is run
+        on all of them before moving on to the next grouping.
+        """
+        ungrouped, self._ungrouped = self._ungrouped, []
+        for g in self._groupings:
+            for e in ungrouped:
+                g(e, self._groups)
 
     def add(self, entity):
         """ Add an `entity` to this energy system.
+
+        Grouping the `entity` is deferred until the next time :attr:`groups`
+        is accessed. While inside a :meth:`bulk` block, adding the `entity`
+        itself is deferred until the block is left.
         """
+        if self._deferred is not None:
+            self._deferred.append(entity)
+            return
         self.entities.append(entity)
-        self._groups = partial(self._regroup, entity, self.groups,
-                               self._groupings)
+        self._ungrouped.append(entity)
+
+    def add_many(self, entities):
+        """ Add all `entities` to this energy system in one go.
+
+        Like :meth:`add`, but avoids the per entity overhead. The
+        `entities` will be grouped in one batch the next time :attr:`groups`
+        is accessed.
+        """
+        entities = list(entities)
+        if self._deferred is not None:
+            self._deferred.extend(entities)
+            return
+        self.entities.extend(entities)
+        self._ungrouped.extend(entities)
+
+    def remove(self, entity):
+        """ Remove `entity` from this energy system.
+
+        The `entity` is removed from :attr:`entities` and from all
+        :attr:`groups` it was put into. If it is a :class:`Node
+        <oemof.network.Node>`, all flows from or into it are removed too,
+        which also removes them from the groups of its former neighbours.
+
+        Examples
+        --------
+        >>> from oemof.network import Bus, Sink
+        >>> es = EnergySystem()
+        >>> bus = Bus(label="A bus")
+        >>> sink = Sink(label="A sink", inputs=[bus])
+        >>> es.remove(sink)
+        >>> "A sink" in es.groups, len(bus.outputs), es.entities == [bus]
+        (False, 0, True)
+        """
+        if self._deferred is not None and any(
+                entity is e for e in self._deferred):
+            self._deferred.remove(entity)
+        else:
+            self.entities.remove(entity)
+            if any(entity is e for e in self._ungrouped):
+                self._ungrouped.remove(entity)
+            else:
+                for g in self._groupings:
+                    g.remove(entity, self._groups)
+        if isinstance(entity, Node):
+            for target in list(entity.outputs):
+                del flow[entity, target]
+            for source in list(entity.inputs):
+                del flow[source, entity]
+            self.edges.remove_node(entity)
+
+    def replace(self, entity, new):
+        """ Replace `entity` with `new`.
+
+        Removes `entity` like :meth:`remove` does and puts `new` in its place
+        in :attr:`entities`. The flows of `entity` are removed, not
+        transferred, so `new` is expected to be created with flows of its
+        own. If `new` already registered itself with this energy system, it
+        is just moved to the place of `entity`.
+        """
+        position = self.entities.index(entity)
+        self.remove(entity)
+        if any(new is e for e in self.entities):
+            if self.entities.index(new) < position:
+                position -= 1
+            self.entities.remove(new)
+        else:
+            if self._deferred is not None and any(
+                    new is e for e in self._deferred):
+                self._deferred.remove(new)
+            self._ungrouped.append(new)
+        self.entities.insert(position, new)
+
+    @contextmanager
+    def bulk(self):
+        """ Defer registering entities until the end of a `with` block.
+
+        Entities registering themselves with this energy system inside the
+        block are collected and only added (via :meth:`add_many`) when the
+        block is left, after which all groupings are run on them in one
+        batched pass. Nesting these blocks is allowed, in which case only
+        leaving the outermost one adds the collected entities.
+
+        Examples
+        --------
+        >>> from oemof.network import Bus
+        >>> es = EnergySystem()
+        >>> with es.bulk():
+        ...     buses = [Bus(label="Bulk bus {}".format(i)) for i in range(3)]
+        ...     len(es.entities)
+        0
+        >>> es.entities == buses
+        True
+        """
+        if self._deferred is not None:
+            yield self
+            return
+        self._deferred = []
+        try:
+            yield self
+        finally:
+            deferred, self._deferred = self._deferred, None
+            self.add_many(deferred)
+        self._regroup()
 
     @property
     def groups(self):
-        while callable(self._groups):
-            self._groups = self._groups()
+        if self._ungrouped:
+            self._regroup()
         return self._groups
 
     @property
@@ -148,6 +480,12 @@ class EnergySystem:
 
     def dump(self, dpath=None, filename=None, keep_weather=True):
         r""" Dump an EnergySystem instance.
+
+        The energy system is stored as a snapshot (see
+        :func:`write_snapshot`) of its :attr:`entities`, its flows and its
+        remaining attributes. The :attr:`groups` aren't stored, as they are
+        recomputed using the groupings of the energy system restoring the
+        snapshot. See :meth:`restore`.
         """
         if dpath is None:
             bpath = os.path.join(os.path.expanduser("~"), '.oemof')
@@ -160,7 +498,10 @@ class EnergySystem:
         if filename is None:
             filename = 'es_dump.oemof'
 
-        pickle.dump(self.__dict__, open(os.path.join(dpath, filename), 'wb'))
+        write_snapshot(os.path.join(dpath, filename), self.entities,
+                       self.edges,
+                       {k: v for k, v in self.__dict__.items()
+                        if k not in _NOT_DUMPED})
 
         msg = ('Attributes dumped to: {0}'.format(os.path.join(
             dpath, filename)))
@@ -169,6 +510,12 @@ class EnergySystem:
 
     def restore(self, dpath=None, filename=None):
         r""" Restore an EnergySystem instance.
+
+        Reads a snapshot written by :meth:`dump`. The arrays stored in the
+        snapshot are memory mapped, i.e. they are read-only and only read
+        from disk when they are accessed. The restored entities replace the
+        :attr:`entities` of this energy system and are regrouped using its
+        groupings the next time :attr:`groups` is accessed.
         """
         logging.info(
             "Restoring attributes will overwrite existing attributes.")
@@ -178,9 +525,16 @@ class EnergySystem:
         if filename is None:
             filename = 'es_dump.oemof'
 
-        self.__dict__ = pickle.load(open(os.path.join(dpath, filename), "rb"))
-        msg = ('Attributes restored from: {0}'.format(os.path.join(
-            dpath, filename)))
+        path = os.path.join(dpath, filename)
+        self.edges = Edges()
+        entities, attributes = read_snapshot(path, self.edges)
+        self.entities = entities
+        self._groups = {}
+        self._ungrouped = list(entities)
+        self._deferred = None
+        self.__dict__.update(attributes)
+
+        msg = ('Attributes restored from: {0}'.format(path))
         logging.debug(msg)
         return msg
 
@@ -2,10 +2,10 @@
 """
 try:
     from collections.abc import (Hashable, Iterable, Mapping,
-                                 MutableMapping as MM)
+                                 MutableMapping as MM, MutableSet)
 except ImportError:
     from collections import (Hashable, Iterable, Mapping,
-                             MutableMapping as MM)
+                             MutableMapping as MM, MutableSet)
 from itertools import chain, filterfalse
 
 
@@ -55,6 +55,13 @@ class Grouping:
     :obj:`e`, so one should make sure that user defined :class:`Grouping`
     :obj:`g` is idempotent, i.e. :obj:`g(e, g(e, d)) == g(e, d)`.
 
+    When an :class:`entity <oemof.core.network.Entity>` :obj:`e` is removed
+    from an energy system, :meth:`g.remove(e, groups) <Grouping.remove>` is
+    called to undo what :obj:`g(e, groups)` did. It works like calling
+    :obj:`g` but uses :meth:`unmerge <Grouping.unmerge>` instead of
+    :meth:`merge <Grouping.merge>`. If you supply a custom :obj:`merge`, you
+    probably want to supply a matching :obj:`unmerge` too.
+
     Parameters
     ----------
 
@@ -84,6 +91,10 @@ class Grouping:
 
         Overrides the default behaviour of :meth:`merge <Grouping.merge>`.
 
+    unmerge: callable, optional
+
+        Overrides the default behaviour of :meth:`unmerge <Grouping.unmerge>`.
+
     """
 
     def __init__(self, key=None, constant_key=None, filter=None, **kwargs):
@@ -100,7 +111,7 @@ class Grouping:
                 "Grouping constructor missing required argument: " +
                 "one of `key` or `constant_key`.")
         self.filter = filter
-        for kw in ["value", "merge", "filter"]:
+        for kw in ["value", "merge", "unmerge", "filter"]:
             if kw in kwargs:
                 setattr(self, kw, kwargs[kw])
 
@@ -159,6 +170,19 @@ class Grouping:
                              id(old), old, id(new), new) +
                          "Possibly duplicate uids/labels?")
 
+    def unmerge(self, new, old):
+        """ Remove a :obj:`new` group from a known :obj:`old` one.
+
+        The counterpart to :meth:`merge <Grouping.merge>`, called by
+        :meth:`remove <Grouping.remove>` if there is a value stored under
+        :obj:`group[key(e)]`. Should return what is left of :obj:`old` or
+        :obj:`None` if nothing is, in which case the group is deleted.
+
+        The default deletes the group if :obj:`new` and :obj:`old` are
+        identical and leaves it alone otherwise.
+        """
+        return None if old is new else old
+
     def filter(self, group):
         """
         :func:`Filter <builtins.filter>` the group returned by :meth:`value`
@@ -182,26 +206,66 @@ class Grouping:
             "https://github.com/oemof/oemof/issues\n")
 
 
-    def __call__(self, e, d):
-        k = self.key(e) if callable(self.key) else self.key
-        if k is None:
-            return
+    def _filtered_value(self, e):
+        """ Return :meth:`value(e) <Grouping.value>` run through the filter.
+
+        Returns :obj:`None` if the whole value got filtered out.
+        """
         v = self.value(e)
         if isinstance(v, MM):
-            for k in list(filterfalse(self.filter, v)):
-                v.pop(k)
+            for key in list(filterfalse(self.filter, v)):
+                v.pop(key)
         elif isinstance(v, Mapping):
-            v = type(v)((k, v[k]) for k in v if self.filter(k))
+            v = type(v)((key, v[key]) for key in v if self.filter(key))
         elif isinstance(v, Iterable):
             v = type(v)(filter(self.filter, v))
         elif self.filter and not self.filter(v):
+            return None
+        return v
+
+    def __call__(self, e, d):
+        k = self.key(e) if callable(self.key) else self.key
+        if k is None:
+            return
+        v = self._filtered_value(e)
+        if not v:
+            return
+        stored = False
+        for group in (k if (isinstance(k, Iterable) and not
+                            isinstance(k, Hashable))
+                        else [k]):
+            if group in d:
+                d[group] = self.merge(v, d[group])
+            elif not stored:
+                d[group] = v
+                stored = True
+            else:
+                # Groups may be updated in place by :meth:`merge`, so each
+                # new group needs a value of its own.
+                d[group] = self._filtered_value(e)
+
+    def remove(self, e, d):
+        """ Remove whatever calling :obj:`self(e, d)` put into :obj:`d`.
+
+        Note that this has to be called before :obj:`e` is modified or
+        disconnected, as the groups to remove :obj:`e` from are determined
+        the same way they were determined when adding it.
+        """
+        k = self.key(e) if callable(self.key) else self.key
+        if k is None:
             return
+        v = self._filtered_value(e)
         if not v:
             return
         for group in (k if (isinstance(k, Iterable) and not
                             isinstance(k, Hashable))
                         else [k]):
-            d[group] = (self.merge(v, d[group]) if group in d else v)
+            if group in d:
+                rest = self.unmerge(v, d[group])
+                if rest:
+                    d[group] = rest
+                else:
+                    del d[group]
 
 
 class Nodes(Grouping):
@@ -220,9 +284,25 @@ class Nodes(Grouping):
         """
         :meth:`Updates <set.update>` :obj:`old` to be the union of :obj:`old`
         and :obj:`new`.
+
+        This is done in place if :obj:`old` is mutable, so that adding
+        members to a group one by one doesn't copy the whole group every time.
         """
+        if isinstance(old, MutableSet):
+            old.update(new)
+            return old
         return old.union(new)
 
+    def unmerge(self, new, old):
+        """
+        Removes the members of :obj:`new` from :obj:`old`, in place if
+        :obj:`old` is mutable.
+        """
+        if isinstance(old, MutableSet):
+            old.difference_update(new)
+            return old
+        return old.difference(new)
+
 
 class Flows(Nodes):
     """
@@ -242,6 +322,10 @@ class Flows(Nodes):
         flows = set(chain(n.outputs.values(), n.inputs.values()))
         super().__call__(flows, d)
 
+    def remove(self, n, d):
+        flows = set(chain(n.outputs.values(), n.inputs.values()))
+        super().remove(flows, d)
+
 
 class FlowsWithNodes(Nodes):
     """
@@ -258,11 +342,87 @@ class FlowsWithNodes(Nodes):
         """
         return set(tuples)
 
-    def __call__(self, n, d):
-        tuples = set(chain(
+    @staticmethod
+    def tuples(n):
+        """ Returns the :class:`set` of :obj:`(source, target, flow)` tuples
+        of all flows connected to :obj:`n`.
+        """
+        return set(chain(
             ((n, t, f) for (t, f) in n.outputs.items()),
             ((s, n, f) for (s, f) in n.inputs.items())))
-        super().__call__(tuples, d)
+
+    def __call__(self, n, d):
+        super().__call__(self.tuples(n), d)
+
+    def remove(self, n, d):
+        super().remove(self.tuples(n), d)
+
+
+class Fused:
+    """
+    Runs several :class:`FlowsWithNodes` groupings in a single pass.
+
+    Calling :obj:`fused(n, d)` enumerates the flows connected to :obj:`n`
+    only once via :meth:`FlowsWithNodes.tuples` and then hands the resulting
+    tuples to each of the fused groupings, which compute their keys, values,
+    filters and merges as usual. The result is the same as calling each of
+    the groupings on their own.
+
+    You don't need to create instances of this yourself. :func:`fuse` is
+    used by :class:`energy systems <oemof.energy_system.EnergySystem>` to
+    combine all eligible groupings automatically.
+
+    Parameters
+    ----------
+
+    groupings: iterable of :class:`FlowsWithNodes`
+        The groupings to run in one pass.
+    """
+    def __init__(self, groupings):
+        self.groupings = list(groupings)
+
+    def __call__(self, n, d):
+        tuples = FlowsWithNodes.tuples(n)
+        for g in self.groupings:
+            Grouping.__call__(g, tuples, d)
+
+    def remove(self, n, d):
+        tuples = FlowsWithNodes.tuples(n)
+        for g in self.groupings:
+            Grouping.remove(g, tuples, d)
+
+
+def fuse(groupings):
+    """ Combine all fusable groupings in :obj:`groupings` into one.
+
+    A grouping is fusable if it is an instance of :class:`FlowsWithNodes`
+    which overrides neither :meth:`__call__ <FlowsWithNodes.__call__>` nor
+    :meth:`remove <FlowsWithNodes.remove>`. So in
+    order to have a custom grouping join the fused pass, create it as a
+    :class:`FlowsWithNodes` instance or subclass :class:`FlowsWithNodes` and
+    only override :meth:`key <Grouping.key>`, :meth:`value
+    <FlowsWithNodes.value>`, :meth:`filter <Grouping.filter>`, :meth:`merge
+    <Nodes.merge>` or :meth:`unmerge <Nodes.unmerge>`.
+
+    The fused grouping takes the place of the first fusable grouping in the
+    returned list. All other groupings are returned unchanged and in order.
+    If there are less than two fusable groupings, :obj:`groupings` is
+    returned as a new list but otherwise unchanged.
+    """
+    groupings = list(groupings)
+    fusable = [g for g in groupings
+               if isinstance(g, FlowsWithNodes) and
+               type(g).__call__ is FlowsWithNodes.__call__ and
+               type(g).remove is FlowsWithNodes.remove]
+    if len(fusable) < 2:
+        return groupings
+    result = []
+    for g in groupings:
+        if g is fusable[0]:
+            result.append(Fused(fusable))
+        elif not any(g is f for f in fusable):
+            result.append(g)
+    return result
 
 
 def _uid_or_str(node_or_entity):
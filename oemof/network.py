@@ -1,5 +1,10 @@
+from array import array
 from functools import total_ordering
-from weakref import WeakKeyDictionary as WKD, WeakSet as WS
+from itertools import accumulate, chain
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 """
 This package (along with its subpackages) contains the classes used to model
 energy systems. An energy system is modelled as a graph/network of entities
@@ -9,26 +14,263 @@ connected.
 """
 
 
-class _Edges():
-    """ Internal utility class keeping track of known edges.
+class _Removed:
+    """ Marks removed edges in the flow table of :class:`Edges`.
+    """
+    def __reduce__(self):
+        return "_REMOVED"
+
+
+_REMOVED = _Removed()
+
+
+class Edges:
+    """ A compact adjacency index of the edges (i.e. flows) between nodes.
+
+    Every :class:`energy system <oemof.energy_system.EnergySystem>` owns one
+    of these as its :attr:`edges <oemof.energy_system.EnergySystem.edges>`
+    attribute and every :class:`Node` created while an energy system is the
+    :attr:`registry <Node.registry>` records its flows there. Nodes created
+    without a registry get an index of their own.
+
+    Nodes are numbered consecutively in the order in which they are first
+    seen. Edges are stored in a flow table consisting of parallel source,
+    target and flow columns. Lookups by node go through CSR style offset
+    arrays for outgoing and incoming edges, which are rebuilt lazily once
+    enough edges have been added since the last rebuild. Edges added in
+    between are kept in small per node lists, so interleaving additions and
+    lookups stays cheap. Removed edges are marked as such in the flow table
+    and skipped until the next rebuild drops them from the offset arrays.
+
+    You usually don't need to use this class directly. Flows are added by
+    passing `inputs` or `outputs` to a :class:`Node` and read through the
+    views returned by :attr:`Node.inputs` and :attr:`Node.outputs`.
+
+    Examples
+    --------
+    >>> edges = Edges()
+    >>> edges.add("a", "b", "a -> b")
+    >>> len(edges)
+    1
+    >>> edges.flow("a", "b")
+    'a -> b'
+    >>> list(edges)
+    [('a', 'b', 'a -> b')]
+    >>> edges.remove("a", "b")
+    >>> len(edges)
+    0
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._nodes = []
+        self._sources = array('l')
+        self._targets = array('l')
+        self._flows = []
+        self._edges = {}
+        self._compacted = 0
+        self._stale = 0
+        self._offsets = {True: array('l', [0]), False: array('l', [0])}
+        self._csr = {True: array('l'), False: array('l')}
+        self._pending = {True: {}, False: {}}
+
+    def _id(self, node):
+        """ Return the integer id of `node`, assigning a new one if needed.
+        """
+        i = self._ids.get(id(node))
+        if i is None:
+            i = self._ids[id(node)] = len(self._nodes)
+            self._nodes.append(node)
+        return i
+
+    def add(self, source, target, flow=None):
+        """ Add (or replace) the `flow` from `source` into `target`.
+        """
+        key = (self._id(source), self._id(target))
+        edge = self._edges.get(key)
+        if edge is not None:
+            self._flows[edge] = flow
+            return
+        edge = self._edges[key] = len(self._flows)
+        self._sources.append(key[0])
+        self._targets.append(key[1])
+        self._flows.append(flow)
+        self._pending[True].setdefault(key[0], []).append(edge)
+        self._pending[False].setdefault(key[1], []).append(edge)
+
+    def remove(self, source, target):
+        """ Remove the flow from `source` into `target`.
+
+        Raises a :class:`KeyError` if there is no such flow.
+        """
+        try:
+            key = (self._ids[id(source)], self._ids[id(target)])
+            edge = self._edges.pop(key)
+        except KeyError:
+            raise KeyError((source, target))
+        self._flows[edge] = _REMOVED
+        self._stale += 1
+
+    def remove_node(self, node):
+        """ Remove `node` and all flows from or into it from the index.
+
+        Does nothing if `node` isn't part of the index.
+        """
+        i = self._ids.get(id(node))
+        if i is None:
+            return
+        nodes = self._nodes
+        for edge in self._adjacent(i, True):
+            self.remove(node, nodes[self._targets[edge]])
+        for edge in self._adjacent(i, False):
+            self.remove(nodes[self._sources[edge]], node)
+        del self._ids[id(node)]
+        nodes[i] = None
+
+    def flow(self, source, target):
+        """ Return the flow from `source` into `target`.
+
+        Raises a :class:`KeyError` if there is no such flow.
+        """
+        try:
+            key = (self._ids[id(source)], self._ids[id(target)])
+            return self._flows[self._edges[key]]
+        except KeyError:
+            raise KeyError((source, target))
+
+    def _compact(self):
+        """ Rebuild the offset arrays from the whole flow table.
+        """
+        size = len(self._nodes)
+        live = [e for e, f in enumerate(self._flows) if f is not _REMOVED]
+        for outgoing, ends in ((True, self._sources), (False, self._targets)):
+            counts = [0] * (size + 1)
+            for edge in live:
+                counts[ends[edge] + 1] += 1
+            offsets = array('l', accumulate(counts))
+            positions = offsets[:-1].tolist()
+            csr = array('l', bytes(len(live) * array('l').itemsize))
+            for edge in live:
+                node = ends[edge]
+                csr[positions[node]] = edge
+                positions[node] += 1
+            self._offsets[outgoing] = offsets
+            self._csr[outgoing] = csr
+            self._pending[outgoing] = {}
+        self._compacted = len(self._flows)
+        self._stale = 0
+
+    def _adjacent(self, node, outgoing):
+        """ Return the edges leaving (or entering) the node with id `node`.
+        """
+        if (len(self._flows) > 2 * self._compacted or
+                self._stale > len(self._edges) // 4):
+            self._compact()
+        offsets = self._offsets[outgoing]
+        edges = (self._csr[outgoing][offsets[node]:offsets[node + 1]]
+                 if node + 1 < len(offsets) else ())
+        pending = self._pending[outgoing].get(node)
+        if pending is not None:
+            edges = list(edges) + pending
+        if self._stale:
+            flows = self._flows
+            edges = [e for e in edges if flows[e] is not _REMOVED]
+        return edges
+
+    def __len__(self):
+        return len(self._edges)
+
+    def __iter__(self):
+        """ Iterate over all `(source, target, flow)` triples.
+        """
+        nodes = self._nodes
+        return ((nodes[s], nodes[t], f) for s, t, f in
+                zip(self._sources, self._targets, self._flows)
+                if f is not _REMOVED)
+
+
+class _Neighbours(Mapping):
+    """ Read-only view mapping the neighbours of a node to flows.
+
+    Instances are returned by :attr:`Node.inputs` and :attr:`Node.outputs`.
+    They are backed by the node's :class:`Edges` index, so creating them is
+    cheap and they always reflect the current state of the index.
+    """
+
+    __slots__ = ("_index", "_node", "_outgoing")
+
+    def __init__(self, index, node, outgoing):
+        self._index = index
+        self._node = index._id(node)
+        self._outgoing = outgoing
+
+    def __getitem__(self, neighbour):
+        index = self._index
+        try:
+            other = index._ids[id(neighbour)]
+            key = ((self._node, other) if self._outgoing
+                   else (other, self._node))
+            return index._flows[index._edges[key]]
+        except KeyError:
+            raise KeyError(neighbour)
+
+    def __contains__(self, neighbour):
+        index = self._index
+        other = index._ids.get(id(neighbour))
+        if other is None:
+            return False
+        return ((self._node, other) if self._outgoing
+                else (other, self._node)) in index._edges
+
+    def __iter__(self):
+        index = self._index
+        nodes = index._nodes
+        ends = index._targets if self._outgoing else index._sources
+        return (nodes[ends[e]]
+                for e in index._adjacent(self._node, self._outgoing))
+
+    def __len__(self):
+        return len(self._index._adjacent(self._node, self._outgoing))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def _connect(source, target, flow):
+    """ Record `flow` from `source` into `target` in the indices of both.
+    """
+    source._edges.add(source, target, flow)
+    if target._edges is not source._edges:
+        target._edges.add(source, target, flow)
+
+
+def _disconnect(source, target):
+    """ Remove the flow from `source` into `target` from both indices.
+    """
+    source._edges.remove(source, target)
+    if target._edges is not source._edges:
+        target._edges.remove(source, target)
 
-    As this is currently quite dirty and hackish, it should be treated as an
-    internal implementation detail with an unstable interface. Maye it can be
-    converted to a fully fledged useful :python:`Edge` class later on, but for
-    now it simply hides most of the dirty secrets of the :class:`Node` class.
 
+class _Flows:
+    """ Compatibility layer mimicking the former global `flow` registry.
+
+    Reading from it and assigning to it is forwarded to the :class:`Edges`
+    index of the nodes involved, i.e. :python:`flow[s, t] = f` connects `s`
+    to `t` via `f`, :python:`del flow[s, t]` removes that connection again,
+    :python:`flow(s)` returns :python:`s.outputs` and :python:`flow(s, t)`
+    returns :python:`s.outputs[t]`.
     """
-    _in_edges = WKD()
-    _flows = WKD()
-    def __getitem__(self, key):
-        self._flows[key] = self._flows.get(key, WKD())
-        return self._flows[key]
+    def __getitem__(self, source):
+        return source.outputs
+
     def __setitem__(self, key, value):
         source, target = key
-        self._in_edges[target] = self._in_edges.get(target, WS())
-        self._in_edges[target].add(source)
-        self._flows[source] = self._flows.get(source, WKD())
-        self._flows[source][target] = value
+        _connect(source, target, value)
+
+    def __delitem__(self, key):
+        source, target = key
+        _disconnect(source, target)
 
     def __call__(self, *keys):
         result = self
@@ -37,7 +279,7 @@ class _Edges():
         return result
 
 
-flow = _Edges()
+flow = _Flows()
 
 @total_ordering
 class Node:
@@ -78,52 +320,60 @@ class Node:
         If this node was given a `label` on construction, this attribute holds
         the actual object passed as a parameter. Otherwise py:``node.label`` is
         a synonym for ``str(node)``.
-    inputs: dict
-        Dictionary mapping input :class:`Node`s `n` to flows from `n` into
+    inputs: :class:`Mapping <collections.abc.Mapping>`
+        Read-only mapping of input :class:`Node`s `n` to flows from `n` into
         `self`.
-    outputs: dict
-        Dictionary mapping output :class:`Node`s `n` to flows from `self` into
-        `n`.
+    outputs: :class:`Mapping <collections.abc.Mapping>`
+        Read-only mapping of output :class:`Node`s `n` to flows from `self`
+        into `n`.
 
     """
 
-    # TODO: Doing this _state/__getstate__/__setstate__ dance is
-    #       necessary to fix issues #186 and #203. But there must be
-    #       some more elegant solution. So in the long run, either this,
-    #       or dump/restore should be refactored so that storing the
-    #       initialization arguments is not necessary.
-    #       The culprit seems to be that inputs/outputs are actually
-    #       stored in the `_Edge` class and pickle can't make that jump.
-    #       But more sophisticated research and minimal test cases are
-    #       needed to confirm that.
-
     registry = None
-    __slots__ = ["__weakref__", "_label", "_state"]
+    __slots__ = ["__weakref__", "_edges", "_label"]
 
     def __init__(self, *args, **kwargs):
-        self._state = (args, kwargs)
-        self.__setstate__(self._state)
+        self.__setstate__((args, kwargs))
         if __class__.registry is not None:
             __class__.registry.add(self)
 
     def __getstate__(self):
-        return self._state
+        # The flows of a node live in an `Edges` index which isn't pickled
+        # along with it, so they are recorded as they currently are,
+        # alongside the attributes of subclasses.
+        kwargs = {'inputs': dict(self.inputs), 'outputs': dict(self.outputs)}
+        if hasattr(self, '_label'):
+            kwargs['label'] = self._label
+        return ((), kwargs, getattr(self, '__dict__', None))
 
     def __setstate__(self, state):
-        args, kwargs = state
+        args, kwargs = state[:2]
+        if not hasattr(self, '_edges'):
+            self._edges = getattr(__class__.registry, 'edges', None)
+            if self._edges is None:
+                self._edges = Edges()
         for optional in ['label']:
             if optional in kwargs:
                 setattr(self, '_' + optional, kwargs[optional])
+        # While unpickling, neighbours might not have been set up yet, in
+        # which case they get to share the index of this node.
+        for n in chain(kwargs.get('inputs', ()), kwargs.get('outputs', ())):
+            if not hasattr(n, '_edges'):
+                n._edges = self._edges
         for i in kwargs.get('inputs', {}):
             try:
-                flow[i, self] = kwargs['inputs'].get(i)
+                f = kwargs['inputs'].get(i)
             except AttributeError:
-                flow[i, self] = None
+                f = None
+            _connect(i, self, f)
         for o in kwargs.get('outputs', {}):
             try:
-                flow[self, o] = kwargs['outputs'].get(o)
+                f = kwargs['outputs'].get(o)
             except AttributeError:
-                flow[self, o] = None
+                f = None
+            _connect(self, o, f)
+        if len(state) > 2 and state[2]:
+            self.__dict__.update(state[2])
 
     def __eq__(self, other):
         return id(self) == id(other)
@@ -145,16 +395,15 @@ class Node:
 
     @property
     def inputs(self):
-        # TODO: Accessing :class:`Flow`'s `_in_edges` is kinda ugly.
-        #       Find a way to replace it.
-        #       This can also have unintuitive behaviour since adding new
-        #       associations to the returned mapping will NOT add a new input
-        #       flow to this node.
-        return {k: flow(k, self) for k in flow._in_edges.get(self, ())}
+        """ Read-only view mapping input nodes to flows into `self`.
+        """
+        return _Neighbours(self._edges, self, False)
 
     @property
     def outputs(self):
-        return flow(self)
+        """ Read-only view mapping output nodes to flows out of `self`.
+        """
+        return _Neighbours(self._edges, self, True)
 
 
 class Bus(Node):
@@ -5,6 +5,11 @@
 from oemof.solph.network import (Sink, Source, LinearTransformer, Storage, Bus,
                                  Flow, EnergySystem)
 from oemof.solph.models import OperationalModel
+from oemof.solph.sparse import SparseOperationalModel
+from oemof.solph.session import SolverSession
+from oemof.solph.rolling import ParallelWindows, RollingHorizon
+from oemof.solph.aggregation import AdaptiveResolution, TypicalPeriods
+from oemof.solph.decomposition import ADMM, Benders, Components
 from oemof.solph.groupings import GROUPINGS
 from oemof.solph.options import (Investment, BinaryFlow, DiscreteFlow)
-from oemof.solph.plumbing import NodesFromCSV
+from oemof.solph.plumbing import NodesFromCSV, NodesFromTables
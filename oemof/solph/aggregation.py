@@ -0,0 +1,566 @@
+# -*- coding: utf-8 -*-
+"""Aggregating time horizons into typical periods or longer timesteps.
+
+The periods of a horizon, e.g. its days, are clustered by the time series
+of the energy system. The model is then only built for one representative
+period of each cluster, weighted by the number of periods in the cluster.
+
+Alternatively, consecutive timesteps in which the time series hardly change
+are merged into longer ones.
+
+"""
+
+from collections import UserDict, UserList
+from contextlib import contextmanager
+
+import numpy as np
+
+from .models import OperationalModel
+from .network import Bus, Flow, LinearTransformer, Storage
+from .plumbing import Sequence
+from .sparse import _series
+
+#: The time dependent attributes of flows and storages clustered by
+#: :class:`TypicalPeriods`.
+PROFILES = ((Flow, ('actual_value', 'min', 'max', 'variable_costs',
+                    'positive_gradient', 'negative_gradient')),
+            (Storage, ('capacity_loss', 'inflow_conversion_factor',
+                       'outflow_conversion_factor', 'capacity_max',
+                       'capacity_min')))
+
+
+def _sequences(es):
+    """ Yields the time series of `es` listed in :const:`PROFILES` and the
+    conversion factors of linear transformers.
+
+    Each series comes as a triple of its owner, its key and itself, where
+    the owner is either the object having the series as the attribute
+    named by the key, or the dictionary of conversion factors having it as
+    the item of the key.
+    """
+    objects = list(es.nodes) + [f for n in es.nodes
+                                for f in n.outputs.values()]
+    for obj in objects:
+        for cls, attributes in PROFILES:
+            if isinstance(obj, cls):
+                for attribute in attributes:
+                    yield obj, attribute, getattr(obj, attribute)
+        if isinstance(obj, LinearTransformer):
+            for target, sequence in obj.conversion_factors.items():
+                yield obj.conversion_factors, target, sequence
+
+
+def _profiles(es, timesteps):
+    """ Returns the values of all time series of `es` at `timesteps`, one
+    row per series, scaled to the range from 0 to 1.
+
+    Constant series and series without values are skipped.
+    """
+    sequences = {id(sequence): sequence
+                 for _, _, sequence in _sequences(es)}
+
+    rows = []
+    for sequence in sequences.values():
+        if getattr(sequence, 'is_constant', True):
+            continue
+        values = _series(sequence, timesteps)
+        if np.isnan(values).any():
+            continue
+        low, high = values.min(), values.max()
+        if high > low:
+            rows.append((values - low) / (high - low))
+    return np.array(rows).reshape(len(rows), len(timesteps))
+
+
+def _distances(a, b):
+    """ Returns the squared euclidean distances between the rows of `a` and
+    `b`.
+    """
+    distances = ((a ** 2).sum(axis=1)[:, None] + (b ** 2).sum(axis=1) -
+                 2 * np.dot(a, b.T))
+    return np.maximum(distances, 0)
+
+
+def _seeds(features, k, random_state):
+    """ Picks `k` initial centers among the rows of `features` by k-means++.
+    """
+    seeds = [random_state.randint(len(features))]
+    closest = _distances(features, features[seeds])[:, 0]
+    for _ in range(1, k):
+        total = closest.sum()
+        if total == 0:
+            seeds.append(int(np.flatnonzero(~np.isin(
+                np.arange(len(features)), seeds))[0]))
+        else:
+            seeds.append(int(random_state.choice(len(features),
+                                                 p=closest / total)))
+        closest = np.minimum(closest, _distances(
+            features, features[seeds[-1:]])[:, 0])
+    return seeds
+
+
+def _representatives(features, labels, k):
+    """ Returns the rows of `features` closest to the mean of their cluster.
+    """
+    representatives = []
+    for cluster in range(k):
+        members = np.flatnonzero(labels == cluster)
+        mean = features[members].mean(axis=0, keepdims=True)
+        representatives.append(int(members[np.argmin(
+            _distances(features[members], mean)[:, 0])]))
+    return representatives
+
+
+def kmeans(features, k, random_state, iterations=100):
+    """ Clusters the rows of `features` into `k` clusters by k-means.
+
+    Returns the cluster of each row and the row representing each cluster,
+    which is the one closest to the cluster's mean.
+    """
+    centers = features[_seeds(features, k, random_state)]
+    labels = None
+    for _ in range(iterations):
+        update = np.argmin(_distances(features, centers), axis=1)
+        if labels is not None and (update == labels).all():
+            break
+        labels = update
+        for cluster in range(k):
+            members = labels == cluster
+            if members.any():
+                centers[cluster] = features[members].mean(axis=0)
+    # renumber the clusters to drop empty ones
+    _, labels = np.unique(labels, return_inverse=True)
+    k = labels.max() + 1
+    return labels, _representatives(features, labels, k)
+
+
+def kmedoids(features, k, random_state, iterations=100):
+    """ Clusters the rows of `features` into `k` clusters by k-medoids.
+
+    Returns the cluster of each row and the medoid of each cluster, the row
+    with the least sum of distances to the other rows of its cluster.
+    """
+    distances = _distances(features, features)
+    medoids = np.array(_seeds(features, k, random_state))
+    for _ in range(iterations):
+        labels = np.argmin(distances[:, medoids], axis=1)
+        update = medoids.copy()
+        for cluster in range(k):
+            members = np.flatnonzero(labels == cluster)
+            if not len(members):
+                continue
+            update[cluster] = members[np.argmin(
+                distances[np.ix_(members, members)].sum(axis=1))]
+        if (update == medoids).all():
+            break
+        medoids = update
+    labels = np.argmin(distances[:, medoids], axis=1)
+    # renumber the clusters to drop empty ones
+    used, labels = np.unique(labels, return_inverse=True)
+    return labels, [int(m) for m in medoids[used]]
+
+
+def hierarchical(features, k, random_state=None):
+    """ Clusters the rows of `features` into `k` clusters by agglomerative
+    clustering with Ward's linkage.
+
+    Returns the cluster of each row and the row representing each cluster,
+    which is the one closest to the cluster's mean.
+    """
+    distances = _distances(features, features)
+    np.fill_diagonal(distances, np.inf)
+    sizes = np.ones(len(features))
+    labels = np.arange(len(features))
+    active = np.ones(len(features), dtype=bool)
+    for _ in range(len(features) - k):
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        # Lance-Williams update of the distances to the merged cluster
+        merged = ((sizes + sizes[i]) * distances[i] +
+                  (sizes + sizes[j]) * distances[j] -
+                  sizes * distances[i, j]) / (sizes + sizes[i] + sizes[j])
+        distances[i], distances[:, i] = merged, merged
+        distances[i, i] = np.inf
+        distances[j], distances[:, j] = np.inf, np.inf
+        sizes[i] += sizes[j]
+        active[j] = False
+        labels[labels == j] = i
+        distances[~active, i] = distances[i, ~active] = np.inf
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels, _representatives(features, labels, labels.max() + 1)
+
+
+#: The clustering methods available for :class:`TypicalPeriods`.
+METHODS = {'kmeans': kmeans, 'kmedoids': kmedoids,
+           'hierarchical': hierarchical}
+
+
+class TypicalPeriods:
+    r""" Solves an energy system on typical periods instead of its whole
+    horizon.
+
+    The horizon is split into periods of `period_length` timesteps, which
+    are clustered by the time series of all flows, storages and
+    transformers. One period of each cluster represents it in the model,
+    where its costs are weighted by the number of periods in the cluster,
+    as are the summed limits of flows. Storages are linked over the
+    sequence of the periods of the horizon, see the `period_sequence` of
+    :class:`.OperationalModel`, so that they can shift energy between
+    periods, e.g. between seasons.
+
+    Parameters
+    ----------
+    es : EnergySystem object
+        The energy system to solve.
+    k : int
+        The number of typical periods.
+    period_length : int
+        The number of timesteps of a period, e.g. 24 for typical days of an
+        hourly time index. It has to divide the number of timesteps.
+    method : str
+        The clustering method, one of :const:`METHODS`.
+    seed : int (optional)
+        Seed of the random initialisation of k-means and k-medoids.
+    link_storages : bool
+        Whether to link storages over the periods of the horizon. Otherwise
+        they wrap around within each representative period.
+    model : class
+        The model to build, :class:`.OperationalModel` or
+        :class:`.SparseOperationalModel`.
+    \**kwargs :
+        Further arguments for the model.
+
+    Attributes
+    ----------
+    labels : numpy.ndarray
+        The typical period of each period of the horizon.
+    representatives : list
+        The period of the horizon representing each typical period.
+    weights : numpy.ndarray
+        The number of periods represented by each typical period.
+
+    Examples
+    --------
+    Sizing storages on eight typical days:
+
+    >>> tp = TypicalPeriods(es, k=8)  # doctest: +SKIP
+    >>> tp.solve(solver='cbc')  # doctest: +SKIP
+    >>> len(es.results[bel][demand]) == len(es.timeindex)  # doctest: +SKIP
+    True
+    """
+    def __init__(self, es, k, period_length=24, method='kmedoids', seed=None,
+                 link_storages=True, model=OperationalModel, **kwargs):
+        horizon = len(es.timeindex)
+        if horizon % period_length:
+            raise ValueError(
+                "The period length has to divide the {} timesteps.".format(
+                    horizon))
+        if method not in METHODS:
+            raise ValueError("Unknown clustering method: {!r}".format(method))
+        count = horizon // period_length
+        self.es = es
+        self.period_length = period_length
+        self.link_storages = link_storages
+        self.model = model
+        self.kwargs = kwargs
+
+        features = (_profiles(es, range(horizon))
+                    .reshape(-1, count, period_length)
+                    .transpose(1, 0, 2).reshape(count, -1))
+        labels, representatives = METHODS[method](
+            features, min(k, count), np.random.RandomState(seed))
+        # number the typical periods in the order they occur in
+        order = np.argsort(representatives)
+        self.representatives = [representatives[c] for c in order]
+        self.labels = np.argsort(order)[labels]
+        self.weights = np.bincount(self.labels,
+                                   minlength=len(self.representatives))
+
+    def periods(self):
+        """ Returns the timesteps of the representative periods.
+        """
+        return [list(range(p * self.period_length,
+                           (p + 1) * self.period_length))
+                for p in self.representatives]
+
+    def objective_weighting(self):
+        """ Returns the weights of all timesteps of the horizon, which are
+        the weights of the typical periods for the timesteps of their
+        representatives and zero elsewhere.
+        """
+        weighting = np.zeros(len(self.es.timeindex))
+        for period, weight in zip(self.periods(), self.weights):
+            weighting[period] = weight
+        return weighting
+
+    def build(self):
+        """ Builds the model of the typical periods.
+        """
+        kwargs = dict(self.kwargs)
+        if self.link_storages:
+            kwargs.setdefault('period_sequence', self.labels)
+        return self.model(self.es, periods=self.periods(),
+                          objective_weighting=self.objective_weighting(),
+                          **kwargs)
+
+    def expand(self, results):
+        """ Expands the `results` of the model of the typical periods to
+        the whole horizon, where each period takes the values of the
+        period representing it.
+
+        The capacities of storages linked over the periods are the sum of
+        the inter-period state of each period, reduced by the losses, and
+        the intra-period states of its representative.
+        """
+        length = len(self.representatives) * self.period_length
+        expanded = UserDict()
+        for i, outputs in results.items():
+            expanded[i] = UserDict()
+            for o, values in outputs.items():
+                if len(values) == length:
+                    typical = np.reshape(values, (-1, self.period_length))
+                    levels = typical[self.labels]
+                    if hasattr(values, 'inter_capacity'):
+                        decay = np.cumprod([
+                            1 - _series(i.capacity_loss, period)
+                            for period in self.periods()], axis=1)
+                        levels = levels + (
+                            np.reshape(values.inter_capacity, (-1, 1)) *
+                            decay[self.labels])
+                    expanded[i][o] = UserList(levels.ravel().tolist())
+                    expanded[i][o].__dict__.update(
+                        (key, value) for key, value
+                        in getattr(values, '__dict__', {}).items()
+                        if key != 'data')
+                else:
+                    expanded[i][o] = values
+        expanded.__dict__.update((key, value)
+                                 for key, value in vars(results).items()
+                                 if key != 'data')
+        return expanded
+
+    def solve(self, solver='glpk', solver_io='lp', **kwargs):
+        r""" Builds and solves the model of the typical periods and stores
+        its results, expanded to the whole horizon, in the energy system.
+
+        The objective is the one of the weighted model.
+
+        Parameters
+        ----------
+        solver : string
+        solver_io : string
+        \**kwargs :
+            See :meth:`.OperationalModel.solve`.
+        """
+        model = self.build()
+        model.solve(solver=solver, solver_io=solver_io, **kwargs)
+        self.es.results = self.expand(self.es.results)
+        return self.es.results
+
+
+#: How the time series named here are merged over the timesteps of a
+#: segment by :class:`AdaptiveResolution`. All others are averaged,
+#: weighted by the timeincrement.
+MERGING = {'capacity_loss': 'compound', 'positive_gradient': 'sum',
+           'negative_gradient': 'sum'}
+
+
+def _segment(profiles, tolerance, max_length=None):
+    """ Splits the timesteps, the columns of `profiles`, into segments of
+    consecutive timesteps in which no profile spans more than `tolerance`,
+    and returns the first timestep of each segment.
+    """
+    starts = [0]
+    low = high = profiles[:, 0]
+    for t in range(1, profiles.shape[1]):
+        values = profiles[:, t]
+        lower, higher = np.minimum(low, values), np.maximum(high, values)
+        spread = higher - lower
+        if ((spread.size and spread.max() > tolerance) or
+                (max_length is not None and t - starts[-1] >= max_length)):
+            starts.append(t)
+            low = high = values
+        else:
+            low, high = lower, higher
+    return np.array(starts)
+
+
+class AdaptiveResolution:
+    r""" Solves an energy system on a coarser time grid, where consecutive
+    timesteps in which the time series hardly change are merged.
+
+    The time series of all flows, storages and transformers are scaled to
+    the range from 0 to 1, and a new segment of timesteps is started
+    whenever one of them would span more than `tolerance` within the
+    current segment. The model is built for the first timestep of each
+    segment, with the timeincrement of the whole segment. The time series
+    are merged over the segments while the model is built, see
+    :const:`MERGING`, so that e.g. the losses of storages and the gradients
+    of flows are those of the whole segment.
+
+    Parameters
+    ----------
+    es : EnergySystem object
+        The energy system to solve.
+    tolerance : float
+        The largest change of a scaled time series within a segment.
+    max_length : int (optional)
+        The largest number of timesteps of a segment.
+    model : class
+        The model to build, :class:`.OperationalModel` or
+        :class:`.SparseOperationalModel`.
+    \**kwargs :
+        Further arguments for the model. A `timeincrement` is the one of the
+        original timesteps.
+
+    Attributes
+    ----------
+    starts : numpy.ndarray
+        The first timestep of each segment.
+    lengths : numpy.ndarray
+        The number of timesteps of each segment.
+
+    Examples
+    --------
+    Keeping the peaks in hourly detail, while merging calm nights:
+
+    >>> ar = AdaptiveResolution(es, tolerance=0.05)  # doctest: +SKIP
+    >>> ar.solve(solver='cbc')  # doctest: +SKIP
+    >>> len(es.results[bel][demand]) == len(es.timeindex)  # doctest: +SKIP
+    True
+    """
+    def __init__(self, es, tolerance=0.1, max_length=None,
+                 model=OperationalModel, **kwargs):
+        if max_length is not None and max_length < 1:
+            raise ValueError("Segments need at least one timestep.")
+        self.es = es
+        self.model = model
+        horizon = len(es.timeindex)
+        self.increments = _series(Sequence(kwargs.pop(
+            'timeincrement', es.timeindex.freq.nanos / 3.6e12)),
+            range(horizon))
+        self.kwargs = kwargs
+
+        self.starts = _segment(_profiles(es, range(horizon)), tolerance,
+                               max_length)
+        self.lengths = np.diff(np.append(self.starts, horizon))
+
+    def timeincrement(self):
+        """ Returns the timeincrements of all timesteps, where those of the
+        first timesteps of the segments are summed over the segments.
+        """
+        increments = self.increments.copy()
+        increments[self.starts] = np.add.reduceat(self.increments,
+                                                  self.starts)
+        return increments
+
+    def _merge(self, values, how):
+        """ Returns the `values` of all timesteps, where those of the first
+        timesteps of the segments are merged over the segments `how` it is
+        given in :const:`MERGING`.
+        """
+        merged = values.copy()
+        if how == 'compound':
+            merged[self.starts] = 1 - np.multiply.reduceat(1 - values,
+                                                           self.starts)
+        elif how == 'sum':
+            merged[self.starts] = np.add.reduceat(values, self.starts)
+        else:
+            merged[self.starts] = (
+                np.add.reduceat(values * self.increments, self.starts) /
+                np.add.reduceat(self.increments, self.starts))
+        return merged
+
+    @contextmanager
+    def merged(self):
+        """ Replaces the time series of the energy system by the ones merged
+        over the segments, and restores them when leaving the context.
+        """
+        replaced = []
+        horizon = range(len(self.es.timeindex))
+        for owner, key, sequence in list(_sequences(self.es)):
+            values = _series(sequence, horizon)
+            how = MERGING.get(key)
+            if np.isnan(values).any() or (
+                    how is None and getattr(sequence, 'is_constant', True)):
+                continue
+            merged = Sequence(self._merge(values, how))
+            replaced.append((owner, key, sequence))
+            if isinstance(owner, dict):
+                owner[key] = merged
+            else:
+                setattr(owner, key, merged)
+        try:
+            yield
+        finally:
+            for owner, key, sequence in reversed(replaced):
+                if isinstance(owner, dict):
+                    owner[key] = sequence
+                else:
+                    setattr(owner, key, sequence)
+
+    def build(self):
+        """ Builds the model of the segments.
+        """
+        with self.merged():
+            return self.model(self.es, timesteps=self.starts.tolist(),
+                              timeincrement=self.timeincrement(),
+                              **self.kwargs)
+
+    def expand(self, results):
+        """ Expands the `results` of the model of the segments to the
+        original timesteps.
+
+        Flows keep their value over each segment. The capacities of
+        storages, which are those at the end of the segments, are
+        interpolated linearly from the end of the previous segment, and the
+        dual values of buses are divided among the timesteps of a segment by
+        their timeincrement.
+        """
+        segment = np.repeat(np.arange(len(self.starts)), self.lengths)
+        totals = np.add.reduceat(self.increments, self.starts)
+        share = self.increments / totals[segment]
+        # the share of its segment passed at the end of each timestep
+        cumulative = np.cumsum(self.increments)
+        offsets = (cumulative - self.increments)[self.starts]
+        passed = (cumulative - offsets[segment]) / totals[segment]
+
+        expanded = UserDict()
+        for i, outputs in results.items():
+            expanded[i] = UserDict()
+            for o, values in outputs.items():
+                if len(values) != len(self.starts):
+                    expanded[i][o] = values
+                    continue
+                merged = np.asarray(values, dtype=float)
+                if i is o and isinstance(i, Storage):
+                    before = np.roll(merged, 1)[segment]
+                    series = before + (merged[segment] - before) * passed
+                elif i is o and isinstance(i, Bus):
+                    series = merged[segment] * share
+                else:
+                    series = merged[segment]
+                expanded[i][o] = UserList(series.tolist())
+                expanded[i][o].__dict__.update(
+                    (key, value) for key, value
+                    in getattr(values, '__dict__', {}).items()
+                    if key != 'data')
+        expanded.__dict__.update((key, value)
+                                 for key, value in vars(results).items()
+                                 if key != 'data')
+        return expanded
+
+    def solve(self, solver='glpk', solver_io='lp', **kwargs):
+        r""" Builds and solves the model of the segments and stores its
+        results, expanded to the original timesteps, in the energy system.
+
+        Parameters
+        ----------
+        solver : string
+        solver_io : string
+        \**kwargs :
+            See :meth:`.OperationalModel.solve`.
+        """
+        model = self.build()
+        model.solve(solver=solver, solver_io=solver_io, **kwargs)
+        self.es.results = self.expand(self.es.results)
+        return self.es.results
@@ -4,10 +4,86 @@ for the specified groups.
 """
 
 from pyomo.core import (Var, Set, Constraint, BuildAction, Expression,
-                        NonNegativeReals, Binary, NonNegativeIntegers)
+                        NonNegativeReals, Binary, NonNegativeIntegers, Reals)
 from pyomo.core.base.block import SimpleBlock
 
 
+def _link_periods(block, storages, size):
+    """ Chains the capacities of the `storages` of `block` over the periods
+    of the model's `period_sequence`.
+
+    The capacities are states within the representative periods, starting
+    from zero. Every period of the sequence gets an inter-period state, the
+    capacity before it, which is carried over to the next period with the
+    losses and the final intra-period state of its representative, and the
+    last one wraps around to the first. `size(n)` returns the capacity
+    storage `n` is bounded by, a number or the invest variable.
+    """
+    m = block.parent_block()
+    periods = [list(period) for period in m.periods]
+    sequence = list(m.period_sequence)
+    period_of = {t: p for p, period in enumerate(periods) for t in period}
+
+    block.PERIODS = Set(initialize=range(len(periods)), ordered=True)
+    block.SEQUENCE = Set(initialize=range(len(sequence)), ordered=True)
+
+    block.inter_capacity = Var(storages, block.SEQUENCE,
+                               within=NonNegativeReals)
+    block.intra_max = Var(storages, block.PERIODS)
+    block.intra_min = Var(storages, block.PERIODS)
+
+    def _intra_upper_rule(block, n, t):
+        """Rule definition of the maximum intra-period state.
+        """
+        return block.capacity[n, t] <= block.intra_max[n, period_of[t]]
+    block.intra_upper = Constraint(storages, m.TIMESTEPS,
+                                   rule=_intra_upper_rule)
+
+    def _intra_lower_rule(block, n, t):
+        """Rule definition of the minimum intra-period state.
+        """
+        return block.capacity[n, t] >= block.intra_min[n, period_of[t]]
+    block.intra_lower = Constraint(storages, m.TIMESTEPS,
+                                   rule=_intra_lower_rule)
+
+    def _inter_balance_rule(block, n, d):
+        """Rule definition of the inter-period state after period `d`.
+        """
+        period = periods[sequence[d]]
+        decay = 1
+        for t in period:
+            decay *= 1 - n.capacity_loss[t]
+        expr = block.inter_capacity[n, (d + 1) % len(sequence)]
+        expr += - block.inter_capacity[n, d] * decay
+        expr += - block.capacity[n, period[-1]]
+        return expr == 0
+    block.inter_balance = Constraint(storages, block.SEQUENCE,
+                                     rule=_inter_balance_rule)
+
+    def _inter_upper_rule(block, n, d):
+        """Rule definition of the upper bound of the capacity in period `d`.
+        """
+        period = periods[sequence[d]]
+        return (block.inter_capacity[n, d] + block.intra_max[n, sequence[d]]
+                <= size(n) * min(n.capacity_max[t] for t in period))
+    block.inter_upper = Constraint(storages, block.SEQUENCE,
+                                   rule=_inter_upper_rule)
+
+    def _inter_lower_rule(block, n, d):
+        """Rule definition of the lower bound of the capacity in period `d`,
+        where the inter-period state has decayed the most at its end.
+        """
+        period = periods[sequence[d]]
+        decay = 1
+        for t in period:
+            decay *= 1 - n.capacity_loss[t]
+        return (block.inter_capacity[n, d] * decay
+                + block.intra_min[n, sequence[d]]
+                >= size(n) * max(n.capacity_min[t] for t in period))
+    block.inter_lower = Constraint(storages, block.SEQUENCE,
+                                   rule=_inter_lower_rule)
+
+
 class Storage(SimpleBlock):
     """ Storages (no investment)
 
@@ -23,7 +99,10 @@ class Storage(SimpleBlock):
     capacity
         Capacity (level) for every storage and timestep. The value for the
         capacity at the beginning is set by the parameter `initial_capacity` or
-        not set if `initial_capacity` is None.
+        not set if `initial_capacity` is None. Storages in the model's
+        `initial_state` start from the level given there instead, and the
+        levels of storages in its `final_state` at the last timestep are
+        fixed.
         The variable of storage s and timestep t can be accessed by:
         `om.Storage.capacity[s, t]`
 
@@ -35,6 +114,13 @@ class Storage(SimpleBlock):
             - \\frac{flow(n, o, t)}{\\eta(n, o, t)} \\cdot \\tau \
             + flow(i, n, t) \\cdot \\eta(i, n, t) \\cdot \\tau
 
+    If the model has a `period_sequence`, the capacities are states within
+    the representative periods, starting from zero, and the storages are
+    chained over the sequence by :attr:`om.Storage.inter_capacity[n, d]`,
+    see :class:`.OperationalModel`. The constraints `intra_upper`,
+    `intra_lower`, `inter_balance`, `inter_upper` and `inter_lower` are
+    created additionally.
+
     **The following parts of the objective function are created:**
 
     If :attr:`fixed_costs` is set by the user:
@@ -42,6 +128,12 @@ class Storage(SimpleBlock):
 
     The fixed costs expression can be accessed by `om.Storage.fixed_costs`
     and their value after optimization by: `om.Storage.fixed_costs()`.
+
+    The values of the energy left in the storages found in the model's
+    `final_values` are subtracted:
+        .. math:: - \\sum_n final\\_value(n) \\cdot capacity(n, t_{last})
+
+    They can be accessed by `om.Storage.final_values`.
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -60,23 +152,39 @@ class Storage(SimpleBlock):
             return None
 
         self.STORAGES = Set(initialize=[n for n in group])
+        linked = m.period_sequence is not None
 
         def _storage_capacity_bound_rule(block, n, t):
             """Rule definition for bounds of capacity variable of storage n
             in timestep t
             """
+            if linked:
+                # intra-period states are bounded via the inter-period ones
+                return None, None
             bounds = (n.nominal_capacity * n.capacity_min[t],
                       n.nominal_capacity * n.capacity_max[t])
             return bounds
         self.capacity = Var(self.STORAGES, m.TIMESTEPS,
                             bounds=_storage_capacity_bound_rule)
 
-        # set the initial capacity of the storage
-        for n in group:
-            if n.initial_capacity is not None:
-                self.capacity[n, m.timesteps[-1]] = (n.initial_capacity *
-                                                     n.nominal_capacity)
-                self.capacity[n, m.timesteps[-1]].fix()
+        if linked:
+            _link_periods(self, self.STORAGES, lambda n: n.nominal_capacity)
+            for n in group:
+                if n.initial_capacity is not None:
+                    self.inter_capacity[n, 0] = (n.initial_capacity *
+                                                 n.nominal_capacity)
+                    self.inter_capacity[n, 0].fix()
+        else:
+            # set the initial capacity of the storage
+            for n in group:
+                if (n.initial_capacity is not None and
+                        n not in m.initial_state):
+                    self.capacity[n, m.timesteps[-1]] = (
+                        n.initial_capacity * n.nominal_capacity)
+                    self.capacity[n, m.timesteps[-1]].fix()
+                if n in m.final_state:
+                    self.capacity[n, m.timesteps[-1]] = m.final_state[n]
+                    self.capacity[n, m.timesteps[-1]].fix()
 
         # storage balance constraint
         def _storage_balance_rule(block, n, t):
@@ -85,8 +193,13 @@ class Storage(SimpleBlock):
             """
             expr = 0
             expr += block.capacity[n, t]
-            expr += - block.capacity[n, m.previous_timesteps[t]] * (
-                1 - n.capacity_loss[t])
+            if t == m.TIMESTEPS[1] and n in m.initial_state:
+                # the capacity before the first timestep is given
+                expr += - m.initial_state[n] * (1 - n.capacity_loss[t])
+            elif not (linked and t in m.first_timesteps):
+                # intra-period states of linked periods start from zero
+                expr += - block.capacity[n, m.previous_timesteps[t]] * (
+                    1 - n.capacity_loss[t])
             expr += (- m.flow[n._input(), n, t] *
                      n.inflow_conversion_factor[t]) * m.timeincrement[t]
             expr += (m.flow[n, n._output(), t] /
@@ -103,15 +216,22 @@ class Storage(SimpleBlock):
         if not hasattr(self, 'STORAGES'):
             return 0
 
+        m = self.parent_block()
+
         fixed_costs = 0
+        final_values = 0
 
         for n in self.STORAGES:
             if n.fixed_costs is not None:
                 fixed_costs += n.nominal_capacity * n.fixed_costs
+            if n in m.final_values:
+                final_values += (m.final_values[n] *
+                                 self.capacity[n, m.TIMESTEPS[-1]])
 
         self.fixed_costs = Expression(expr=fixed_costs)
+        self.final_values = Expression(expr=final_values)
 
-        return fixed_costs
+        return fixed_costs - final_values
 
 
 class InvestmentStorage(SimpleBlock):
@@ -179,6 +299,12 @@ class InvestmentStorage(SimpleBlock):
             \\forall n \\in \\textrm{MIN\_INVESTSTORAGES,} \\\\
             \\forall t \\in \\textrm{TIMESTEPS}.
 
+    If the model has a `period_sequence`, the storages are chained over it
+    like those of :class:`Storage`, with the inter-period state of the first
+    period taking the initial capacity, and the intra-period states bounded
+    via the inter-period ones instead of the constraints `max_capacity` and
+    `min_capacity`.
+
 
     **The following parts of the objective function are created:**
 
@@ -218,9 +344,12 @@ class InvestmentStorage(SimpleBlock):
             initialize=[n for n in group if sum(
                 [n.capacity_min[t] for t in m.TIMESTEPS]) > 0])
 
+        linked = m.period_sequence is not None
+
         # ######################### Variables  ################################
+        # intra-period states of linked periods may become negative
         self.capacity = Var(self.INVESTSTORAGES, m.TIMESTEPS,
-                            within=NonNegativeReals)
+                            within=Reals if linked else NonNegativeReals)
 
         def _storage_investvar_bound_rule(block, n):
             """Rule definition to bound the invested storage capacity `invest`.
@@ -238,8 +367,10 @@ class InvestmentStorage(SimpleBlock):
             """
             expr = 0
             expr += block.capacity[n, t]
-            expr += - block.capacity[n, m.previous_timesteps[t]] * (
-                1 - n.capacity_loss[t])
+            if not (linked and t in m.first_timesteps):
+                # intra-period states of linked periods start from zero
+                expr += - block.capacity[n, m.previous_timesteps[t]] * (
+                    1 - n.capacity_loss[t])
             expr += (- m.flow[i[n], n, t] *
                      n.inflow_conversion_factor[t]) * m.timeincrement[t]
             expr += (m.flow[n, o[n], t] /
@@ -248,10 +379,16 @@ class InvestmentStorage(SimpleBlock):
         self.balance = Constraint(self.INVESTSTORAGES, m.TIMESTEPS,
                                   rule=_storage_balance_rule)
 
+        if linked:
+            _link_periods(self, self.INVESTSTORAGES, lambda n: self.invest[n])
+
         def _initial_capacity_invest_rule(block, n):
             """Rule definition for constraint to connect initial storage
             capacity with capacity of last timesteps.
             """
+            if linked:
+                return (self.inter_capacity[n, 0] ==
+                        n.initial_capacity * self.invest[n])
             expr = (self.capacity[n, m.TIMESTEPS[-1]] == (n.initial_capacity *
                                                           self.invest[n]))
             return expr
@@ -280,6 +417,10 @@ class InvestmentStorage(SimpleBlock):
         self.storage_capacity_outflow = Constraint(
             self.INVESTSTORAGES, rule=_storage_capacity_outflow_invest_rule)
 
+        if linked:
+            # the intra-period states are bounded via the inter-period ones
+            return
+
         def _max_capacity_invest_rule(block, n, t):
             """Rule definition for upper bound constraint for the storage cap.
             """
@@ -329,6 +470,9 @@ class Flow(SimpleBlock):
     **The following sets are created:** (-> see basic sets at
     :class:`.OperationalModel` )
 
+    FLOWS
+        A set of the flows of the group, whose costs are added to the
+        objective.
     SUMMED_MAX_FLOWS
         A set of flows with the attribute :attr:`summed_max` being not None.
     SUMMED_MIN_FLOWS
@@ -399,6 +543,8 @@ class Flow(SimpleBlock):
         m = self.parent_block()
 
         # ########################## SETS #################################
+        self.FLOWS = Set(initialize=[(g[0], g[1]) for g in group])
+
         # set for all flows with an global limit on the flow over time
         self.SUMMED_MAX_FLOWS = Set(initialize=[
             (g[0], g[1]) for g in group if g[2].summed_max is not None and
@@ -434,8 +580,8 @@ class Flow(SimpleBlock):
             """Rule definition for build action of max. sum flow constraint.
             """
             for inp, out in self.SUMMED_MAX_FLOWS:
-                lhs = sum(m.flow[inp, out, ts] * m.timeincrement[ts]
-                          for ts in m.TIMESTEPS)
+                lhs = sum(m.flow[inp, out, ts] * m.timeincrement[ts] *
+                          m.objective_weighting[ts] for ts in m.TIMESTEPS)
                 rhs = (m.flows[inp, out].summed_max *
                        m.flows[inp, out].nominal_value)
                 self.summed_max.add((inp, out), lhs <= rhs)
@@ -446,8 +592,8 @@ class Flow(SimpleBlock):
             """Rule definition for build action of min. sum flow constraint.
             """
             for inp, out in self.SUMMED_MIN_FLOWS:
-                lhs = sum(m.flow[inp, out, ts] * m.timeincrement[ts]
-                          for ts in m.TIMESTEPS)
+                lhs = sum(m.flow[inp, out, ts] * m.timeincrement[ts] *
+                          m.objective_weighting[ts] for ts in m.TIMESTEPS)
                 rhs = (m.flows[inp, out].summed_min *
                        m.flows[inp, out].nominal_value)
                 self.summed_min.add((inp, out), lhs >= rhs)
@@ -459,8 +605,9 @@ class Flow(SimpleBlock):
             """
             for inp, out in self.POSITIVE_GRADIENT_FLOWS:
                 for ts in m.TIMESTEPS:
-                    if ts > 0:
-                        lhs = m.flow[inp, out, ts] - m.flow[inp, out, ts-1]
+                    if ts not in m.first_timesteps:
+                        lhs = (m.flow[inp, out, ts] -
+                               m.flow[inp, out, m.previous_timesteps[ts]])
                         rhs = m.positive_flow_gradient[inp, out, ts]
                         self.positive_gradient_constr.add((inp, out, ts),
                                                           lhs <= rhs)
@@ -476,8 +623,9 @@ class Flow(SimpleBlock):
             """
             for inp, out in self.NEGATIVE_GRADIENT_FLOWS:
                 for ts in m.TIMESTEPS:
-                    if ts > 0:
-                        lhs = m.flow[inp, out, ts-1] - m.flow[inp, out, ts]
+                    if ts not in m.first_timesteps:
+                        lhs = (m.flow[inp, out, m.previous_timesteps[ts]] -
+                               m.flow[inp, out, ts])
                         rhs = m.negative_flow_gradient[inp, out, ts]
                         self.negative_gradient_constr.add((inp, out, ts),
                                                           lhs <= rhs)
@@ -492,16 +640,20 @@ class Flow(SimpleBlock):
         """ Objective expression for all standard flows with fixed costs
         and variable costs.
         """
+        if not hasattr(self, 'FLOWS'):
+            return 0
+
         m = self.parent_block()
 
         variable_costs = 0
         fixed_costs = 0
 
-        for i, o in m.FLOWS:
+        for i, o in self.FLOWS:
             for t in m.TIMESTEPS:
                 # add variable costs
                 if m.flows[i, o].variable_costs[0] is not None:
                     variable_costs += (m.flow[i, o, t] * m.timeincrement[t] *
+                                       m.objective_weighting[t] *
                                        m.flows[i, o].variable_costs[t])
             # add fixed costs if nominal_value is not None
             if (m.flows[i, o].fixed_costs and
@@ -676,8 +828,8 @@ class InvestmentFlow(SimpleBlock):
             """Rule definition for build action of max. sum flow constraint
             in investment case.
             """
-            expr = (sum(m.flow[i, o, t] * m.timeincrement[t]
-                        for t in m.TIMESTEPS) <=
+            expr = (sum(m.flow[i, o, t] * m.timeincrement[t] *
+                        m.objective_weighting[t] for t in m.TIMESTEPS) <=
                     m.flows[i, o].summed_max * self.invest[i, o])
             return expr
         self.summed_max = Constraint(self.SUMMED_MAX_FLOWS,
@@ -687,8 +839,8 @@ class InvestmentFlow(SimpleBlock):
             """Rule definition for build action of min. sum flow constraint
             in investment case.
             """
-            expr = (sum(m.flow[i, o, t] * m.timeincrement[t]
-                        for t in m.TIMESTEPS) >=
+            expr = (sum(m.flow[i, o, t] * m.timeincrement[t] *
+                        m.objective_weighting[t] for t in m.TIMESTEPS) >=
                     m.flows[i, o].summed_min * self.invest[i, o])
             return expr
         self.summed_min = Constraint(self.SUMMED_MIN_FLOWS,
@@ -974,12 +1126,13 @@ class BinaryFlow(SimpleBlock):
         def _startup_rule(block, i, o, t):
             """Rule definition for startup constraint of binary flows.
             """
-            if t > m.TIMESTEPS[1]:
+            if t not in m.first_timesteps:
                 expr = (self.startup[i, o, t] >= self.status[i, o, t] -
-                        self.status[i, o, t-1])
+                        self.status[i, o, m.previous_timesteps[t]])
             else:
                 expr = (self.startup[i, o, t] >= self.status[i, o, t] -
-                        m.flows[i, o].binary.initial_status)
+                        m.initial_state.get(
+                            (i, o), m.flows[i, o].binary.initial_status))
             return expr
         self.startup_constr = Constraint(self.STARTUPFLOWS, m.TIMESTEPS,
                                          rule=_startup_rule)
@@ -987,12 +1140,14 @@ class BinaryFlow(SimpleBlock):
         def _shutdown_rule(block, i, o, t):
             """Rule definition for shutdown constraints of binary flows.
             """
-            if t > m.TIMESTEPS[1]:
-                expr = (self.shutdown[i, o, t] >= self.status[i, o, t-1] -
+            if t not in m.first_timesteps:
+                expr = (self.shutdown[i, o, t] >=
+                        self.status[i, o, m.previous_timesteps[t]] -
                         self.status[i, o, t])
             else:
                 expr = (self.shutdown[i, o, t] >=
-                        m.flows[i, o].binary.initial_status -
+                        m.initial_state.get(
+                            (i, o), m.flows[i, o].binary.initial_status) -
                         self.status[i, o, t])
             return expr
         self.shutdown_constr = Constraint(self.SHUTDOWNFLOWS, m.TIMESTEPS,
@@ -1014,6 +1169,7 @@ class BinaryFlow(SimpleBlock):
 
         if self.STARTUPFLOWS:
             startcosts += sum(self.startup[i, o, t] *
+                              m.objective_weighting[t] *
                               m.flows[i, o].binary.startup_costs
                               for i, o in self.STARTUPFLOWS
                               for t in m.TIMESTEPS)
@@ -1021,6 +1177,7 @@ class BinaryFlow(SimpleBlock):
 
         if self.SHUTDOWNFLOWS:
             shutdowncosts += sum(self.shutdown[i, o, t] *
+                                 m.objective_weighting[t] *
                                  m.flows[i, o].binary.shutdown_costs
                                  for i, o in self.SHUTDOWNFLOWS
                                  for t in m.TIMESTEPS)
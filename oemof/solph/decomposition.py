@@ -0,0 +1,1001 @@
+# -*- coding: utf-8 -*-
+"""Decomposing models into parts which are solved in parallel processes:
+the connected components of an energy system, regions coordinated by the
+prices of the flows they exchange, or the blocks of the horizon of an
+investment model, coordinated by a master problem.
+
+"""
+
+from collections import OrderedDict, UserDict
+import logging
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import pyomo.environ as po
+from pyomo.opt import SolverFactory
+
+from ..energy_system import EnergySystem
+from ..network import Entity, Node
+from .models import OperationalModel
+from .network import Storage
+from .rolling import _Keys, _flatten, _nest, _stitch
+from .session import SolverSession
+
+
+def _investments(es):
+    """ Returns the invest variables of `es` as triples of their key, their
+    :class:`.Investment` object and their costs per invested unit.
+
+    The keys are `(source, target)` tuples for flows and the storages
+    themselves for storages.
+    """
+    investments = [((i, o), f.investment,
+                    f.investment.ep_costs + (f.fixed_costs or 0))
+                   for i in es.nodes for o, f in i.outputs.items()
+                   if f.investment is not None]
+    investments.extend(
+        (n, n.investment, n.investment.ep_costs + (n.fixed_costs or 0))
+        for n in es.nodes
+        if isinstance(n, Storage) and n.investment is not None)
+    return investments
+
+
+def _fix_investments(model):
+    """ Adds the constraints `fixed_invest` to the investment blocks of
+    `model`, which fix the invest variables to the values set by
+    :func:`_set_investments`.
+
+    The bounds of the invest variables are dropped, so that the costs of
+    changing an investment are found in the duals of these constraints.
+    """
+    if isinstance(model, po.ConcreteModel):
+        flows = model.InvestmentFlow
+        if hasattr(flows, 'FLOWS'):
+            flows.invest_value = po.Param(flows.FLOWS, mutable=True,
+                                          initialize=0)
+
+            def _fixed_flow_invest_rule(block, i, o):
+                return block.invest[i, o] == block.invest_value[i, o]
+            flows.fixed_invest = po.Constraint(flows.FLOWS,
+                                               rule=_fixed_flow_invest_rule)
+        storages = model.InvestmentStorage
+        if hasattr(storages, 'INVESTSTORAGES'):
+            storages.invest_value = po.Param(storages.INVESTSTORAGES,
+                                             mutable=True, initialize=0)
+
+            def _fixed_storage_invest_rule(block, n):
+                return block.invest[n] == block.invest_value[n]
+            storages.fixed_invest = po.Constraint(
+                storages.INVESTSTORAGES, rule=_fixed_storage_invest_rule)
+        for block in (flows, storages):
+            if hasattr(block, 'invest'):
+                for var in block.invest.values():
+                    var.domain = po.Reals
+                    var.setlb(None)
+                    var.setub(None)
+    else:
+        for name in ('InvestmentFlow', 'InvestmentStorage'):
+            invest = model.variables.get(name + '.invest')
+            if invest is None:
+                continue
+            rows = model.add_constraints(name + '.fixed_invest',
+                                         invest.keys, 'E', 0)
+            model.add_coefficients(rows.ids, invest.ids, 1)
+            model.lb[invest.ids] = -np.inf
+            model.ub[invest.ids] = np.inf
+
+
+def _set_investments(model, invest):
+    """ Sets the values the invest variables of a `model` prepared by
+    :func:`_fix_investments` are fixed to.
+    """
+    for key, value in invest.items():
+        name = ('InvestmentFlow' if isinstance(key, tuple) else
+                'InvestmentStorage')
+        if isinstance(model, po.ConcreteModel):
+            getattr(model, name).invest_value[key] = value
+        else:
+            model.rhs[model.constraints[name + '.fixed_invest'][key]] = value
+
+
+def _investment_duals(model):
+    """ Returns the duals of the constraints fixing the invest variables of
+    a solved `model` prepared by :func:`_fix_investments`.
+    """
+    duals = {}
+    for name in ('InvestmentFlow', 'InvestmentStorage'):
+        if isinstance(model, po.ConcreteModel):
+            rows = getattr(getattr(model, name), 'fixed_invest', {})
+            for key in rows:
+                duals[key] = model.dual.get(rows[key])
+        else:
+            rows = model.constraints.get(name + '.fixed_invest')
+            for key in (rows.keys if rows is not None else []):
+                duals[key] = float(model.duals[rows[key]])
+    if any(d is None or np.isnan(d) for d in duals.values()):
+        raise ValueError("The subproblems have to be linear to yield duals.")
+    return duals
+
+
+#: The energy system, model class, model arguments and parts, i.e. the
+#: components, regions, blocks or windows, of a worker process of
+#: :class:`Components`, :class:`ADMM`, :class:`Benders` or
+#: :class:`.ParallelWindows`, together with the sessions of the models it
+#: has built and the inputs, i.e. prices or investments, they were solved
+#: for last.
+_WORKER = {}
+
+
+def _initialize(es, model, kwargs, parts):
+    """ Sets up a worker process of :class:`Components`, :class:`ADMM`,
+    :class:`Benders` or :class:`.ParallelWindows`.
+    """
+    _WORKER.clear()
+    _WORKER.update(es=es, model=model, kwargs=kwargs, parts=parts,
+                   keys=_Keys(es), sessions={}, inputs={})
+
+
+def components(es, join=()):
+    """ Returns the connected components of the graph of the nodes and flows
+    of `es` as lists of nodes, in the order of :attr:`es.nodes
+    <oemof.energy_system.EnergySystem.nodes>`.
+
+    Nodes in the same collection of `join` are put into the same component,
+    e.g. because they share a global constraint.
+
+    Examples
+    --------
+    >>> from oemof.network import Bus, Sink
+    >>> es = EnergySystem()
+    >>> a, b = Bus(label='a'), Bus(label='b')
+    >>> sinks = [Sink(label='a1', inputs=[a]), Sink(label='b1', inputs=[b])]
+    >>> [[n.label for n in c] for c in components(es)]
+    [['a', 'a1'], ['b', 'b1']]
+    >>> len(components(es, join=[(a, b)]))
+    1
+    """
+    index = {id(n): k for k, n in enumerate(es.nodes)}
+    parent = list(range(len(index)))
+
+    def find(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    def union(nodes):
+        roots = [find(index[id(n)]) for n in nodes]
+        for root in roots[1:]:
+            parent[root] = roots[0]
+
+    for i in es.nodes:
+        for o in i.outputs:
+            union([i, o])
+    for nodes in join:
+        union(list(nodes))
+
+    grouped = OrderedDict()
+    for k, n in enumerate(es.nodes):
+        grouped.setdefault(find(k), []).append(n)
+    return list(grouped.values())
+
+
+def _subsystem(es, nodes):
+    """ Returns an energy system of the `nodes` of `es`, which are grouped
+    by the groupings of `es`, without making it the registry of new nodes.
+
+    Flows into the `nodes` from other nodes are left out of the groups of
+    flows, as they are constrained and priced with their source.
+    """
+    registries = Node.registry, Entity.registry
+    try:
+        subsystem = EnergySystem(entities=list(nodes), timeindex=es.timeindex)
+    finally:
+        Node.registry, Entity.registry = registries
+    subsystem._groupings = es._groupings
+    nodes = set(nodes)
+    groups = subsystem.groups
+    for key, group in list(groups.items()):
+        if isinstance(group, set) and any(isinstance(member, tuple)
+                                          for member in group):
+            group = {(s, t, f) for s, t, f in group if s in nodes}
+            if group:
+                groups[key] = group
+            else:
+                del groups[key]
+    return subsystem
+
+
+def _solve_component(task):
+    """ Builds and solves the model of one component in a worker process.
+
+    Returns its results and its objective, with all keys encoded by
+    :class:`_Keys`.
+    """
+    k, solver, solver_io, kwargs = task
+    keys = _WORKER['keys']
+    nodes = [keys.nodes[n] for n in _WORKER['parts'][k]]
+    model = _WORKER['model'](_subsystem(_WORKER['es'], nodes),
+                             **_WORKER['kwargs'])
+    model.solve(solver=solver, solver_io=solver_io, **kwargs)
+    results = model.results()
+    return keys.encode(_flatten(results)), results.objective
+
+
+class Components:
+    r""" Solves each connected component of an energy system, e.g. the heat
+    network of each town, as a model of its own in a pool of processes.
+
+    Components which aren't connected by any flow don't share any variable
+    or constraint, so solving them one by one gives the same solution as
+    solving them in one model, while each model and the time to solve it
+    stay small. Constraints which couple several components, like custom
+    constraint groups, need a shared model: the nodes they couple have to be
+    joined into one component.
+
+    Parameters
+    ----------
+    es : EnergySystem object
+        The energy system to solve.
+    join : iterable of iterables of nodes
+        Nodes which have to be in the same component, see
+        :func:`components`.
+    processes : int (optional)
+        The number of worker processes, defaulting to the number of CPUs
+        but not more than the number of components. With a single process,
+        the components are solved one after another in the current process.
+        Worker processes are forked, so they don't work on platforms which
+        can't fork.
+    model : class
+        The model built for each component, :class:`.OperationalModel` or
+        :class:`.SparseOperationalModel`.
+    \**kwargs :
+        Further arguments for the models.
+
+    Attributes
+    ----------
+    components : list of lists of nodes
+        The components which have flows, and are therefore solved.
+
+    Examples
+    --------
+    >>> cc = Components(es, processes=4)  # doctest: +SKIP
+    >>> len(cc.components)  # doctest: +SKIP
+    12
+    >>> cc.solve(solver='cbc')  # doctest: +SKIP
+    """
+    def __init__(self, es, join=(), processes=None, model=OperationalModel,
+                 **kwargs):
+        self.es = es
+        self.components = [c for c in components(es, join)
+                           if any(n.outputs for n in c)]
+        self.processes = min(processes or multiprocessing.cpu_count(),
+                             len(self.components)) or 1
+        self.model = model
+        self.kwargs = kwargs
+
+    def solve(self, solver='glpk', solver_io='lp', **kwargs):
+        r""" Solves the components and stores their merged results in the
+        energy system.
+
+        The results are structured like those of
+        :meth:`.OperationalModel.results`, with the sum of the objectives of
+        the components in `objective` and each of them in `objectives`.
+
+        Parameters
+        ----------
+        solver : string
+        solver_io : string
+        \**kwargs :
+            See :meth:`.OperationalModel.solve`.
+        """
+        keys = _Keys(self.es)
+        parts = [[keys.index[id(n)] for n in c] for c in self.components]
+        # the largest components first, to keep all processes busy
+        order = sorted(range(len(parts)), key=lambda k: -len(parts[k]))
+        tasks = [(k, solver, solver_io, kwargs) for k in order]
+        if self.processes == 1:
+            _initialize(self.es, self.model, self.kwargs, parts)
+            try:
+                outputs = [_solve_component(task) for task in tasks]
+            finally:
+                _close()
+        else:
+            with multiprocessing.get_context('fork').Pool(
+                    self.processes, _initialize,
+                    (self.es, self.model, self.kwargs, parts)) as pool:
+                outputs = pool.map(_solve_component, tasks, chunksize=1)
+        outputs = dict(zip(order, outputs))
+
+        results = UserDict()
+        results.objectives = []
+        for k in range(len(parts)):
+            result = _nest(keys.decode(outputs[k][0]), outputs[k][1])
+            results.update(result)
+            results.objectives.append(result.objective)
+        results.objective = sum(results.objectives)
+        self.es.results = results
+        return results
+
+
+def _close():
+    """ Removes the files of the sessions of a worker process and forgets
+    its models.
+    """
+    for session in _WORKER.get('sessions', {}).values():
+        session.close()
+    _WORKER.clear()
+
+
+def _solve_block(task):
+    """ Solves the model of one block for the given investments in a worker
+    process. The model is built on first use and kept for the following
+    iterations, and it is only solved again if the investments changed.
+
+    Returns its objective and the duals of the investments, and its results
+    if they are asked for, with all keys encoded by :class:`_Keys`.
+    """
+    k, invest, solver, solver_io, kwargs, results = task
+    keys, sessions = _WORKER['keys'], _WORKER['sessions']
+    if k not in sessions:
+        timesteps, weighting = _WORKER['parts'][k]
+        model = _WORKER['model'](_WORKER['es'], timesteps=timesteps,
+                                 objective_weighting=weighting,
+                                 **_WORKER['kwargs'])
+        _fix_investments(model)
+        model.receive_duals()
+        sessions[k] = SolverSession(model, solver, solver_io, **kwargs)
+    session = sessions[k]
+    if _WORKER['inputs'].get(k) != invest:
+        _set_investments(session.model, keys.decode(invest))
+        session.resolve()
+        _WORKER['inputs'][k] = invest
+    output = (session.model.objective(),
+              keys.encode(_investment_duals(session.model)))
+    if results:
+        output += (keys.encode(_flatten(session.model.results())),)
+    return output
+
+
+def _serve(connection, es, model, kwargs, parts):
+    """ Runs a worker process, which applies the functions it receives over
+    `connection` to their tasks until it receives None.
+    """
+    _initialize(es, model, kwargs, parts)
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                return
+            function, tasks = message
+            try:
+                connection.send([function(task) for task in tasks])
+            except Exception as error:
+                connection.send(error)
+    finally:
+        _close()
+
+
+def serve(es, address, authkey=None):
+    r""" Serves as a worker process of :class:`ADMM` or :class:`Benders` on
+    another host, until the coordinator is done.
+
+    The coordinator passes the `address` in its `addresses`. As parts of the
+    energy system are referred to by the positions of its nodes, `es` has to
+    be built like the coordinator's, e.g. by the same script.
+
+    Parameters
+    ----------
+    es : EnergySystem object
+        The energy system of the coordinator.
+    address : tuple
+        The host name and port to listen on.
+    authkey : bytes (optional)
+        A secret shared with the coordinator. As the coordinator's messages
+        are unpickled, only trusted coordinators may connect.
+
+    Examples
+    --------
+    >>> serve(es, ('', 6000), authkey=b'secret')  # doctest: +SKIP
+    """
+    with Listener(address, authkey=authkey) as listener:
+        with listener.accept() as connection:
+            _serve(connection, es, *connection.recv())
+
+
+class _Workers:
+    """ The worker processes of :class:`ADMM`, :class:`Benders` or
+    :class:`.ParallelWindows`, which keep the models of their parts between
+    rounds. Part `k` is always solved by worker `k` modulo the number of
+    workers.
+
+    The workers are forked from this process, or served by :func:`serve` at
+    the `addresses` of other hosts. With a single process and no addresses,
+    the parts are solved in this process.
+    """
+    def __init__(self, es, model, kwargs, parts, processes=1, addresses=None,
+                 authkey=None):
+        self.connections = []
+        self.processes = []
+        if addresses:
+            for address in addresses:
+                self.connections.append(Client(address, authkey=authkey))
+                self.connections[-1].send((model, kwargs, parts))
+        elif processes > 1:
+            context = multiprocessing.get_context('fork')
+            for _ in range(processes):
+                parent, child = context.Pipe()
+                process = context.Process(
+                    target=_serve, args=(child, es, model, kwargs, parts))
+                process.start()
+                self.connections.append(parent)
+                self.processes.append(process)
+        else:
+            _initialize(es, model, kwargs, parts)
+
+    def map(self, function, tasks):
+        """ Returns the results of `function` for all `tasks`, the `k`-th of
+        which belongs to part `k`.
+        """
+        if not self.connections:
+            return [function(task) for task in tasks]
+        n = len(self.connections)
+        for w, connection in enumerate(self.connections):
+            connection.send((function, tasks[w::n]))
+        answers = [connection.recv() for connection in self.connections]
+        for answer in answers:
+            if isinstance(answer, Exception):
+                raise answer
+        outputs = [None] * len(tasks)
+        for w, answer in enumerate(answers):
+            outputs[w::n] = answer
+        return outputs
+
+    def close(self):
+        """ Stops the workers.
+        """
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+        for process in self.processes:
+            process.join()
+        if not self.connections:
+            _close()
+
+
+def _add_prices(model, flows, rho):
+    """ Adds prices for the copies of the exchanged `flows` in `model`,
+    which are set by :func:`_set_prices`, and the proximal term of ADMM,
+    `rho / 2` times their squares, to its objective.
+    """
+    if isinstance(model, po.ConcreteModel):
+        model.EXCHANGE_FLOWS = po.Set(initialize=flows, ordered=True,
+                                      dimen=2)
+        model.exchange_price = po.Param(model.EXCHANGE_FLOWS,
+                                        model.TIMESTEPS, mutable=True,
+                                        initialize=0)
+        expr = model.objective.expr + sum(
+            model.exchange_price[i, o, t] * model.flow[i, o, t] +
+            rho / 2 * model.flow[i, o, t] ** 2
+            for i, o in flows for t in model.TIMESTEPS)
+        model.del_component('objective')
+        model.objective = po.Objective(expr=expr)
+    else:
+        model.exchange_costs = {key: model.cost[model.flow[key]].copy()
+                                for key in flows}
+        for key in flows:
+            model.quadratic[model.flow[key]] = rho
+
+
+def _set_prices(model, prices):
+    """ Sets the prices of the exchanged flows of a `model` prepared by
+    :func:`_add_prices`.
+    """
+    for (i, o), values in prices.items():
+        if isinstance(model, po.ConcreteModel):
+            for t, value in zip(model.TIMESTEPS, values):
+                model.exchange_price[i, o, t] = value
+        else:
+            model.cost[model.flow[i, o]] = (model.exchange_costs[i, o] +
+                                            values)
+
+
+def _exchanged(model, flows):
+    """ Returns the values of the `flows` in a solved `model`.
+    """
+    if isinstance(model, po.ConcreteModel):
+        return {(i, o): np.array([model.flow[i, o, t].value
+                                  for t in model.TIMESTEPS])
+                for i, o in flows}
+    return {key: model.solution[model.flow[key]] for key in flows}
+
+
+def _solve_region(task):
+    """ Solves the model of one region for the given prices of its exchanged
+    flows in a worker process. The model is built on first use and kept for
+    the following iterations, and it is only solved again if the prices
+    changed.
+
+    Returns its costs without the prices and proximal terms and the values
+    of the exchanged flows, and its results if they are asked for, with all
+    keys encoded by :class:`_Keys`.
+    """
+    k, prices, solver, solver_io, kwargs, results = task
+    keys, sessions = _WORKER['keys'], _WORKER['sessions']
+    nodes, flows, rho = _WORKER['parts'][k]
+    flows = [(keys.nodes[i], keys.nodes[o]) for i, o in flows]
+    if k not in sessions:
+        es = _subsystem(_WORKER['es'], [keys.nodes[n] for n in nodes])
+        model = _WORKER['model'](es, **_WORKER['kwargs'])
+        _add_prices(model, flows, rho)
+        sessions[k] = SolverSession(model, solver, solver_io, **kwargs)
+    session = sessions[k]
+    decoded = {key: np.asarray(values)
+               for key, values in keys.decode(prices).items()}
+    if _WORKER['inputs'].get(k) != prices:
+        _set_prices(session.model, decoded)
+        session.resolve()
+        _WORKER['inputs'][k] = prices
+    values = _exchanged(session.model, flows)
+    costs = session.model.objective() - sum(
+        np.dot(decoded[key], x) + rho / 2 * np.dot(x, x)
+        for key, x in values.items())
+    output = (costs, keys.encode({key: x.tolist()
+                                  for key, x in values.items()}))
+    if results:
+        output += (keys.encode(_flatten(session.model.results())),)
+    return output
+
+
+class ADMM:
+    r""" Solves an energy system split into regions, which only share the
+    flows between them, by the alternating direction method of multipliers
+    (ADMM), solving the regions at once in a pool of processes.
+
+    Each region is built as a model of its own, which holds a copy of every
+    flow it exchanges with other regions. A flow is only constrained and
+    priced in the region of its source, while its copy in the region of its
+    target is only bounded. In every iteration, the regions are solved with
+    prices for their copies and a penalty of `rho / 2` times their squares,
+    pulling them towards the average of the copies in the last iteration.
+    The prices are raised where a copy exceeds the new average, until all
+    copies agree. For linear models, the regions then solve the whole
+    energy system, and the prices of the flows are their marginal values.
+
+    The penalty makes the regions quadratic programs, which need a solver
+    supporting quadratic objectives, e.g. gurobi or cplex.
+
+    Parameters
+    ----------
+    es : EnergySystem object
+        The energy system to solve.
+    regions : callable or dict
+        The region of each node, e.g. the `key` of a grouping, or a
+        dictionary mapping each node to its region.
+    rho : float
+        The weight of the penalty, which trades the agreement of the copies
+        in each iteration against the progress of the prices.
+    tolerance : float
+        The largest difference of copies and of their averages in
+        consecutive iterations (times `rho`) for which they are considered to
+        agree.
+    max_iterations : int
+        The number of iterations after which to stop even if the copies
+        don't agree.
+    processes : int (optional)
+        The number of worker processes, defaulting to the number of CPUs but
+        not more than the number of regions. Each worker keeps the models of
+        its regions between the iterations. With a single process, the
+        regions are solved in the current process. Worker processes are
+        forked, so they don't work on platforms which can't fork.
+    addresses : list of tuples (optional)
+        Instead of forking processes, connect to workers run by
+        :func:`serve` at these addresses, e.g. on other hosts.
+    authkey : bytes (optional)
+        The secret shared with the workers at the `addresses`.
+    model : class
+        The model built for each region, :class:`.OperationalModel` or
+        :class:`.SparseOperationalModel`.
+    \**kwargs :
+        Further arguments for the models.
+
+    Attributes
+    ----------
+    regions : OrderedDict
+        The nodes of each region, keyed by the region.
+    exchanges : list
+        The flows between regions, keyed by `(source, target)`.
+    residuals : list
+        The largest difference between copies and the largest change of
+        their averages times `rho` in every iteration.
+    converged : bool
+        Whether the copies agreed in the last iteration.
+
+    Examples
+    --------
+    Solving the regions named by the first part of the labels of the nodes
+    on two other hosts, each running :func:`serve`:
+
+    >>> admm = ADMM(es, lambda n: n.label.split('_')[0], rho=10,
+    ...             addresses=[('host1', 6000), ('host2', 6000)],
+    ...             authkey=b'secret')  # doctest: +SKIP
+    >>> admm.solve(solver='gurobi')  # doctest: +SKIP
+    >>> admm.converged, admm.residuals[-1]  # doctest: +SKIP
+    (True, (0.0004, 0.0007))
+    """
+    def __init__(self, es, regions, rho=1, tolerance=1e-3,
+                 max_iterations=200, processes=None, addresses=None,
+                 authkey=None, model=OperationalModel, **kwargs):
+        key = regions if callable(regions) else regions.__getitem__
+        self.regions = OrderedDict()
+        region = {}
+        for n in es.nodes:
+            region[n] = key(n)
+            self.regions.setdefault(region[n], []).append(n)
+        self.exchanges = [(i, o) for i in es.nodes for o in i.outputs
+                          if region[i] != region[o]]
+        self.es = es
+        self.rho = rho
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.processes = min(processes or multiprocessing.cpu_count(),
+                             len(self.regions))
+        self.addresses = addresses
+        self.authkey = authkey
+        self.model = model
+        self.kwargs = kwargs
+        self.residuals = []
+        self.converged = False
+
+    def solve(self, solver='glpk', solver_io='lp', **kwargs):
+        r""" Solves the regions until the copies of the exchanged flows agree
+        and stores the merged results in the energy system.
+
+        The results are structured like those of
+        :meth:`.OperationalModel.results`, with the exchanged flows taking
+        the average of their copies. The sum of the costs of the regions is
+        stored in `objective` and each of them in `objectives`.
+
+        Parameters
+        ----------
+        solver : string
+        solver_io : string
+        \**kwargs :
+            See :meth:`.OperationalModel.solve`.
+        """
+        keys = _Keys(self.es)
+        regions = list(self.regions.values())
+        flows = [[(i, o) for i, o in self.exchanges
+                  if i in nodes or o in nodes]
+                 for nodes in (set(r) for r in regions)]
+        parts = [([keys.index[id(n)] for n in nodes],
+                  [(keys.index[id(i)], keys.index[id(o)]) for i, o in f],
+                  self.rho) for nodes, f in zip(regions, flows)]
+        timesteps = len(self.kwargs.get('timesteps',
+                                        range(len(self.es.timeindex))))
+        average = {f: np.zeros(timesteps) for f in self.exchanges}
+        prices = {(k, f): np.zeros(timesteps)
+                  for k in range(len(regions)) for f in flows[k]}
+
+        workers = _Workers(self.es, self.model, self.kwargs, parts,
+                           self.processes, self.addresses, self.authkey)
+        try:
+            self.residuals = []
+            for iteration in range(self.max_iterations):
+                tasks = [(k, keys.encode({
+                    f: (prices[k, f] - self.rho * average[f]).tolist()
+                    for f in flows[k]}), solver, solver_io, kwargs, False)
+                    for k in range(len(regions))]
+                outputs = workers.map(_solve_region, tasks)
+                copies = {(k, f): np.asarray(x)
+                          for k, output in enumerate(outputs)
+                          for f, x in keys.decode(output[1]).items()}
+                previous, average = average, {
+                    f: np.mean([copies[k, f] for k in range(len(regions))
+                                if (k, f) in copies], axis=0)
+                    for f in self.exchanges}
+                for (k, f), x in copies.items():
+                    prices[k, f] += self.rho * (x - average[f])
+                primal = max([np.abs(x - average[f]).max()
+                              for (k, f), x in copies.items()] + [0])
+                dual = self.rho * max([np.abs(average[f] - previous[f]).max()
+                                       for f in self.exchanges] + [0])
+                self.residuals.append((primal, dual))
+                logging.info(
+                    "ADMM iteration {}: residuals {} and {}.".format(
+                        iteration, primal, dual))
+                if max(primal, dual) <= self.tolerance:
+                    break
+
+            # the regions are still solved for the prices of the last tasks
+            outputs = workers.map(_solve_region, [
+                task[:-1] + (True,) for task in tasks])
+        finally:
+            workers.close()
+
+        self.converged = max(self.residuals[-1]) <= self.tolerance
+        if not self.converged:
+            logging.warning(
+                "The exchanged flows still differ by {} after {} "
+                "iterations.".format(max(self.residuals[-1]),
+                                     len(self.residuals)))
+
+        results = UserDict()
+        results.objectives = []
+        for nodes, output in zip(regions, outputs):
+            result = _nest(keys.decode(output[2]), output[0])
+            # flows into the region are taken from the region of their source
+            for i, targets in result.items():
+                merged = results.setdefault(i, UserDict())
+                for o, series in targets.items():
+                    if i in nodes or o not in merged:
+                        merged[o] = series
+            results.objectives.append(output[0])
+        for i, o in self.exchanges:
+            results[i][o].data = average[i, o].tolist()
+        results.objective = sum(results.objectives)
+        self.es.results = results
+        return results
+
+
+class Benders:
+    r""" Solves an investment model by Benders decomposition into a master
+    problem choosing the investments and operational subproblems, which are
+    solved for the chosen investments in a pool of processes.
+
+    The horizon is split into blocks, e.g. weather years or representative
+    periods, which are built as models of their own with their invest
+    variables fixed to the values chosen by the master problem. From the
+    costs of each block and the duals of the constraints fixing its
+    investments follows a cut, a lower bound of its operational costs for
+    all investments, which is added to the master problem. The master
+    problem holds the invest variables and the constraints linking those of
+    storages and their flows, while the costs of operating each block are
+    only known to it by these cuts. It is solved again until its objective,
+    a lower bound of the costs, comes close enough to the costs of the best
+    investments seen so far, an upper bound.
+
+    Each block stands for a share of the horizon, in proportion to its
+    number of timesteps times its weight. Its costs are weighted by its
+    weight divided by this share, so that the costs of its model count the
+    costs of all its occurrences as those of the whole horizon, and its
+    occurrences together have to meet the same share of the summed limits
+    of the flows. Storages wrap around within each block, and the
+    subproblems have to be linear and feasible for every investment, e.g.
+    by means of a costly source covering the demand which can't be met.
+
+    Parameters
+    ----------
+    es : EnergySystem object
+        The energy system to solve.
+    blocks : int or list of lists
+        The number of blocks to split the horizon into, or the timesteps of
+        each block.
+    weights : list of floats (optional)
+        The number of times each block occurs in the horizon, e.g. the
+        number of days a representative day stands for. Defaults to once.
+    processes : int (optional)
+        The number of worker processes, defaulting to the number of CPUs
+        but not more than the number of blocks. Each worker keeps the models
+        of its blocks between the iterations. With a single process, the
+        blocks are solved in the current process. Worker processes are
+        forked, so they don't work on platforms which can't fork.
+    addresses : list of tuples (optional)
+        Instead of forking processes, connect to workers run by
+        :func:`serve` at these addresses, e.g. on other hosts.
+    authkey : bytes (optional)
+        The secret shared with the workers at the `addresses`.
+    tolerance : float
+        The gap between the bounds at which to stop, relative to the upper
+        bound if it's larger than one.
+    max_iterations : int
+        The number of iterations after which to stop even if the gap is
+        larger than the tolerance.
+    lower_bound : float
+        A lower bound of the operational costs of the whole horizon, which
+        bounds the master problem before it has cuts. Zero holds as long as
+        no costs are negative.
+    model : class
+        The model built for each block, :class:`.OperationalModel` or
+        :class:`.SparseOperationalModel`.
+    \**kwargs :
+        Further arguments for the models. `timesteps` restricts the horizon
+        split into blocks to these timesteps.
+
+    Attributes
+    ----------
+    lower_bounds, upper_bounds : list
+        The bounds of the costs in every iteration.
+    gaps : list
+        The gap between the bounds in every iteration.
+    converged : bool
+        Whether the gap closed within the tolerance.
+    invest : dict
+        The best investments found, keyed like the invest variables by
+        `(source, target)` tuples for flows and by storages.
+
+    Examples
+    --------
+    Planning investments for ten weather years on ten cores:
+
+    >>> bd = Benders(es, blocks=10, processes=10)  # doctest: +SKIP
+    >>> bd.solve(solver='cbc')  # doctest: +SKIP
+    >>> bd.converged, bd.gaps[-1]  # doctest: +SKIP
+    (True, 8.3e-05)
+    """
+    def __init__(self, es, blocks, weights=None, processes=None,
+                 addresses=None, authkey=None, tolerance=1e-4,
+                 max_iterations=100, lower_bound=0, model=OperationalModel,
+                 **kwargs):
+        for name in ('objective_weighting', 'periods', 'period_sequence'):
+            if name in kwargs:
+                raise ValueError(
+                    "The {} of the blocks is set by the decomposition.".format(
+                        name))
+        self._investments = _investments(es)
+        if not self._investments:
+            raise ValueError("The energy system has no investments.")
+        timesteps = list(kwargs.pop('timesteps', range(len(es.timeindex))))
+        if isinstance(blocks, int):
+            if not 0 < blocks <= len(timesteps):
+                raise ValueError(
+                    "The number of blocks has to be between 1 and {}.".format(
+                        len(timesteps)))
+            blocks = [b.tolist() for b in np.array_split(timesteps, blocks)]
+        self.blocks = [list(b) for b in blocks]
+        self.weights = list(weights if weights is not None else
+                            [1] * len(self.blocks))
+        if len(self.weights) != len(self.blocks):
+            raise ValueError("Every block needs a weight.")
+        sizes = np.array([len(b) for b in self.blocks]) * self.weights
+        #: The share of the horizon each block stands for.
+        self.shares = sizes / sizes.sum()
+        #: The weighting of the costs in the model of each block, which
+        #: counts them for all occurrences of the block and for the whole
+        #: horizon.
+        self.weightings = np.array(self.weights) / self.shares
+        self.es = es
+        self.processes = min(processes or multiprocessing.cpu_count(),
+                             len(self.blocks))
+        self.addresses = addresses
+        self.authkey = authkey
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.lower_bound = lower_bound
+        self.model = model
+        self.kwargs = kwargs
+        self.lower_bounds = []
+        self.upper_bounds = []
+        self.gaps = []
+        self.converged = False
+        self.invest = {}
+
+    def _master(self):
+        """ Returns the master problem over the invest variables, with one
+        variable for the operational costs of each block.
+        """
+        index = {key: k for k, (key, _, _) in enumerate(self._investments)}
+        master = po.ConcreteModel()
+        master.invest = po.Var(
+            range(len(index)), within=po.NonNegativeReals,
+            bounds=lambda m, k: (0, self._investments[k][1].maximum))
+        master.costs = po.Var(
+            range(len(self.blocks)),
+            bounds=lambda m, k: (self.lower_bound * self.shares[k], None))
+
+        master.links = po.ConstraintList()
+        for n in (key for key, _, _ in self._investments
+                  if isinstance(key, Storage)):
+            for key, ratio in (((n._input(), n),
+                                n.nominal_input_capacity_ratio),
+                               ((n, n._output()),
+                                n.nominal_output_capacity_ratio)):
+                master.links.add(master.invest[index[key]] ==
+                                 ratio * master.invest[index[n]])
+        master.cuts = po.ConstraintList()
+        master.objective = po.Objective(
+            expr=sum(costs * master.invest[k]
+                     for k, (_, _, costs) in enumerate(self._investments)) +
+            sum(master.costs.values()))
+        return master
+
+    def _cut(self, k, objective, duals, invest):
+        """ Returns the operational costs of all occurrences of block `k`
+        for the investments `invest`, given the `objective` of its model and
+        the `duals` of its investments, and their change per invested unit.
+        """
+        share = self.shares[k]
+        costs = {key: c for key, _, c in self._investments}
+        value = share * (objective - sum(costs[key] * invest[key]
+                                         for key in costs))
+        slopes = {key: share * (duals[key] - costs[key]) for key in costs}
+        return value, slopes
+
+    def solve(self, solver='glpk', solver_io='lp', **kwargs):
+        r""" Solves the master problem and the blocks until the gap between
+        the bounds closes, and stores the results of the best investments in
+        the energy system.
+
+        The results are structured like those of :meth:`.RollingHorizon.solve`,
+        with the results of the blocks concatenated in their order. The
+        investments are found in the `invest` attributes of the flows and
+        storages, the total costs in `objective` and the operational costs of
+        each block in `objectives`.
+
+        Parameters
+        ----------
+        solver : string
+        solver_io : string
+        \**kwargs :
+            See :meth:`.OperationalModel.solve`, used for the master problem
+            and the blocks.
+        """
+        keys = _Keys(self.es)
+        master = self._master()
+        index = {key: k for k, (key, _, _) in enumerate(self._investments)}
+        opt = SolverFactory(solver, solver_io=solver_io)
+        for option, value in kwargs.get('cmdline_options', {}).items():
+            opt.options[option] = value
+        blocks = list(zip(self.blocks, self.weightings))
+
+        workers = _Workers(self.es, self.model, self.kwargs, blocks,
+                           self.processes, self.addresses, self.authkey)
+
+        def run(invest, results=False):
+            return workers.map(_solve_block, [
+                (k, keys.encode(invest), solver, solver_io, kwargs, results)
+                for k in range(len(blocks))])
+
+        try:
+            self.lower_bounds, self.upper_bounds, self.gaps = [], [], []
+            best = np.inf
+            for iteration in range(self.max_iterations):
+                opt.solve(master, **kwargs.get('solve_kwargs', {}))
+                invest = {key: master.invest[k].value or 0
+                          for key, k in index.items()}
+                lower = po.value(master.objective)
+
+                upper = sum(costs * invest[key]
+                            for key, _, costs in self._investments)
+                for k, output in enumerate(run(invest)):
+                    value, slopes = self._cut(k, output[0],
+                                              keys.decode(output[1]), invest)
+                    upper += value
+                    master.cuts.add(master.costs[k] >= value + sum(
+                        slope * (master.invest[index[key]] - invest[key])
+                        for key, slope in slopes.items()))
+                if upper < best:
+                    best, self.invest = upper, invest
+
+                self.lower_bounds.append(lower)
+                self.upper_bounds.append(best)
+                self.gaps.append(max(best - lower, 0) / max(abs(best), 1))
+                logging.info(
+                    "Benders iteration {}: costs between {} and {}.".format(
+                        iteration, lower, best))
+                if self.gaps[-1] <= self.tolerance:
+                    break
+
+            outputs = run(self.invest, results=True)
+        finally:
+            workers.close()
+
+        self.converged = self.gaps[-1] <= self.tolerance
+        if not self.converged:
+            logging.warning(
+                "The bounds still differ by {} after {} iterations.".format(
+                    self.gaps[-1], len(self.gaps)))
+
+        parts = [(_nest(keys.decode(output[2]), output[0]), len(block))
+                 for block, output in zip(self.blocks, outputs)]
+        results = _stitch(parts)
+        for key, value in self.invest.items():
+            i, o = key if isinstance(key, tuple) else (key, key)
+            results[i][o].invest = value
+        results.objective = self.upper_bounds[-1]
+        results.objectives = [
+            self._cut(k, output[0], keys.decode(output[1]), self.invest)[0]
+            for k, output in enumerate(outputs)]
+        self.es.results = results
+        return results
@@ -65,6 +65,8 @@ discrete_flow_grouping = groupings.FlowsWithNodes(
     filter=lambda stf: stf[2].discrete is not None)
 
 
+# The flow groupings below are all plain `FlowsWithNodes` instances, so energy
+# systems evaluate them in a single fused pass over each node's flows.
 GROUPINGS = [constraint_grouping, investment_flow_grouping,
              standard_flow_grouping, binary_flow_grouping, 
              discrete_flow_grouping]
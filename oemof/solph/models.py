@@ -6,12 +6,83 @@
 from collections import UserDict, UserList
 from itertools import groupby
 import pyomo.environ as po
-from pyomo.opt import SolverFactory
 from pyomo.core.plugins.transform.relax_integrality import RelaxIntegrality
 from oemof.solph import blocks
-from .network import Storage
+from .network import Flow, Storage
 from .options import Investment
 from .plumbing import Sequence
+from .session import SolverSession
+
+#: The attributes which can be changed via :meth:`OperationalModel.update`
+#: for each kind of object.
+UPDATABLE = ((Flow, ('variable_costs', 'actual_value', 'min', 'max')),
+             (Storage, ('capacity_loss',)),
+             (Investment, ('ep_costs',)))
+
+
+def _set_attributes(obj, attributes):
+    """ Sets the updatable `attributes` of `obj`, converting time series to
+    sequences.
+    """
+    for cls, names in UPDATABLE:
+        if isinstance(obj, cls):
+            break
+    else:
+        raise ValueError("Can't update objects of type {}.".format(
+            type(obj).__name__))
+    for name, value in attributes.items():
+        if name not in names:
+            raise ValueError("Can't update {!r} of {}.".format(
+                name, type(obj).__name__))
+        setattr(obj, name, value if cls is Investment else Sequence(value))
+
+
+def _check_initial_storages(storages, old, new):
+    """ Raises a ValueError if the `storages` given an initial state differ
+    between the `old` and the `new` initial state of a model.
+    """
+    if [n for n in storages if n in old] != [n for n in storages if n in new]:
+        raise ValueError(
+            "Can't change the storages given an initial state by updating. "
+            "Please build the model anew.")
+
+
+def _flows(es):
+    """ Returns the flows of the nodes of `es` keyed by `(source, target)`.
+
+    Besides the outputs of the nodes, these are the flows into them from
+    nodes outside of `es`, e.g. into a region split off a larger energy
+    system. Such a flow is only bounded, as its constraints and costs belong
+    to the model of its source.
+    """
+    flows = {(source, target): flow
+             for source in es.nodes
+             for target, flow in source.outputs.items()}
+    for target in es.nodes:
+        for source, flow in target.inputs.items():
+            flows.setdefault((source, target), flow)
+    return flows
+
+
+def _period_sequence(model, kwargs):
+    """ Returns the `period_sequence` given in `kwargs`, after checking it
+    against the periods and states of the `model`.
+    """
+    sequence = kwargs.get('period_sequence')
+    if sequence is None:
+        return None
+    sequence = [int(p) for p in sequence]
+    if model.periods is None:
+        raise ValueError("A period sequence needs periods.")
+    if not sequence or not all(0 <= p < len(model.periods)
+                               for p in sequence):
+        raise ValueError("The period sequence has to consist of indices of "
+                         "the {} periods.".format(len(model.periods)))
+    if model.final_state or any(isinstance(key, Storage)
+                                for key in model.initial_state):
+        raise ValueError("Storages linked over periods can't be given an "
+                         "initial or final state.")
+    return sequence
 
 # #############################################################################
 #
@@ -62,6 +133,41 @@ class OperationalModel(po.ConcreteModel):
         solph.plumbing.Sequence() object for time dependent timeincrement.
         If a list is provided this list will be taken. Default is calculated
         from timeindex if provided.
+    initial_state : dict (optional)
+        The state of the energy system before the first timestep, as
+        returned by :meth:`state`. Storages (without investment) found in it
+        start from the given capacity instead of the capacity at the last
+        timestep, and binary flows, keyed by `(source, target)`, from the
+        given status instead of their `initial_status`. Flows with
+        gradients, keyed by their :class:`.Flow` object, can only change by
+        their gradients from the given value in the first timestep.
+    final_state : dict (optional)
+        Capacities the storages found in it have to reach at the last
+        timestep.
+    final_values : dict (optional)
+        Values of the energy left in the storages found in it at the last
+        timestep, per unit of capacity, which are subtracted from the
+        objective, e.g. the value of water kept in a reservoir.
+    periods : list of lists (optional)
+        Splits the timesteps into periods, e.g. representative days, which
+        replace `timesteps`. Storages wrap around within each period, and
+        gradients and startups start anew at the beginning of each period.
+        Defaults to one period of all timesteps.
+    objective_weighting : float or list of floats (optional)
+        Weights of the timesteps in the objective and in summed flow
+        limits, e.g. the number of days represented by a typical day.
+        Defaults to 1.
+    period_sequence : list of ints (optional)
+        The sequence of the original periods of the horizon, given by the
+        index of the period in `periods` representing each of them. Storages
+        are then chained over this sequence instead of wrapping around
+        within each period: their capacities become states within the
+        representative periods, starting from zero, and the capacity before
+        each period of the sequence is an inter-period state, which the
+        state of the next period follows from. The capacity has to stay
+        within its bounds in every period of the sequence, where the losses
+        of the inter-period state within a period are neglected. Storages
+        can't be given an `initial_state` or `final_state` then.
 
     **The following sets are created:**
 
@@ -112,6 +218,11 @@ class OperationalModel(po.ConcreteModel):
         self.es = es
         self.timeindex = kwargs.get('timeindex', es.timeindex)
         self.timesteps = kwargs.get('timesteps', range(len(self.timeindex)))
+        self.periods = kwargs.get('periods')
+        if self.periods is not None:
+            self.timesteps = [t for period in self.periods for t in period]
+        self.objective_weighting = Sequence(kwargs.get('objective_weighting',
+                                                       1))
         self.timeincrement = kwargs.get('timeincrement',
                                         self.timeindex.freq.nanos / 3.6e12)
 
@@ -120,14 +231,16 @@ class OperationalModel(po.ConcreteModel):
 
         if self.timesteps is None:
             raise ValueError("Missing timesteps!")
-        self._constraint_groups = OperationalModel.CONSTRAINT_GROUPS
-        self._constraint_groups.extend(kwargs.get('constraint_groups', []))
+        self.initial_state = kwargs.get('initial_state', {})
+        self.final_state = kwargs.get('final_state', {})
+        self.final_values = kwargs.get('final_values', {})
+        self.period_sequence = _period_sequence(self, kwargs)
+        self._constraint_groups = (OperationalModel.CONSTRAINT_GROUPS +
+                                   kwargs.get('constraint_groups', []))
 
         # dictionary with all flows containing flow objects as values und
         # tuple of string representation of oemof nodes (source, target)
-        self.flows = {(source, target): source.outputs[target]
-                      for source in es.nodes
-                      for target in source.outputs}
+        self.flows = _flows(es)
 
         # ###########################  SETS  ##################################
         # set with all nodes
@@ -136,11 +249,14 @@ class OperationalModel(po.ConcreteModel):
         # pyomo set for timesteps of optimization problem
         self.TIMESTEPS = po.Set(initialize=self.timesteps, ordered=True)
 
-        # previous timesteps
-        previous_timesteps = [x - 1 for x in self.timesteps]
-        previous_timesteps[0] = self.timesteps[-1]
-
-        self.previous_timesteps = dict(zip(self.TIMESTEPS, previous_timesteps))
+        # previous timesteps, wrapping around within each period
+        periods = [list(period) for period in (
+            self.periods if self.periods is not None else [self.timesteps])]
+        self.previous_timesteps = {}
+        for period in periods:
+            self.previous_timesteps.update(zip(period,
+                                               period[-1:] + period[:-1]))
+        self.first_timesteps = set(period[0] for period in periods)
         # self.PREVIOUS_TIMESTEPS = po.Set(self.TIMESTEPS,
         #                            initialize=dict(zip(self.TIMESTEPS,
         #                                                previous_timesteps)))
@@ -169,25 +285,7 @@ class OperationalModel(po.ConcreteModel):
 
         # loop over all flows and timesteps to set flow bounds / values
         for (o, i) in self.FLOWS:
-            for t in self.TIMESTEPS:
-                if self.flows[o, i].actual_value[t] is not None and (
-                        self.flows[o, i].nominal_value is not None):
-                    # pre- optimized value of flow variable
-                    self.flow[o, i, t].value = (
-                        self.flows[o, i].actual_value[t] *
-                        self.flows[o, i].nominal_value)
-                    # fix variable if flow is fixed
-                    if self.flows[o, i].fixed:
-                        self.flow[o, i, t].fix()
-
-                if self.flows[o, i].nominal_value is not None and (
-                        self.flows[o, i].binary is None):
-                    # upper bound of flow variable
-                    self.flow[o, i, t].setub(self.flows[o, i].max[t] *
-                                             self.flows[o, i].nominal_value)
-                    # lower bound of flow variable
-                    self.flow[o, i, t].setlb(self.flows[o, i].min[t] *
-                                             self.flows[o, i].nominal_value)
+            self._set_flow_bounds(o, i)
 
         self.positive_flow_gradient = po.Var(self.POSITIVE_GRADIENT_FLOWS,
                                              self.TIMESTEPS,
@@ -211,11 +309,158 @@ class OperationalModel(po.ConcreteModel):
         # ########################### Objective ###############################
         self.objective_function()
 
+    def _set_flow_bounds(self, o, i):
+        """ Sets bounds and values of the flow variables from `o` to `i`.
+        """
+        f = self.flows[o, i]
+        # nothing to set if there is no nominal value
+        if f.nominal_value is None:
+            return
+        for t in self.TIMESTEPS:
+            if f.actual_value[t] is not None:
+                # pre- optimized value of flow variable
+                self.flow[o, i, t].value = (f.actual_value[t] *
+                                            f.nominal_value)
+                # fix variable if flow is fixed
+                if f.fixed:
+                    self.flow[o, i, t].fix()
+
+            if f.binary is None:
+                # upper bound of flow variable
+                self.flow[o, i, t].setub(f.max[t] * f.nominal_value)
+                # lower bound of flow variable
+                self.flow[o, i, t].setlb(f.min[t] * f.nominal_value)
+
+        # the flow can only change by its gradients from the given value
+        if f in self.initial_state:
+            t = self.TIMESTEPS[1]
+            previous = self.initial_state[f]
+            flow = self.flow[o, i, t]
+            if f.positive_gradient[0] is not None:
+                flow.setub(min(
+                    previous + f.positive_gradient[t] * f.nominal_value,
+                    float('inf') if flow.ub is None else flow.ub))
+            if f.negative_gradient[0] is not None:
+                flow.setlb(max(
+                    previous - f.negative_gradient[t] * f.nominal_value,
+                    flow.lb or 0))
+
+    def _recreate(self, constraint, key, wanted=True, steps=None):
+        """ Recreates the rows of the time dependent `constraint` indexed by
+        `key` via the constraint's rule, or deletes them if not `wanted`.
+
+        The rows are those of all timesteps, or of the given `steps`.
+        """
+        block = constraint.parent_block()
+        for t in (self.TIMESTEPS if steps is None else steps):
+            index = key + (t,)
+            if not wanted:
+                if index in constraint:
+                    del constraint[index]
+            elif index in constraint:
+                constraint[index].set_value(constraint.rule(block, *index))
+            else:
+                constraint.add(index, constraint.rule(block, *index))
+
+    def update(self, obj=None, initial_state=None, **attributes):
+        r""" Changes `attributes` of `obj` and patches the bounds,
+        constraints and objective of the model depending on them, so that
+        the model can be solved again without building it anew.
+
+        Only the variables and rows belonging to `obj` are touched, while the
+        objective is recreated if costs change.
+
+        Parameters
+        ----------
+        obj : Flow, Storage or Investment (optional)
+            The object to change.
+        initial_state : dict (optional)
+            Replaces the `initial_state` of the model, patching the rows and
+            bounds of the first timestep which depend on it. The storages
+            given an initial state can't change, as this changes the
+            structure of the model.
+        \**attributes :
+            The new values. See :const:`UPDATABLE` for the attributes which
+            can be changed for each kind of object.
+
+        Examples
+        --------
+        Doubling the fuel costs of a power plant `pp` fed by the bus `gas`:
+
+        >>> om.update(gas.outputs[pp], variable_costs=60)  # doctest: +SKIP
+        >>> om.solve()  # doctest: +SKIP
+        """
+        if initial_state is not None:
+            self._update_initial_state(initial_state)
+        if obj is None:
+            return
+        _set_attributes(obj, attributes)
+        costs = isinstance(obj, Investment) or 'variable_costs' in attributes
+
+        if isinstance(obj, Flow):
+            for i, o in [k for k, f in self.flows.items() if f is obj]:
+                self._set_flow_bounds(i, o)
+                minimum = sum(obj.min[t] for t in self.TIMESTEPS) > 0
+                if obj.investment is not None:
+                    block = self.InvestmentFlow
+                    if obj.fixed:
+                        self._recreate(block.fixed, (i, o))
+                    self._recreate(block.max, (i, o))
+                    self._recreate(block.min, (i, o), minimum)
+                    if minimum and (i, o) not in block.MIN_FLOWS:
+                        block.MIN_FLOWS.add((i, o))
+                    elif not minimum and (i, o) in block.MIN_FLOWS:
+                        block.MIN_FLOWS.remove((i, o))
+                if obj.binary is not None:
+                    block = self.BinaryFlow
+                    self._recreate(block.min, (i, o), minimum)
+                    self._recreate(block.max, (i, o), minimum)
+                    if minimum and (i, o) not in block.MIN_FLOWS:
+                        block.MIN_FLOWS.add((i, o))
+                    elif not minimum and (i, o) in block.MIN_FLOWS:
+                        block.MIN_FLOWS.remove((i, o))
+
+        if isinstance(obj, Storage):
+            block = (self.Storage if obj.investment is None else
+                     self.InvestmentStorage)
+            self._recreate(block.balance, (obj,))
+            if self.period_sequence is not None:
+                for constraint in (block.inter_balance, block.inter_lower):
+                    self._recreate(constraint, (obj,), steps=block.SEQUENCE)
+
+        if costs:
+            self.objective_function(update=True)
+
+    def _update_initial_state(self, initial_state):
+        """ Replaces the `initial_state` and recreates the storage balances,
+        startup and shutdown constraints and flow bounds depending on it.
+        """
+        storages = list(getattr(self.Storage, 'STORAGES', []))
+        _check_initial_storages(storages, self.initial_state, initial_state)
+        self.initial_state = dict(initial_state)
+        for n in storages:
+            if n in initial_state:
+                self._recreate(self.Storage.balance, (n,),
+                               steps=[self.TIMESTEPS[1]])
+        for name, flows in (('startup_constr', 'STARTUPFLOWS'),
+                            ('shutdown_constr', 'SHUTDOWNFLOWS')):
+            for i, o in getattr(self.BinaryFlow, flows, []):
+                self._recreate(getattr(self.BinaryFlow, name), (i, o),
+                               steps=sorted(self.first_timesteps))
+        for i, o in set(self.POSITIVE_GRADIENT_FLOWS) | set(
+                self.NEGATIVE_GRADIENT_FLOWS):
+            self._set_flow_bounds(i, o)
+
     def objective_function(self, sense=po.minimize, update=False):
         """
         """
         if update:
             self.del_component('objective')
+            # the blocks recreate their cost expressions below
+            for block in self.component_objects(po.Block):
+                for expression in list(block.component_objects(
+                        po.Expression, descend_into=False)):
+                    block.del_component(expression)
 
         expr = 0
 
@@ -265,6 +510,10 @@ class OperationalModel(po.ConcreteModel):
 
         :attr:`om.results()[stor][stor].invest` attribute
 
+        If the storages are linked over a `period_sequence`, their values are
+        the intra-period states, and the inter-period states are found in
+        the :attr:`om.results()[stor][stor].inter_capacity` attribute.
+
         For the investment flow of a 'transformer' trsf to the bus 'bel' this
         can be accessed with:
 
@@ -280,21 +529,24 @@ class OperationalModel(po.ConcreteModel):
 
         result = UserDict()
         result.objective = self.objective()
+        nodes = set(self.es.nodes)
         for i, o in self.flows:
 
             result[i] = result.get(i, UserDict())
             result[i][o] = UserList([self.flow[i, o, t].value
                                      for t in self.TIMESTEPS])
+            if i not in nodes:
+                continue
 
             if isinstance(i, Storage):
-                if i.investment is None:
-                    result[i][i] = UserList(
-                        [self.Storage.capacity[i, t].value
-                         for t in self.TIMESTEPS])
-                else:
-                    result[i][i] = UserList(
-                        [self.InvestmentStorage.capacity[i, t].value
-                         for t in self.TIMESTEPS])
+                block = (self.Storage if i.investment is None else
+                         self.InvestmentStorage)
+                result[i][i] = UserList([block.capacity[i, t].value
+                                         for t in self.TIMESTEPS])
+                if self.period_sequence is not None:
+                    setattr(result[i][i], 'inter_capacity',
+                            [block.inter_capacity[i, d].value
+                             for d in block.SEQUENCE])
 
             if isinstance(self.flows[i, o].investment, Investment):
                 setattr(result[i][o], 'invest',
@@ -316,6 +568,25 @@ class OperationalModel(po.ConcreteModel):
 
         return result
 
+    def state(self, t):
+        """ Returns the state of the energy system at timestep `t` after
+        solving, which can be passed on as the `initial_state` of a model
+        starting at the following timestep.
+
+        The state maps storages without investment to their capacity, binary
+        flows, keyed by `(source, target)`, to their status and flows with
+        gradients, keyed by their :class:`.Flow` object, to their value.
+        """
+        state = {}
+        for n in getattr(self.Storage, 'STORAGES', []):
+            state[n] = self.Storage.capacity[n, t].value
+        for i, o in getattr(self.BinaryFlow, 'BINARY_FLOWS', []):
+            state[i, o] = round(self.BinaryFlow.status[i, o, t].value)
+        for i, o in set(self.POSITIVE_GRADIENT_FLOWS) | set(
+                self.NEGATIVE_GRADIENT_FLOWS):
+            state[self.flows[i, o]] = self.flow[i, o, t].value
+        return state
+
     def solve(self, solver='glpk', solver_io='lp', **kwargs):
         r""" Takes care of communication with solver to solve the model.
 
@@ -341,25 +612,8 @@ class OperationalModel(po.ConcreteModel):
             {"method": 2}
 
         """
-        solve_kwargs = kwargs.get('solve_kwargs', {})
-        solver_cmdline_options = kwargs.get("cmdline_options", {})
-
-        opt = SolverFactory(solver, solver_io=solver_io)
-        # set command line options
-        options = opt.options
-        for k in solver_cmdline_options:
-            options[k] = solver_cmdline_options[k]
-
-        results = opt.solve(self, **solve_kwargs)
-
-        self.solutions.load_from(results)
-
-        # storage optimization results in result dictionary of energysystem
-        self.es.results = self.results()
-        self.es.results.objective = self.objective()
-        self.es.results.solver = results
-
-        return results
+        return SolverSession(self, solver, solver_io, warmstart=False,
+                             **kwargs).resolve()
 
     def relax_problem(self):
         """ Relaxes integer variables to reals of optimization model self
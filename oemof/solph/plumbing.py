@@ -2,16 +2,39 @@
 """
 
 """
-from collections import abc, UserList
+from collections import abc
+from contextlib import ExitStack
+from functools import wraps
+import hashlib
+import inspect
+import logging
+import os
+
+import numpy as np
 
 from .. import network
+from ..energy_system import read_snapshot, write_snapshot
+from ..tools import helpers
 from .options import BinaryFlow, Investment
 
 
 def Sequence(sequence_or_scalar):
     """ Tests if an object is sequence (except string) or scalar and returns
-    a the original sequence if object is a sequence and a 'emulated' sequence
-    object of class _Sequence if object is a scalar or string.
+    a sequence object backed by a NumPy array if object is a list, tuple,
+    NumPy array or pandas Series, an 'emulated' constant sequence object of
+    class _Sequence if object is a scalar or string and the original object
+    otherwise.
+
+    NumPy arrays and pandas Series aren't copied. They are wrapped in a
+    read-only view sharing memory with the original object, which is
+    indexed by position, regardless of the index of a Series. The view
+    can't be written to, but changes of the original object show through.
+
+    If the current :attr:`registry <oemof.network.Node.registry>` has a
+    :class:`sequence pool <oemof.energy_system.SequencePool>`, the data of
+    sequences owning their data, i.e. those created from lists or tuples,
+    is interned there, so that sequences with equal contents share one
+    buffer. Views aren't interned, as their data belongs to the caller.
 
     Parameters
     ----------
@@ -26,64 +49,301 @@ def Sequence(sequence_or_scalar):
     >>> x[0]
     10
 
-    >>> x[10]
+    >>> x[8760]
     10
+    >>> x.is_constant, x.value
+    (True, 10)
     >>> print(x)
-    [10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10]
+    _Sequence(default=10)
 
     """
-    if (isinstance(sequence_or_scalar, abc.Iterable) and not
+    if isinstance(sequence_or_scalar, (_Sequence, _ArraySequence)):
+        return sequence_or_scalar
+    elif isinstance(sequence_or_scalar, (list, tuple)):
+        sequence = _ArraySequence(sequence_or_scalar)
+    elif (isinstance(sequence_or_scalar, np.ndarray) or
+            isinstance(getattr(sequence_or_scalar, 'values', None),
+                       np.ndarray)):
+        sequence = _ArraySequence(sequence_or_scalar, copy=False)
+    elif (isinstance(sequence_or_scalar, abc.Iterable) and not
             isinstance(sequence_or_scalar, str)):
         return sequence_or_scalar
     else:
         return _Sequence(default=sequence_or_scalar)
+    pool = getattr(network.Node.registry, 'sequences', None)
+    if pool is not None:
+        sequence.data = pool.intern(sequence.data)
+    return sequence
 
 
-class _Sequence(UserList):
+class _Sequence:
     """ Emulates a list whose length is not known in advance.
 
+    Every element is `default`, unless it has been set explicitly. Reading
+    elements doesn't store anything, so a scalar takes up constant memory
+    regardless of how many timesteps it is read for.
+
     Parameters
     ----------
-    source:
     default:
-
+        The value of all elements not set explicitly.
 
     Examples
     --------
     >>> s = _Sequence(default=42)
-    >>> len(s)
-    0
     >>> s[2]
     42
-    >>> len(s)
-    3
+    >>> s.is_constant
+    True
     >>> s[0] = 23
-    >>> s
-    [23, 42, 42]
+    >>> s[0:3]
+    array([23, 42, 42])
+    >>> s.is_constant
+    False
 
     """
+    __iter__ = None
+
     def __init__(self, *args, **kwargs):
         self.default = kwargs["default"]
-        super().__init__(*args)
+        self._explicit = dict(enumerate(args[0])) if args else {}
+
+    @property
+    def is_constant(self):
+        """ True if all elements are equal to :attr:`default`.
+        """
+        return all(v == self.default for v in self._explicit.values())
+
+    @property
+    def value(self):
+        """ The value of all elements if the sequence :attr:`is_constant`.
+        """
+        if not self.is_constant:
+            raise ValueError("Sequence is not constant.")
+        return self.default
 
     def __getitem__(self, key):
-        try:
-            return self.data[key]
-        except IndexError:
-            self.data.extend([self.default] * (key - len(self.data) + 1))
+        if isinstance(key, slice):
+            if key.stop is None:
+                raise ValueError(
+                    "Slicing a sequence of unknown length needs a stop.")
+            indices = range(*key.indices(key.stop))
+            result = np.full(len(indices), self.default,
+                             dtype=None if self.default is not None
+                             else object)
+            for position, index in enumerate(indices):
+                if index in self._explicit:
+                    result[position] = self._explicit[index]
+            return result
+        if self._explicit:
+            return self._explicit.get(key, self.default)
+        return self.default
+
+    def __setitem__(self, key, value):
+        self._explicit[key] = value
+
+    def __repr__(self):
+        return "_Sequence(default={!r})".format(self.default)
+
+
+class _ArraySequence:
+    """ A sequence of known length backed by a NumPy array.
+
+    Reading single elements returns plain Python scalars, while slicing
+    returns (views of) NumPy arrays. Copied data which has become read-only,
+    e.g. because it has been interned, is copied again on write, so only
+    views of data not owned by the sequence are really read-only.
+
+    Parameters
+    ----------
+    data: array-like
+        The elements of the sequence.
+    copy: bool
+        If `False`, `data` isn't copied but viewed read-only, sharing memory
+        with `data`.
+
+    Examples
+    --------
+    >>> s = _ArraySequence([0.5, 0.5, 0.5])
+    >>> s[1]
+    0.5
+    >>> list(s[1:])
+    [0.5, 0.5]
+    >>> s.is_constant, s.value
+    (True, 0.5)
+
+    """
+    def __init__(self, data, copy=True):
+        if copy:
+            self.data = np.array(data)
+        else:
+            self.data = np.asarray(data).view()
+            self.data.flags.writeable = False
+        self._view = not copy
+        self._constant = None
+
+    @property
+    def is_constant(self):
+        """ True if all elements are equal.
+        """
+        if self._constant is None:
+            self._constant = bool(len(self.data) == 0 or
+                                  (self.data == self.data[0]).all())
+        return self._constant
+
+    @property
+    def value(self):
+        """ The value of all elements if the sequence :attr:`is_constant`.
+        """
+        if not self.is_constant or not len(self.data):
+            raise ValueError("Sequence is not constant.")
+        return self.data.item(0)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
             return self.data[key]
+        return self.data.item(key)
 
     def __setitem__(self, key, value):
-        try:
-            self.data[key] = value
-        except IndexError:
-            self.data.extend([self.default] * (key - len(self.data) + 1))
-            self.data[key] = value
+        if not (self._view or self.data.flags.writeable):
+            self.data = self.data.copy()
+        self.data[key] = value
+        self._constant = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data.tolist())
 
+    def __repr__(self):
+        return repr(self.data.tolist())
 
+
+class ScenarioCache:
+    """ A size bounded on-disk cache of the nodes built by scenario readers.
+
+    Entries are keyed by a hash of the reader, the contents of the files it
+    reads and its remaining arguments. They are stored as :func:`snapshots
+    <oemof.energy_system.write_snapshot>`, so restoring them is much faster
+    than parsing the files again. When the total size of all entries exceeds
+    `max_size` bytes, the least recently used ones are evicted.
+
+    Parameters
+    ----------
+    directory : string
+        The name of the cache directory inside the basic oemof path, see
+        :func:`oemof.tools.helpers.extend_basic_path`.
+    max_size : integer
+        The maximum total size of all entries in bytes.
+
+    """
+    def __init__(self, directory='scenario_cache', max_size=2 ** 30):
+        self.path = helpers.extend_basic_path(directory)
+        self.max_size = max_size
+
+    def key(self, reader, arguments):
+        """ Compute the key of calling `reader` with `arguments`.
+
+        The `arguments` are a dictionary mapping parameter names to values.
+        Values naming an existing file contribute the contents of this file.
+        """
+        digest = hashlib.sha1(
+            '{}.{}'.format(reader.__module__, reader.__qualname__).encode())
+        for name, value in sorted(arguments.items()):
+            digest.update(name.encode())
+            if isinstance(value, str) and os.path.isfile(value):
+                with open(value, 'rb') as f:
+                    for block in iter(lambda: f.read(2 ** 20), b''):
+                        digest.update(block)
+            else:
+                digest.update(repr(value).encode())
+        return digest.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.oemof')
+
+    def load(self, key):
+        """ Restore the nodes stored under `key`.
+
+        Returns `None` if there's no such entry. Restored nodes are added to
+        the current :attr:`registry <oemof.network.Node.registry>`.
+        """
+        path = self._file(key)
+        if not os.path.isfile(path):
+            return None
+        registry = network.Node.registry
+        edges = getattr(registry, 'edges', None)
+        if edges is None:
+            edges = network.Edges()
+        try:
+            nodes, attributes = read_snapshot(path, edges)
+        except Exception:
+            logging.warning(
+                "Dropping unreadable scenario cache entry {}.".format(path))
+            os.remove(path)
+            return None
+        os.utime(path)
+        if registry is not None:
+            registry.add_many(nodes)
+        return dict(zip(attributes['labels'], nodes))
+
+    def store(self, key, nodes):
+        """ Store the dictionary of `nodes` under `key`.
+        """
+        path = self._file(key)
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        entities = list(nodes.values())
+        write_snapshot(temporary, entities,
+                       [(s, t, f) for s in entities
+                        for t, f in s.outputs.items()],
+                       {'labels': list(nodes)})
+        os.replace(temporary, path)
+        self._evict()
+
+    def _evict(self):
+        entries = sorted((os.path.join(self.path, name)
+                          for name in os.listdir(self.path)
+                          if name.endswith('.oemof')),
+                         key=os.path.getmtime, reverse=True)
+        size = 0
+        for entry in entries:
+            size += os.path.getsize(entry)
+            if size > self.max_size:
+                os.remove(entry)
+
+
+def _cached(reader):
+    """ Add a `cache` argument to the scenario `reader`.
+
+    If `cache` is a :class:`ScenarioCache`, the nodes are restored from it
+    if possible and stored in it otherwise. If `cache` is `True`, a
+    :class:`ScenarioCache` with the default settings is used.
+    """
+    signature = inspect.signature(reader)
+
+    @wraps(reader)
+    def cached_reader(*args, cache=None, **kwargs):
+        if not cache:
+            return reader(*args, **kwargs)
+        if cache is True:
+            cache = ScenarioCache()
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = cache.key(reader, arguments.arguments)
+        nodes = cache.load(key)
+        if nodes is None:
+            nodes = reader(*args, **kwargs)
+            cache.store(key, nodes)
+        return nodes
+
+    return cached_reader
+
+
+@_cached
 def NodesFromCSV(file_nodes_flows, file_nodes_flows_sequences,
                  delimiter=',', additional_classes={},
-                 additional_seq_attributes=[]):
+                 additional_seq_attributes=[], chunksize=None):
     """ Creates nodes with their respective flows and sequences from
     a pre-defined CSV structure. An example has been provided in the
     development examples
@@ -97,22 +357,162 @@ def NodesFromCSV(file_nodes_flows, file_nodes_flows_sequences,
                          of type {'MyClass1': MyClass1, ...}
     additional_seq_attributes : list of strings with attributes that have to be
                                 of type 'solph sequence'
-
+    chunksize : integer, optional
+        If given, the CSV file of sequences is read in chunks of this many
+        lines, which are written into an array allocated after counting the
+        lines in a first pass, so that the sequences are held in memory only
+        once. Only the columns referenced by a 'seq' entry in the CSV file
+        of nodes and flows are read in any case.
+    cache : :class:`ScenarioCache` or boolean, optional
+        If given, the nodes are restored from this cache if the files and
+        arguments haven't changed since they have been stored there, and
+        stored there otherwise. Use `True` for the default cache.
+
+    Notes
+    -----
+    The sequences are read into one array in which each sequence is a
+    contiguous column. Sequences are then created as views of these columns,
+    so they aren't copied again. If the current registry supports it, nodes
+    are created in :meth:`bulk <oemof.energy_system.EnergySystem.bulk>`.
     """
 
     import pandas as pd
-    from .network import (Bus, Source, Sink, Flow, LinearTransformer, Storage)
 
-    # dataframe creation and manipulation
-    nodes_flows = pd.read_csv(file_nodes_flows, sep=delimiter)
-    nodes_flows_seq = pd.read_csv(file_nodes_flows_sequences, sep=delimiter,
-                                  header=None)
-    nodes_flows_seq.dropna(axis=0, how='all', inplace=True)
-    nodes_flows_seq.drop(0, axis=1, inplace=True)
-    nodes_flows_seq = nodes_flows_seq.transpose()
-    nodes_flows_seq.set_index([0, 1, 2, 3, 4], inplace=True)
-    nodes_flows_seq.columns = range(0, len(nodes_flows_seq.columns))
-    nodes_flows_seq = nodes_flows_seq.astype(float)
+    def read_sequences(wanted):
+        # read the five header lines of the sequences, map them to their
+        # columns and read the wanted columns in one go or in chunks
+        header = pd.read_csv(file_nodes_flows_sequences, sep=delimiter,
+                             header=None, nrows=5, index_col=0, dtype=str)
+        columns = sorted(c for c in header.columns
+                         if tuple(header[c]) in wanted)
+        if not columns:
+            return {}
+        options = dict(sep=delimiter, header=None, skiprows=5,
+                       float_precision='round_trip')
+        if chunksize is None:
+            data = pd.read_csv(file_nodes_flows_sequences, usecols=columns,
+                               **options)
+            data = np.asfortranarray(
+                data.dropna(axis=0, how='all')[columns].values, dtype=float)
+        else:
+            # count the rows in a first pass over a single column, so that
+            # the chunks can be written into one preallocated array instead
+            # of being concatenated and copied again
+            rows = sum(len(chunk) for chunk in pd.read_csv(
+                file_nodes_flows_sequences, usecols=columns[:1],
+                chunksize=chunksize, **options))
+            data = np.empty((rows, len(columns)), order='F')
+            filled = 0
+            for chunk in pd.read_csv(file_nodes_flows_sequences,
+                                     usecols=columns, chunksize=chunksize,
+                                     **options):
+                chunk = chunk.dropna(axis=0, how='all')[columns].values
+                data[filled:filled + len(chunk)] = chunk
+                filled += len(chunk)
+            # rows without any values leave some rows unfilled at the end
+            data = data[:filled]
+        return {tuple(header[c]): data[:, position]
+                for position, c in enumerate(columns)}
+
+    return _nodes_from_frames(pd.read_csv(file_nodes_flows, sep=delimiter),
+                              read_sequences, additional_classes,
+                              additional_seq_attributes)
+
+
+_FORMATS = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather',
+            '.h5': 'hdf5', '.hdf5': 'hdf5', '.hdf': 'hdf5'}
+
+
+@_cached
+def NodesFromTables(file_nodes_flows, file_nodes_flows_sequences,
+                    format=None, separator='|', memory_map=True,
+                    additional_classes={}, additional_seq_attributes=[]):
+    """ Creates nodes with their respective flows and sequences from the
+    structure read by :func:`NodesFromCSV`, stored in Parquet, Feather or
+    HDF5 files instead of CSV files.
+
+    The table of nodes and flows has the same columns as the CSV file, but
+    they can be typed, e.g. numbers don't have to be parsed and booleans are
+    real booleans. Columns containing 'seq' markers have to be string
+    columns. The table of sequences has one float column per sequence,
+    named by joining the class, label, source, target and attribute the
+    sequence belongs to with `separator`, e.g. 'Sink|load|bus|load|
+    actual_value'. Only the columns needed by the nodes and flows are read.
+
+    Parquet and Feather files are read via `pyarrow`, HDF5 files via pandas,
+    which needs `pytables`. HDF5 files are expected to contain only one
+    table. The table of sequences has to be stored in the 'table' format,
+    as only those can be read selectively.
+
+    Parameters
+    ----------
+    file_nodes_flows : string with name of file of nodes and flows
+    file_nodes_flows_sequences : string with name of file of sequences
+    format : string, optional
+        One of 'parquet', 'feather' or 'hdf5'. Inferred from the extension
+        of `file_nodes_flows` if not given.
+    separator : string used to join the parts of sequence column names
+    memory_map : boolean
+        Whether Parquet and Feather files are memory mapped while reading.
+    additional_classes : dictionary with additional classes to be used in
+                         the table of type {'MyClass1': MyClass1, ...}
+    additional_seq_attributes : list of strings with attributes that have to be
+                                of type 'solph sequence'
+    cache : :class:`ScenarioCache` or boolean, optional
+        See :func:`NodesFromCSV`.
+
+    """
+    if format is None:
+        format = _FORMATS.get(os.path.splitext(file_nodes_flows)[1].lower())
+    if format not in set(_FORMATS.values()):
+        raise ValueError(
+            "Unknown table format: {}. Use one of {}.".format(
+                format, sorted(set(_FORMATS.values()))))
+
+    def read_sequences(wanted):
+        names = {separator.join(str(part) for part in key): key
+                 for key in wanted}
+        columns = sorted(names)
+        if not columns:
+            return {}
+        data = _read_table(file_nodes_flows_sequences, format, columns,
+                           memory_map)
+        data = np.asfortranarray(data[columns].values, dtype=float)
+        return {names[name]: data[:, position]
+                for position, name in enumerate(columns)}
+
+    return _nodes_from_frames(
+        _read_table(file_nodes_flows, format, memory_map=memory_map),
+        read_sequences, additional_classes, additional_seq_attributes)
+
+
+def _read_table(path, format, columns=None, memory_map=True):
+    """ Read the table in the file at `path` as a pandas DataFrame.
+
+    If `columns` is given, only these columns are read.
+    """
+    if format == 'hdf5':
+        import pandas as pd
+        return pd.read_hdf(path, columns=columns)
+    import pyarrow
+    from pyarrow import feather, parquet
+    source = pyarrow.memory_map(path) if memory_map else path
+    if format == 'parquet':
+        return parquet.read_table(source, columns=columns).to_pandas()
+    return feather.read_feather(source, columns=columns)
+
+
+def _nodes_from_frames(nodes_flows, read_sequences, additional_classes,
+                       additional_seq_attributes):
+    """ Create the nodes described by the rows of `nodes_flows`.
+
+    Does the actual work for :func:`NodesFromCSV` and
+    :func:`NodesFromTables`. The sequences are obtained by calling
+    `read_sequences` with the set of sequence keys, i.e. the class, label,
+    source, target and attribute of all cells marked with 'seq'. It has to
+    return a dictionary mapping these keys to arrays.
+    """
+    from .network import (Bus, Source, Sink, Flow, LinearTransformer, Storage)
 
     # class dictionary for dynamic instantiation
     classes = {'Source': Source, 'Sink': Sink,
@@ -131,18 +531,30 @@ def NodesFromCSV(file_nodes_flows, file_nodes_flows_sequences,
     flow_attrs = vars(Flow()).keys()
     bus_attrs = vars(Bus()).keys()
 
-    # iteration over dataframe rows to create objects
-    nodes = {}
-    for i, r in nodes_flows.iterrows():
+    # only keep lines which hold valid data and not just e.g. blank lines or
+    # data explanations for visual purposes
+    nodes_flows = nodes_flows[nodes_flows['class'].isin(list(classes))]
 
-        # check if current line holds valid data or is just for visual purposes
-        # e.g. a blank line or a line that contains data explanations
-        if isinstance(r['class'], str) and r['class'] in classes.keys():
+    # the sequences are addressed by the class, label, source, target and
+    # attribute of the cells marked with 'seq' in the nodes and flows
+    keys = ['class', 'label', 'source', 'target']
+    marked = nodes_flows.isin(['seq']).stack()
+    marked = marked[marked].index
+    wanted = set(tuple(nodes_flows.loc[row, keys]) + (attr,)
+                 for row, attr in marked)
+
+    sequences = read_sequences(wanted)
+
+    # iteration over the valid lines to create objects, in bulk if possible
+    registry = network.Node.registry
+    nodes = {}
+    with (registry.bulk() if hasattr(registry, 'bulk') else ExitStack()):
+        for i, r in zip(nodes_flows.index,
+                        nodes_flows.to_dict(orient='records')):
 
-            # drop NaN values from series
-            r = r.dropna()
-            # save column labels and row values in dict
-            row = dict(zip(r.index.values, r.values))
+            # save column labels and row values without missing (i.e. NaN or
+            # None) values in dict
+            row = {k: v for k, v in r.items() if v is not None and v == v}
 
             # create node if not existent and set attributes
             # (attributes must be placed either in the first line or in all
@@ -180,16 +592,15 @@ def NodesFromCSV(file_nodes_flows, file_nodes_flows_sequences,
                                     setattr(node, attr, row[attr])
 
                             else:
-                                seq = nodes_flows_seq.loc[row['class'],
-                                                          row['label'],
-                                                          row['source'],
-                                                          row['target'],
-                                                          attr]
+                                seq = sequences[row['class'],
+                                                row['label'],
+                                                row['source'],
+                                                row['target'],
+                                                attr]
                                 if attr in seq_attributes:
-                                    seq = [i for i in seq]
                                     seq = Sequence(seq)
                                 else:
-                                    seq = [i for i in seq.values]
+                                    seq = seq.tolist()
                                 setattr(node, attr, seq)
             except:
                 print('Error with node creation in line', i+2, 'in csv file.')
@@ -206,16 +617,15 @@ def NodesFromCSV(file_nodes_flows, file_nodes_flows_sequences,
                                 row[attr] = Sequence(float(row[attr]))
                             setattr(flow, attr, row[attr])
                         if row[attr] == 'seq':
-                            seq = nodes_flows_seq.loc[row['class'],
-                                                      row['label'],
-                                                      row['source'],
-                                                      row['target'],
-                                                      attr]
+                            seq = sequences[row['class'],
+                                            row['label'],
+                                            row['source'],
+                                            row['target'],
+                                            attr]
                             if attr in seq_attributes:
-                                seq = [i for i in seq]
                                 seq = Sequence(seq)
                             else:
-                                seq = [i for i in seq.values]
+                                seq = seq.tolist()
                             setattr(flow, attr, seq)
                         # this block is only for binary flows!
                         if attr == 'binary' and row[attr] is True:
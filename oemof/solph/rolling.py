@@ -0,0 +1,829 @@
+# -*- coding: utf-8 -*-
+"""Solving the dispatch of long time horizons in windows.
+
+The windows are either solved one after another, overlapping each other,
+or all at once in parallel processes, exchanging the states and values at
+their boundaries until they agree.
+
+"""
+
+from collections import OrderedDict, UserDict, UserList
+import logging
+import multiprocessing
+import numbers
+
+import numpy as np
+import pyomo.environ as po
+
+from .models import UPDATABLE, OperationalModel
+from .network import Storage
+from .plumbing import _ArraySequence, _Sequence
+from .session import SolverSession
+
+
+def _stitch(parts):
+    """ Concatenates the committed parts of the results of all windows.
+
+    `parts` are pairs of the results of a window and the number of its
+    timesteps which are committed. The attributes of the series, like
+    `invest`, are kept.
+    """
+    result = UserDict()
+    for window, commit in parts:
+        for i, outputs in window.items():
+            stitched = result.setdefault(i, UserDict())
+            for o, values in outputs.items():
+                series = stitched.setdefault(o, UserList())
+                series.extend(values[:commit])
+                series.__dict__.update(
+                    {k: v for k, v in getattr(values, '__dict__', {}).items()
+                     if k != 'data'})
+    result.objectives = [window.objective for window, commit in parts]
+    return result
+
+
+def _costs(model, timesteps):
+    """ Returns the costs of a solved `model` which don't depend on time,
+    e.g. fixed costs, and the costs of its variables at `timesteps`.
+
+    The values of the energy left in the storages, see `final_values`, are
+    not costs and excluded from both.
+    """
+    if isinstance(model, po.ConcreteModel):
+        committed = set(timesteps)
+        saved = []
+        for var in model.component_data_objects(po.Var):
+            index = var.index()
+            t = index[-1] if isinstance(index, tuple) else index
+            if isinstance(t, numbers.Integral):
+                saved.append((var, var.value, t in committed))
+        final = getattr(getattr(model, 'Storage', None), 'final_values',
+                        None)
+
+        def value(kept):
+            for var, v, c in saved:
+                var.value = v if kept and c else 0
+            return po.value(model.objective) + (
+                po.value(final) if final is not None else 0)
+        try:
+            total, constant = value(True), value(False)
+        finally:
+            for var, v, c in saved:
+                var.value = v
+    else:
+        timed = np.zeros(model.nvars, dtype=bool)
+        committed = np.zeros(model.nvars, dtype=bool)
+        for grid in model.variables.values():
+            if grid.timesteps is not None:
+                ids = grid.ids
+                timed[ids] = True
+                committed[ids[:, np.in1d(grid.timesteps, timesteps)]] = True
+        capacity = model.variables.get('Storage.capacity')
+        valued = [n for n in (capacity.keys if capacity is not None else [])
+                  if n in model.final_values]
+
+        def value(kept):
+            x = np.where(~timed | kept, model.solution, 0)
+            final = sum(model.final_values[n] * x[capacity[n][-1]]
+                        for n in valued)
+            return float(np.dot(model.cost, x) +
+                         np.dot(model.quadratic, x ** 2) / 2 +
+                         model.objective_offset + final)
+        total, constant = value(committed), value(np.zeros_like(committed))
+    return constant, total - constant
+
+
+def _flatten(results):
+    """ Returns the series of `results` keyed by `(i, o)` tuples, together
+    with their attributes like `invest`, so that they can be encoded by
+    :class:`_Keys` and passed between processes.
+    """
+    return {(i, o): (list(series),
+                     {k: v for k, v in getattr(series, '__dict__', {}).items()
+                      if k != 'data'})
+            for i in results for o, series in results[i].items()}
+
+
+def _nest(flat, objective):
+    """ Reverses :func:`_flatten`, returning results with the `objective`.
+    """
+    result = UserDict()
+    for (i, o), (series, attributes) in flat.items():
+        result.setdefault(i, UserDict())[o] = UserList(series)
+        result[i][o].__dict__.update(attributes)
+    result.objective = objective
+    return result
+
+
+def _reject_investments(es):
+    """ Raises a ValueError if `es` contains investments, which couple all
+    timesteps.
+    """
+    investments = [getattr(n, 'investment', None) for n in es.nodes] + [
+        f.investment for n in es.nodes for f in n.outputs.values()]
+    if any(i is not None for i in investments):
+        raise ValueError("Investments can't be solved in windows.")
+
+
+def _initial_state(es):
+    """ Returns the state of `es` before the first timestep of the horizon:
+    Storages with an `initial_capacity` start from it, the others empty, and
+    binary flows from their `initial_status`.
+    """
+    state = {n: (n.initial_capacity or 0) * n.nominal_capacity
+             for n in es.nodes if isinstance(n, Storage)}
+    state.update({(i, o): f.binary.initial_status
+                  for i in es.nodes for o, f in i.outputs.items()
+                  if f.binary is not None})
+    return state
+
+
+def _final_state(es):
+    """ Returns the capacities the storages of `es` with an
+    `initial_capacity` have to reach again at the end of the horizon.
+    """
+    return {n: n.initial_capacity * n.nominal_capacity
+            for n in es.nodes
+            if isinstance(n, Storage) and n.initial_capacity is not None}
+
+
+def _time_series(es):
+    """ Returns the time series of the nodes and flows of `es` which vary
+    over time, split into those which models can update, as pairs of the
+    object and the attribute, and the other sequences.
+    """
+    updatable, fixed = [], []
+    objects = list(es.nodes) + [f for n in es.nodes
+                                for f in n.outputs.values()]
+    for obj in objects:
+        names = next((names for cls, names in UPDATABLE
+                      if isinstance(obj, cls)), ())
+        for name, value in vars(obj).items():
+            values = (list(value.values()) if isinstance(value, dict)
+                      else [value])
+            varying = [v for v in values
+                       if isinstance(v, (_Sequence, _ArraySequence)) and
+                       not v.is_constant]
+            if name in names and varying:
+                updatable.append((obj, name))
+            else:
+                fixed.extend(varying)
+    return updatable, fixed
+
+
+def _window(sequence, timesteps):
+    """ Returns the values of `sequence` at `timesteps` as a list.
+    """
+    return [sequence[t] for t in timesteps]
+
+
+def _fits(model, base, timesteps, final_state, fixed):
+    """ Returns whether the `model` built for the timesteps `base` can be
+    moved to `timesteps` via :func:`_move`, i.e. whether they are equally
+    long, have the same `final_state` and the `fixed` time series, which
+    can't be updated, and the time increments and weights of the model are
+    equal in both.
+    """
+    series = fixed + [model.timeincrement, model.objective_weighting]
+    return (len(timesteps) == len(base) and
+            model.final_state == final_state and
+            all(_window(s, timesteps) == _window(s, base) for s in series))
+
+
+def _move(model, originals, base, timesteps, length):
+    """ Updates the `model` built for the timesteps `base` with the values
+    of the `originals` of the updatable time series at `timesteps`, leaving
+    those which already hold them unchanged.
+
+    The moved series have the given `length`, so that they cover the whole
+    horizon.
+    """
+    changes = OrderedDict()
+    for (obj, name), original in originals.items():
+        values = _window(original, timesteps)
+        if _window(getattr(obj, name), base) != values:
+            moved = _window(original, range(length))
+            for t, v in zip(base, values):
+                moved[t] = v
+            changes.setdefault(obj, {})[name] = moved
+    for obj, attributes in changes.items():
+        model.update(obj, **attributes)
+
+
+def _restore(originals):
+    """ Sets the attributes of the nodes and flows back to their
+    `originals`.
+    """
+    for (obj, name), original in originals.items():
+        setattr(obj, name, original)
+
+
+class RollingHorizon:
+    r""" Solves the dispatch of an energy system in overlapping windows of
+    timesteps, so that the size of the models built depends on the length
+    of the windows instead of the length of the whole horizon.
+
+    Every window is solved and only its first `window - overlap` timesteps
+    are committed. The capacities of the storages, the status of binary
+    flows and the values of flows with gradients at the last committed
+    timestep are the `initial_state` of the next window. Storages with an
+    `initial_capacity` start from it and have to reach it again at the end
+    of the horizon, while the others start empty.
+
+    The model of the first window is built once and solved again for the
+    following windows through one :class:`.SolverSession`: the time series
+    of the next window are moved onto its timesteps and its initial state
+    is replaced via :meth:`~.OperationalModel.update`. Only the attributes
+    listed in :const:`.UPDATABLE` can be moved this way, so a new model is
+    built for a window whose other time series, e.g. conversion factors,
+    differ from those of the model's window, and for a last window which is
+    shorter or has to reach a final state. The attributes of the nodes and
+    flows are restored after solving.
+
+    Parameters
+    ----------
+    es : EnergySystem object
+        The energy system to solve. It must not contain investments, as
+        these couple all timesteps.
+    window : int
+        The number of timesteps of each window.
+    overlap : int
+        The number of timesteps at the end of each window which are solved
+        again as part of the next window.
+    model : class
+        The model built for each window, :class:`.OperationalModel` or
+        :class:`.SparseOperationalModel`.
+    \**kwargs :
+        Further arguments for the models. `timesteps` restricts the horizon
+        to these consecutive timesteps.
+
+    Examples
+    --------
+    Solving a year in days, looking ahead one more day:
+
+    >>> rh = RollingHorizon(es, window=48, overlap=24)  # doctest: +SKIP
+    >>> rh.solve(solver='cbc')  # doctest: +SKIP
+    >>> es.results[bgas][pp]  # doctest: +SKIP
+    """
+    def __init__(self, es, window, overlap=0, model=OperationalModel,
+                 **kwargs):
+        if not 0 <= overlap < window:
+            raise ValueError("The overlap has to be shorter than the window.")
+        _reject_investments(es)
+        self.es = es
+        self.window = window
+        self.overlap = overlap
+        self.model = model
+        self.timesteps = list(kwargs.pop('timesteps',
+                                         range(len(es.timeindex))))
+        self.kwargs = kwargs
+
+    def windows(self):
+        """ Yields the timesteps of every window together with the number of
+        them which are committed.
+
+        Examples
+        --------
+        >>> from oemof.energy_system import EnergySystem
+        >>> import pandas as pd
+        >>> es = EnergySystem(timeindex=pd.date_range('1/1/2012', periods=5,
+        ...                                           freq='H'))
+        >>> for timesteps, commit in RollingHorizon(es, 3, 1).windows():
+        ...     print(timesteps, commit)
+        [0, 1, 2] 2
+        [2, 3, 4] 3
+        """
+        step = self.window - self.overlap
+        for start in range(0, len(self.timesteps), step):
+            timesteps = self.timesteps[start:start + self.window]
+            if start + self.window >= len(self.timesteps):
+                yield timesteps, len(timesteps)
+                return
+            yield timesteps, step
+
+    def solve(self, solver='glpk', solver_io='lp', **kwargs):
+        r""" Solves all windows one after another and stores the stitched
+        results of the committed timesteps in the energy system.
+
+        The results are structured like those of
+        :meth:`.OperationalModel.results`. Their `objective` holds the costs
+        of the committed timesteps, with the costs which don't depend on
+        time, e.g. fixed costs, counted once. The `objectives` of all
+        windows include the costs of their overlapping timesteps.
+
+        Parameters
+        ----------
+        solver : string
+        solver_io : string
+        \**kwargs :
+            See :meth:`.OperationalModel.solve`.
+        """
+        state, final = _initial_state(self.es), _final_state(self.es)
+        updatable, fixed = _time_series(self.es)
+        originals = {(obj, name): getattr(obj, name)
+                     for obj, name in updatable}
+        length = self.timesteps[-1] + 1
+
+        parts, costs = [], []
+        model = session = None
+        try:
+            for timesteps, commit in self.windows():
+                last = timesteps[-1] == self.timesteps[-1]
+                final_state = final if last else {}
+                if model is not None and _fits(model, base, timesteps,
+                                               final_state, fixed):
+                    _move(model, originals, base, timesteps, length)
+                    model.update(initial_state=state)
+                else:
+                    # only one model is kept, to keep memory to one window
+                    if session is not None:
+                        session.close()
+                    _restore(originals)
+                    base = timesteps
+                    model = self.model(self.es, timesteps=timesteps,
+                                       initial_state=state,
+                                       final_state=final_state,
+                                       **self.kwargs)
+                    session = SolverSession(model, solver, solver_io,
+                                            warmstart=False, **kwargs)
+                session.resolve()
+                parts.append((self.es.results, commit))
+                costs.append(_costs(model, base[:commit]))
+                state = model.state(base[commit - 1])
+        finally:
+            if session is not None:
+                session.close()
+            _restore(originals)
+
+        self.es.results = _stitch(parts)
+        self.es.results.objective = costs[0][0] + sum(c for _, c in costs)
+        return self.es.results
+
+
+class _Keys:
+    """ Translates the nodes, edges and flows keying states and results
+    into indices of the nodes of an energy system and back, so that they
+    can be passed between processes.
+    """
+    def __init__(self, es):
+        self.nodes = list(es.nodes)
+        self.index = {id(n): k for k, n in enumerate(self.nodes)}
+        self.flows = {id(f): (i, o) for i in self.nodes
+                      for o, f in i.outputs.items()}
+
+    def encode(self, mapping):
+        encoded = {}
+        for key, value in mapping.items():
+            if id(key) in self.flows:
+                i, o = self.flows[id(key)]
+                key = ('flow', self.index[id(i)], self.index[id(o)])
+            elif isinstance(key, tuple):
+                key = ('edge', self.index[id(key[0])], self.index[id(key[1])])
+            else:
+                key = ('node', self.index[id(key)])
+            encoded[key] = value
+        return encoded
+
+    def decode(self, mapping):
+        decoded = {}
+        for key, value in mapping.items():
+            nodes = [self.nodes[k] for k in key[1:]]
+            if key[0] == 'flow':
+                decoded[nodes[0].outputs[nodes[1]]] = value
+            elif key[0] == 'edge':
+                decoded[tuple(nodes)] = value
+            else:
+                decoded[nodes[0]] = value
+        return decoded
+
+
+def _coupled(es):
+    """ Returns the keys of the states which couple consecutive windows of
+    `es`, see :meth:`.OperationalModel.state`: its storages, its binary
+    flows and its flows with gradients.
+    """
+    storages = [n for n in es.nodes if isinstance(n, Storage)]
+    flows = [(i, o, f) for i in es.nodes for o, f in i.outputs.items()]
+    binary = [(i, o) for i, o, f in flows if f.binary is not None]
+    gradients = [f for i, o, f in flows
+                 if f.positive_gradient[0] is not None or
+                 f.negative_gradient[0] is not None]
+    return storages, binary, gradients
+
+
+def _start_bounds(f, direction, t):
+    """ Returns the largest change of the flow `f` in `direction` at
+    timestep `t`, or None if it isn't limited.
+    """
+    gradient = getattr(f, direction + '_gradient')
+    if gradient[0] is None or f.nominal_value is None:
+        return None
+    return gradient[t] * f.nominal_value
+
+
+def _add_boundaries(model, start, end):
+    """ Adds copies of the states at the boundaries of the window of `model`
+    and prices for them, which are set by :func:`_price_boundaries`, to its
+    objective.
+
+    If `start` is set, the states before the first timestep become
+    variables: the capacities of storages and the status of binary flows,
+    whose `initial_state` has to be zero, and the values of flows with
+    gradients, which mustn't be in the `initial_state`. If `end` is set,
+    the states at the last timestep are copied. The copies are keyed by
+    `'start'` or `'end'` and the key of their state in `model.boundaries`.
+    """
+    storages, binary, flows = _coupled(model.es)
+    flows = {id(f) for f in flows}
+    gradients = [(i, o) for (i, o), f in model.flows.items()
+                 if id(f) in flows]
+    limited = {direction: [(i, o) for i, o in gradients
+                           if _start_bounds(model.flows[i, o], direction,
+                                            0) is not None]
+               for direction in ('positive', 'negative')}
+    copies = OrderedDict()
+
+    if isinstance(model, po.ConcreteModel):
+        first, last = model.TIMESTEPS[1], model.TIMESTEPS[-1]
+        if start and storages:
+            block = model.Storage
+            block.start_capacity = po.Var(storages, bounds=lambda b, n: (
+                n.nominal_capacity * n.capacity_min[first - 1],
+                n.nominal_capacity * n.capacity_max[first - 1]))
+            for n in storages:
+                balance = block.balance[n, first]
+                balance.set_value(
+                    balance.body - block.start_capacity[n] *
+                    (1 - n.capacity_loss[first]) == balance.upper)
+                copies['start', n] = block.start_capacity[n]
+        if start and binary:
+            block = model.BinaryFlow
+            block.start_status = po.Var(binary, within=po.Binary)
+            for i, o in binary:
+                status = block.start_status[i, o]
+                if (i, o) in getattr(block, 'STARTUPFLOWS', []):
+                    block.startup_constr[i, o, first].set_value(
+                        block.startup[i, o, first] >=
+                        block.status[i, o, first] - status)
+                if (i, o) in getattr(block, 'SHUTDOWNFLOWS', []):
+                    block.shutdown_constr[i, o, first].set_value(
+                        block.shutdown[i, o, first] >=
+                        status - block.status[i, o, first])
+                copies['start', (i, o)] = status
+        if start and gradients:
+            block = model.Flow
+            block.start_flow = po.Var(gradients, within=po.NonNegativeReals)
+            for direction, sign in (('positive', 1), ('negative', -1)):
+                def _start_gradient_rule(block, i, o):
+                    """ The flow can only change by its gradient from the
+                    value before the first timestep.
+                    """
+                    return sign * (model.flow[i, o, first] -
+                                   block.start_flow[i, o]) <= _start_bounds(
+                        model.flows[i, o], direction, first)
+                setattr(block, 'start_{}_gradient'.format(direction),
+                        po.Constraint(limited[direction],
+                                      rule=_start_gradient_rule))
+            for i, o in gradients:
+                copies['start', model.flows[i, o]] = block.start_flow[i, o]
+        if end:
+            for n in storages:
+                copies['end', n] = model.Storage.capacity[n, last]
+            for i, o in binary:
+                copies['end', (i, o)] = model.BinaryFlow.status[i, o, last]
+            for i, o in gradients:
+                copies['end', model.flows[i, o]] = model.flow[i, o, last]
+
+        model.BOUNDARIES = po.Set(initialize=range(len(copies)),
+                                  ordered=True)
+        model.boundary_price = po.Param(model.BOUNDARIES, mutable=True,
+                                        initialize=0)
+        model.boundary_rho = po.Param(mutable=True, initialize=0)
+        expr = model.objective.expr + sum(
+            model.boundary_price[c] * x + model.boundary_rho / 2 * x ** 2
+            for c, x in enumerate(copies.values()))
+        model.del_component('objective')
+        model.objective = po.Objective(expr=expr)
+        model.boundary_variables = list(copies.values())
+    else:
+        first = model.TIMESTEPS[0]
+        if start and storages:
+            capacity = model.add_variables(
+                'Storage.start_capacity', storages,
+                lb=[n.nominal_capacity * n.capacity_min[first - 1]
+                    for n in storages],
+                ub=[n.nominal_capacity * n.capacity_max[first - 1]
+                    for n in storages])
+            balance = model.constraints['Storage.balance']
+            model.set_coefficients(
+                balance.select(storages)[:, 0], capacity.ids,
+                [n.capacity_loss[first] - 1 for n in storages])
+            copies.update((('start', n), capacity[n]) for n in storages)
+        if start and binary:
+            status = model.add_variables('BinaryFlow.start_status', binary,
+                                         ub=1, integer=True)
+            for name, sign in (('startup', 1), ('shutdown', -1)):
+                rows = model.constraints.get('BinaryFlow.{}_constr'.format(
+                    name))
+                selected = [key for key in binary
+                            if rows is not None and key in rows]
+                if selected:
+                    model.set_coefficients(rows.select(selected)[:, 0],
+                                           status.select(selected), sign)
+            copies.update((('start', key), status[key]) for key in binary)
+        if start and gradients:
+            flow = model.add_variables('Flow.start_flow', gradients)
+            for direction, sign in (('positive', 1), ('negative', -1)):
+                selected = limited[direction]
+                rows = model.add_constraints(
+                    'Flow.start_{}_gradient'.format(direction), selected, 'L',
+                    [_start_bounds(model.flows[key], direction, first)
+                     for key in selected])
+                model.add_coefficients(
+                    rows.ids, model.flow.select(selected)[:, 0], sign)
+                model.add_coefficients(rows.ids, flow.select(selected),
+                                       -sign)
+            copies.update((('start', model.flows[key]), flow[key])
+                          for key in gradients)
+        if end:
+            capacity = model.variables.get('Storage.capacity')
+            copies.update((('end', n), capacity[n][-1]) for n in storages)
+            status = model.variables.get('BinaryFlow.status')
+            copies.update((('end', key), status[key][-1]) for key in binary)
+            copies.update((('end', model.flows[key]), model.flow[key][-1])
+                          for key in gradients)
+
+        ids = np.array(list(copies.values()), dtype=int)
+        model.boundary_ids = ids
+        model.boundary_costs = (model.cost[ids].copy(),
+                                model.quadratic[ids].copy())
+        model.solution = np.full(model.nvars, np.nan)
+    model.boundaries = list(copies)
+
+
+def _price_boundaries(model, prices, rho):
+    """ Sets the `prices` of the copies of the states of a `model` prepared
+    by :func:`_add_boundaries`, keyed like `model.boundaries`, and the
+    proximal term of ADMM, `rho / 2` times their squares.
+    """
+    values = [prices.get(copy, 0) for copy in model.boundaries]
+    if isinstance(model, po.ConcreteModel):
+        for c, value in enumerate(values):
+            model.boundary_price[c] = value
+        model.boundary_rho = rho
+    else:
+        costs, quadratic = model.boundary_costs
+        model.cost[model.boundary_ids] = costs + values
+        model.quadratic[model.boundary_ids] = quadratic + rho
+
+
+def _boundary_values(model):
+    """ Returns the values of the copies of the states of a solved `model`
+    prepared by :func:`_add_boundaries`.
+    """
+    if isinstance(model, po.ConcreteModel):
+        values = [x.value for x in model.boundary_variables]
+    else:
+        values = model.solution[model.boundary_ids].tolist()
+    return dict(zip(model.boundaries, values))
+
+
+def _solve_window(task):
+    """ Solves the model of one window for the given prices of the copies
+    of its states at the boundaries in a worker process of
+    :class:`ParallelWindows`, like :func:`.decomposition._solve_region`.
+
+    Returns the values of the copies of its initial and its final state,
+    and its costs, see :func:`_costs`, and its results if they are asked
+    for, with all keys encoded by :class:`_Keys`.
+    """
+    # the workers are shared with the decompositions, which build on this
+    # module
+    from .decomposition import _WORKER
+    k, prices, solver, solver_io, kwargs, results = task
+    keys, sessions = _WORKER['keys'], _WORKER['sessions']
+    timesteps, initial, final, start, end, rho = _WORKER['parts'][k]
+    if k not in sessions:
+        model = _WORKER['model'](_WORKER['es'], timesteps=timesteps,
+                                 initial_state=keys.decode(initial),
+                                 final_state=keys.decode(final),
+                                 **_WORKER['kwargs'])
+        _add_boundaries(model, start, end)
+        sessions[k] = SolverSession(model, solver, solver_io, **kwargs)
+    session = sessions[k]
+    model = session.model
+    decoded = {(side, key): value
+               for side, encoded in zip(('start', 'end'), prices)
+               for key, value in keys.decode(encoded).items()}
+    if _WORKER['inputs'].get(k) != prices:
+        _price_boundaries(model, decoded, rho)
+        session.resolve()
+        _WORKER['inputs'][k] = prices
+    values = _boundary_values(model)
+    output = (tuple(keys.encode({key: value
+                                 for (s, key), value in values.items()
+                                 if s == side})
+                    for side in ('start', 'end')),)
+    if results:
+        # the costs are taken without the prices and proximal terms
+        _price_boundaries(model, {}, 0)
+        output += (_costs(model, timesteps),
+                   keys.encode(_flatten(model.results())))
+        _price_boundaries(model, decoded, rho)
+    return output
+
+
+class ParallelWindows:
+    r""" Solves the dispatch of an energy system in windows of timesteps,
+    which are all solved at once in a pool of processes and coordinated by
+    the alternating direction method of multipliers (ADMM).
+
+    The windows are coupled by their states at the boundaries: the
+    capacities of storages, the status of binary flows and the values of
+    flows with gradients at the last timestep of a window, from which the
+    next window starts. Each window holds a copy of the states at its
+    boundaries, where those at its start are variables replacing its
+    `initial_state`, so that every window stays feasible whatever its
+    neighbours do. In every iteration, the windows are solved with prices
+    for their copies and a penalty of `rho / 2` times their squares,
+    pulling them towards the average of both copies of a state in the last
+    iteration, like the exchanged flows of :class:`.ADMM`. Once all copies
+    agree, the stitched solution of a linear model is optimal for the whole
+    horizon. Binary states make the windows mixed integer programs, for
+    which ADMM is only a heuristic.
+
+    The penalty makes the windows quadratic programs, which need a solver
+    supporting quadratic objectives, e.g. gurobi or cplex. If the copies
+    still differ after `max_iterations`, the horizon is solved by a
+    :class:`RollingHorizon` instead, one window after another.
+
+    Parameters
+    ----------
+    es : EnergySystem object
+        The energy system to solve. It must not contain investments, as
+        these couple all timesteps.
+    windows : int
+        The number of windows to split the horizon into.
+    processes : int (optional)
+        The number of worker processes, defaulting to the number of CPUs but
+        not more than the number of windows. Each worker keeps the models of
+        its windows between the iterations. With a single process, the
+        windows are solved in the current process. Worker processes are
+        forked, so they don't work on platforms which can't fork.
+    tolerance : float
+        The largest difference of copies and of their averages in
+        consecutive iterations (times `rho`) for which they are considered
+        to agree.
+    max_iterations : int
+        The number of iterations after which to stop even if the copies
+        don't agree.
+    rho : float
+        The weight of the penalty, which trades the agreement of the copies
+        in each iteration against the progress of the prices.
+    model : class
+        The model built for each window, :class:`.OperationalModel` or
+        :class:`.SparseOperationalModel`.
+    \**kwargs :
+        Further arguments for the models. `timesteps` restricts the horizon
+        to these consecutive timesteps.
+
+    Attributes
+    ----------
+    residuals : list
+        The largest difference between copies and the largest change of
+        their averages times `rho` in every iteration.
+    converged : bool
+        Whether the copies agreed in the last iteration.
+
+    Examples
+    --------
+    Solving a year in twelve windows on twelve cores:
+
+    >>> pw = ParallelWindows(es, windows=12, processes=12)  # doctest: +SKIP
+    >>> pw.solve(solver='gurobi')  # doctest: +SKIP
+    >>> pw.converged, pw.residuals[-1]  # doctest: +SKIP
+    (True, (0.0002, 0.0009))
+    """
+    def __init__(self, es, windows, processes=None, tolerance=1e-3,
+                 max_iterations=200, rho=1, model=OperationalModel,
+                 **kwargs):
+        _reject_investments(es)
+        timesteps = list(kwargs.pop('timesteps', range(len(es.timeindex))))
+        if not 0 < windows <= len(timesteps):
+            raise ValueError(
+                "The number of windows has to be between 1 and {}.".format(
+                    len(timesteps)))
+        self.es = es
+        self.timesteps = timesteps
+        self.windows = [w.tolist() for w in np.array_split(timesteps,
+                                                           windows)]
+        self.processes = min(processes or multiprocessing.cpu_count(),
+                             windows)
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.rho = rho
+        self.model = model
+        self.kwargs = kwargs
+        self.residuals = []
+        self.converged = False
+
+    def solve(self, solver='glpk', solver_io='lp', **kwargs):
+        r""" Solves the windows until the copies of their states at the
+        boundaries agree and stores the stitched results in the energy
+        system.
+
+        The results are structured like those of :meth:`.RollingHorizon.solve`.
+        Their `objective` holds the costs of the whole horizon, and the
+        `objectives` the costs of every window.
+
+        Parameters
+        ----------
+        solver : string
+        solver_io : string
+        \**kwargs :
+            See :meth:`.OperationalModel.solve`.
+        """
+        # the workers are shared with the decompositions, which build on
+        # this module
+        from .decomposition import _Workers
+        keys = _Keys(self.es)
+        storages, binary, gradients = _coupled(self.es)
+        coupled = storages + binary + gradients
+        # later windows start from their copies of the states
+        starts = {key: 0 for key in storages + binary}
+        initial, final = _initial_state(self.es), _final_state(self.es)
+        last = len(self.windows) - 1
+        parts = [(window, keys.encode(starts if k else initial),
+                  keys.encode(final if k == last else {}), k > 0, k < last,
+                  self.rho) for k, window in enumerate(self.windows)]
+        # the boundaries follow the windows, and the copies of their states
+        # are the starts of the following and the ends of the preceding one
+        sides = (('start', -1), ('end', 0))
+        shifts = dict(sides)
+        average = {(b, key): 0 for b in range(last) for key in coupled}
+        prices = {}
+
+        workers = _Workers(self.es, self.model, self.kwargs, parts,
+                           self.processes)
+        try:
+            self.residuals = []
+            for iteration in range(self.max_iterations):
+                tasks = [(k, tuple(
+                    keys.encode({
+                        key: prices.get((k, side, key), 0) -
+                        self.rho * average[k + shift, key]
+                        for key in coupled})
+                    if 0 <= k + shift < last else {}
+                    for side, shift in sides), solver, solver_io, kwargs,
+                    False) for k in range(len(self.windows))]
+                outputs = workers.map(_solve_window, tasks)
+                copies = {(k, side, key): x
+                          for k, output in enumerate(outputs)
+                          for (side, shift), values in zip(sides, output[0])
+                          for key, x in keys.decode(values).items()}
+                previous, average = average, {
+                    (b, key): (copies[b, 'end', key] +
+                               copies[b + 1, 'start', key]) / 2
+                    for b, key in average}
+                for (k, side, key), x in copies.items():
+                    b = k + shifts[side]
+                    prices[k, side, key] = (prices.get((k, side, key), 0) +
+                                            self.rho * (x - average[b, key]))
+                # both copies of a state differ from their average alike
+                primal = max([abs(copies[b, 'end', key] - average[b, key])
+                              for b, key in average] + [0])
+                dual = self.rho * max([abs(average[c] - previous[c])
+                                       for c in average] + [0])
+                self.residuals.append((primal, dual))
+                logging.info(
+                    "Window iteration {}: residuals {} and {}.".format(
+                        iteration, primal, dual))
+                if max(primal, dual) <= self.tolerance:
+                    break
+
+            self.converged = max(self.residuals[-1]) <= self.tolerance
+            if self.converged:
+                # the windows are still solved for the prices of the last
+                # tasks
+                outputs = workers.map(_solve_window, [
+                    task[:-1] + (True,) for task in tasks])
+        finally:
+            workers.close()
+
+        if not self.converged:
+            logging.warning(
+                "The states at the boundaries of the windows still differ "
+                "by {} after {} iterations. Solving them one after another "
+                "instead.".format(max(self.residuals[-1]),
+                                  len(self.residuals)))
+            return RollingHorizon(
+                self.es, max(len(w) for w in self.windows), model=self.model,
+                timesteps=self.timesteps, **self.kwargs).solve(
+                    solver=solver, solver_io=solver_io, **kwargs)
+
+        parts = [(_nest(keys.decode(output[2]), sum(output[1])), len(window))
+                 for window, output in zip(self.windows, outputs)]
+        self.es.results = _stitch(parts)
+        self.es.results.objective = outputs[0][1][0] + sum(
+            output[1][1] for output in outputs)
+        return self.es.results
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Solver sessions for solving one model repeatedly.
+
+"""
+
+import os
+import tempfile
+
+import pyomo.environ as po
+from pyomo.opt import SolverFactory
+
+
+class SolverSession:
+    r""" A solver bound to a model, which is solved again after the model
+    has been changed via :meth:`.OperationalModel.update` or
+    :meth:`.SparseOperationalModel.update`.
+
+    The solver and its options are set up once. For
+    :class:`.OperationalModel`\s, the solution of the previous solve is
+    passed to the solver as a warm start if the solver plugin is able to.
+    :class:`.SparseOperationalModel`\s are written to a file kept for the
+    whole session, where only the chunks of the file whose rows, bounds or
+    costs changed are formatted again. They are solved from this file, so
+    they aren't warm started.
+
+    Parameters
+    ----------
+    model : OperationalModel or SparseOperationalModel
+        The model to solve.
+    solver : string
+        solver to be used e.g. "glpk","gurobi","cplex"
+    solver_io : string
+        pyomo solver interface file format: "lp","python","nl", etc.
+    warmstart : bool
+        Whether to start from the previous solution, if the solver supports
+        warm starts. Only used for :class:`.OperationalModel`\s.
+    \**kwargs : keyword arguments
+        `solve_kwargs` and `cmdline_options` as described in
+        :meth:`.OperationalModel.solve`, and `chunksize` as described in
+        :meth:`.SparseModel.write`.
+
+    Examples
+    --------
+    Re-dispatching a model `om` for updated wind forecasts:
+
+    >>> session = SolverSession(om, solver='cbc')  # doctest: +SKIP
+    >>> for forecast in forecasts:  # doctest: +SKIP
+    ...     om.update(wind.outputs[bel], actual_value=forecast)
+    ...     session.resolve()
+    """
+    def __init__(self, model, solver='glpk', solver_io='lp', warmstart=True,
+                 **kwargs):
+        self.model = model
+        self.warmstart = warmstart
+        self.solve_kwargs = dict(kwargs.get('solve_kwargs', {}))
+        self.chunksize = kwargs.get('chunksize', 2**18)
+        self.opt = SolverFactory(solver, solver_io=solver_io)
+        # set command line options
+        options = self.opt.options
+        for k, v in kwargs.get('cmdline_options', {}).items():
+            options[k] = v
+        #: The number of solves done in this session.
+        self.solves = 0
+        self._cache = {}
+        self._directory = None
+
+    def resolve(self, **solve_kwargs):
+        r""" Solves the model in its current state and stores the results in
+        the model's energy system.
+
+        Parameters
+        ----------
+        \**solve_kwargs :
+            Arguments for the pyomo solver's `solve` method overriding the
+            `solve_kwargs` given to the session.
+        """
+        kwargs = dict(self.solve_kwargs, **solve_kwargs)
+        if isinstance(self.model, po.ConcreteModel):
+            # the values of the variables are the previous solution
+            if (self.warmstart and self.solves and
+                    self.opt.warm_start_capable()):
+                kwargs.setdefault('warmstart', True)
+            results = self.opt.solve(self.model, **kwargs)
+            self.model.solutions.load_from(results)
+        else:
+            results = self._resolve_sparse(kwargs)
+        self.solves += 1
+
+        # storage optimization results in result dictionary of energysystem
+        es = self.model.es
+        es.results = self.model.results()
+        es.results.objective = self.model.objective()
+        es.results.solver = results
+
+        return results
+
+    def _resolve_sparse(self, kwargs):
+        """ Writes a sparse model to the session's file and solves it.
+
+        The solver plugins only write warm start files for Pyomo models, so
+        `warmstart` doesn't apply here.
+        """
+        model = self.model
+        if model._receive_duals:
+            kwargs.setdefault('suffixes', ['dual'])
+        if self._directory is None:
+            self._directory = tempfile.TemporaryDirectory(prefix='oemof-')
+        filename = os.path.join(self._directory.name, 'model.lp')
+        model._problem().write(filename, chunksize=self.chunksize,
+                               cache=self._cache)
+        results = self.opt.solve(filename, **kwargs)
+        model.load_solution(results)
+        return results
+
+    def close(self):
+        """ Removes the files and cached data of the session.
+        """
+        self._cache.clear()
+        if self._directory is not None:
+            self._directory.cleanup()
+            self._directory = None
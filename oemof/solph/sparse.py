@@ -0,0 +1,1786 @@
+# -*- coding: utf-8 -*-
+"""A sparse matrix backend for solph's optimization models.
+
+Instead of building one Pyomo expression per node, flow and timestep, the
+builders in this module emit all rows of a block at once as NumPy arrays of
+coordinate (COO) triplets over integer variable ids. The resulting linear
+(mixed integer) program is held in a :class:`SparseModel`.
+
+"""
+
+import bisect
+from collections import OrderedDict, UserDict, UserList
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from . import blocks
+from .models import (_check_initial_storages, _flows, _period_sequence,
+                     _set_attributes)
+from .network import Flow, Storage
+from .options import Investment
+from .plumbing import Sequence
+from .session import SolverSession
+
+
+def _series(sequence, timesteps):
+    """ Returns the values of `sequence` at `timesteps` as a float array.
+
+    Elements which are None are returned as NaN.
+    """
+    timesteps = np.asarray(timesteps, dtype=int)
+    if not len(timesteps):
+        return np.empty(0)
+    start, stop = int(timesteps.min()), int(timesteps.max()) + 1
+    try:
+        values = sequence[start:stop]
+    except TypeError:
+        values = [sequence[t] for t in range(start, stop)]
+    return np.asarray(values, dtype=float)[timesteps - start]
+
+
+def _stack(objects, attribute, timesteps):
+    """ Stacks the series `attribute` of all `objects` into one array with
+    one row per object.
+    """
+    return np.array([_series(getattr(o, attribute), timesteps)
+                     for o in objects]).reshape(len(objects), len(timesteps))
+
+
+def _column(values):
+    """ Turns one value per key into a column broadcasting over timesteps.
+    """
+    return np.array(values, dtype=float).reshape(-1, 1)
+
+
+def _canonical(rows, cols, coefficients):
+    """ Sorts COO triplets by row and column, sums up duplicates and drops
+    zeros.
+    """
+    order = np.lexsort((cols, rows))
+    rows, cols = rows[order], cols[order]
+    coefficients = coefficients[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    starts = np.flatnonzero(first)
+    if len(starts):
+        coefficients = np.add.reduceat(coefficients, starts)
+    rows, cols = rows[starts], cols[starts]
+    nonzero = coefficients != 0
+    return rows[nonzero], cols[nonzero], coefficients[nonzero]
+
+
+def _concatenate(triplets):
+    """ Concatenates a list of COO triplets.
+    """
+    if not triplets:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+    return tuple(np.concatenate(parts) for parts in zip(*triplets))
+
+
+class IdGrid:
+    """ Integer ids of a family of variables or constraints.
+
+    The ids of a family are consecutive. They are laid out as a grid with
+    one row per key and one column per timestep, or as a vector with one id
+    per key if the family doesn't depend on time.
+
+    Parameters
+    ----------
+    name : str
+        The name of the family, e.g. `'Bus.balance'`.
+    keys : iterable
+        The keys of the family, i.e. nodes or (source, target) tuples.
+    offset : int
+        The id of the first element of the family.
+    timesteps : array-like (optional)
+        The timesteps of the family.
+
+    Examples
+    --------
+    >>> grid = IdGrid('flow', ['a', 'b'], 10, timesteps=range(3))
+    >>> grid['b']
+    array([13, 14, 15])
+    >>> grid.select(['b', 'a'])[:, 0]
+    array([13, 10])
+    >>> len(grid)
+    6
+    """
+    def __init__(self, name, keys, offset, timesteps=None):
+        self.name = name
+        self.keys = list(keys)
+        self.offset = offset
+        self.timesteps = (None if timesteps is None else
+                          np.asarray(timesteps, dtype=int))
+        self.position = {key: p for p, key in enumerate(self.keys)}
+
+    @property
+    def width(self):
+        """ The number of ids per key.
+        """
+        return 1 if self.timesteps is None else len(self.timesteps)
+
+    @property
+    def shape(self):
+        if self.timesteps is None:
+            return (len(self.keys),)
+        return (len(self.keys), len(self.timesteps))
+
+    @property
+    def ids(self):
+        """ All ids of the family, shaped like :attr:`shape`.
+        """
+        return self.select(self.keys)
+
+    def select(self, keys):
+        """ Returns the ids of `keys` with one row per key.
+        """
+        positions = np.array([self.position[key] for key in keys],
+                             dtype=int)
+        if self.timesteps is None:
+            return self.offset + positions
+        return (self.offset + positions[:, None] * self.width +
+                np.arange(self.width))
+
+    def __getitem__(self, key):
+        start = self.offset + self.position[key] * self.width
+        if self.timesteps is None:
+            return start
+        return np.arange(start, start + self.width)
+
+    def __contains__(self, key):
+        return key in self.position
+
+    def __len__(self):
+        return len(self.keys) * self.width
+
+    def __repr__(self):
+        return "<IdGrid {!r}: {} ids from {}>".format(self.name, len(self),
+                                                      self.offset)
+
+
+class SparseModel:
+    """ A linear (mixed integer) program stored as a sparse matrix.
+
+    Variables and constraints are added in families (see :class:`IdGrid`).
+    The coefficients of the constraint matrix are collected as coordinate
+    (COO) triplets, where entries with the same row and column are summed
+    up. The objective is always minimized.
+
+    The coefficients added since a family of constraints was added are
+    sorted into a segment as soon as the next family is added. If `spill` is
+    set, segments are written to temporary files and memory mapped from
+    there, so that only the coefficients of the family being built are held
+    in memory.
+
+    Parameters
+    ----------
+    spill : bool or str
+        Whether to keep segments on disk. If it's a path, the temporary
+        files are created in that directory.
+
+    Attributes
+    ----------
+    variables : OrderedDict
+        The variable families keyed by their names.
+    constraints : OrderedDict
+        The constraint families keyed by their names.
+    lb, ub, integer, cost : numpy.ndarray
+        Lower and upper bounds, integrality and objective coefficients of
+        the variables, indexed by variable id.
+    quadratic : numpy.ndarray
+        The quadratic objective coefficients of the variables, which add
+        `quadratic / 2 * x ** 2` to the objective. They are all zero for
+        linear programs.
+    sense, rhs : numpy.ndarray
+        The sense (`'E'`, `'L'` or `'G'`) and right hand side of the
+        constraints, indexed by row id.
+    objective_offset : float
+        The constant part of the objective.
+
+    Examples
+    --------
+    >>> m = SparseModel()
+    >>> x = m.add_variables('x', ['a', 'b'], ub=[2, 3])
+    >>> row = m.add_constraints('sum', ['s'], 'G', 4)
+    >>> m.add_coefficients(row['s'], x.ids, 1)
+    >>> m.add_costs(x.ids, [1, 2])
+    >>> [a.tolist() for a in m.matrix()]
+    [[0, 0], [0, 1], [1.0, 1.0]]
+    >>> m.evaluate([2, 2]).tolist()
+    [4.0]
+    """
+    def __init__(self, spill=False):
+        self.name = 'SparseModel'
+        self.variables = OrderedDict()
+        self.constraints = OrderedDict()
+        self.lb = np.empty(0)
+        self.ub = np.empty(0)
+        self.integer = np.empty(0, dtype=bool)
+        self.cost = np.empty(0)
+        self.quadratic = np.empty(0)
+        self.sense = np.empty(0, dtype='U1')
+        self.rhs = np.empty(0)
+        self.objective_offset = 0
+        self._buffer = []
+        self._segments = []
+        self._spill = None
+        if spill:
+            self._spill = tempfile.TemporaryDirectory(
+                prefix='oemof-', dir=None if spill is True else spill)
+
+    @property
+    def nvars(self):
+        return len(self.lb)
+
+    @property
+    def nrows(self):
+        return len(self.rhs)
+
+    def add_variables(self, name, keys, timesteps=None, lb=0, ub=np.inf,
+                      integer=False):
+        """ Adds a family of variables and returns its :class:`IdGrid`.
+
+        The bounds and the integrality are broadcast to the shape of the
+        family, so they may be given per key, per element or as scalars.
+        """
+        if name in self.variables:
+            raise ValueError("Variables {!r} already exist.".format(name))
+        grid = IdGrid(name, keys, self.nvars, timesteps)
+
+        def spread(values, dtype):
+            values = np.asarray(values, dtype=dtype)
+            if values.ndim == 1 and len(grid.shape) == 2:
+                values = values.reshape(-1, 1)
+            return np.broadcast_to(values, grid.shape).ravel()
+        self.lb = np.concatenate([self.lb, spread(lb, float)])
+        self.ub = np.concatenate([self.ub, spread(ub, float)])
+        self.integer = np.concatenate([self.integer, spread(integer, bool)])
+        self.cost = np.concatenate([self.cost, np.zeros(len(grid))])
+        self.quadratic = np.concatenate([self.quadratic,
+                                         np.zeros(len(grid))])
+        self.variables[name] = grid
+        return grid
+
+    def add_constraints(self, name, keys, sense, rhs, timesteps=None):
+        """ Adds a family of constraints and returns its :class:`IdGrid`.
+
+        The coefficients of the rows have to be added separately via
+        :meth:`add_coefficients`.
+        """
+        if name in self.constraints:
+            raise ValueError("Constraints {!r} already exist.".format(name))
+        self._flush()
+        grid = IdGrid(name, keys, self.nrows, timesteps)
+        rhs = np.asarray(rhs, dtype=float)
+        if rhs.ndim == 1 and len(grid.shape) == 2:
+            rhs = rhs.reshape(-1, 1)
+        self.sense = np.concatenate([
+            self.sense, np.broadcast_to(np.asarray(sense, dtype='U1'),
+                                        grid.shape).ravel()])
+        self.rhs = np.concatenate([self.rhs,
+                                   np.broadcast_to(rhs, grid.shape).ravel()])
+        self.constraints[name] = grid
+        return grid
+
+    def add_coefficients(self, rows, cols, coefficients):
+        """ Adds the coefficients of variables `cols` in constraints `rows`.
+
+        All three arguments are broadcast against each other.
+        """
+        rows, cols, coefficients = np.broadcast_arrays(
+            np.asarray(rows, dtype=int), np.asarray(cols, dtype=int),
+            np.asarray(coefficients, dtype=float))
+        self._buffer.append((rows.ravel(), cols.ravel(),
+                             coefficients.ravel()))
+
+    def add_costs(self, cols, coefficients):
+        """ Adds `coefficients` to the objective coefficients of `cols`.
+        """
+        cols, coefficients = np.broadcast_arrays(
+            np.asarray(cols, dtype=int), np.asarray(coefficients, dtype=float))
+        np.add.at(self.cost, cols.ravel(), coefficients.ravel())
+
+    def set_coefficients(self, rows, cols, coefficients):
+        """ Replaces the coefficients of variables `cols` in constraints
+        `rows` by `coefficients`.
+
+        Entries which don't exist yet are added. The arguments are broadcast
+        against each other and every pair of row and column may only occur
+        once.
+        """
+        rows, cols, coefficients = (a.ravel() for a in np.broadcast_arrays(
+            np.asarray(rows, dtype=int), np.asarray(cols, dtype=int),
+            np.asarray(coefficients, dtype=float)))
+        self._flush()
+        # segments are sorted by row and column, i.e. by this key
+        keys = rows.astype(np.int64) * self.nvars + cols
+        missing = np.ones(len(keys), dtype=bool)
+        for segment in self._segments:
+            found = segment[0].astype(np.int64) * self.nvars + segment[1]
+            positions = np.searchsorted(found, keys)
+            positions[positions == len(found)] = 0
+            hit = found[positions] == keys
+            # duplicates in other segments are zeroed, since entries are
+            # summed up
+            segment[2][positions[hit]] = np.where(missing[hit],
+                                                  coefficients[hit], 0)
+            missing &= ~hit
+        if missing.any():
+            self._buffer.append((rows[missing], cols[missing],
+                                 coefficients[missing]))
+
+    def _flush(self):
+        """ Turns the buffered coefficients into a sorted segment, which is
+        written to disk if the model spills.
+        """
+        if not self._buffer:
+            return
+        segment = _canonical(*_concatenate(self._buffer))
+        self._buffer = []
+        if not len(segment[0]):
+            return
+        if self._spill is not None:
+            stored = []
+            for array in segment:
+                path = os.path.join(self._spill.name, '{}.{}'.format(
+                    len(self._segments), len(stored)))
+                array.tofile(path)
+                stored.append(np.memmap(path, dtype=array.dtype, mode='r+',
+                                        shape=array.shape))
+            segment = tuple(stored)
+        self._segments.append(segment)
+
+    def _rows(self, start, stop):
+        """ Returns the canonical triplets of the rows `start` to `stop`.
+        """
+        self._flush()
+        parts = []
+        for rows, cols, coefficients in self._segments:
+            low, high = np.searchsorted(rows, [start, stop])
+            if high > low:
+                parts.append((rows[low:high], cols[low:high],
+                              coefficients[low:high]))
+        if len(parts) == 1:
+            # zeros may have been set via `set_coefficients`
+            nonzero = np.asarray(parts[0][2]) != 0
+            return tuple(np.asarray(part)[nonzero] for part in parts[0])
+        return _canonical(*_concatenate(parts))
+
+    def _columns(self, start, stop, blocksize):
+        """ Returns the triplets of the columns `start` to `stop` sorted by
+        column and row, scanning the segments in blocks of `blocksize`.
+        """
+        self._flush()
+        parts = []
+        for segment in self._segments:
+            for block in range(0, len(segment[0]), blocksize):
+                rows, cols, coefficients = (array[block:block + blocksize]
+                                            for array in segment)
+                inside = (cols >= start) & (cols < stop)
+                if inside.any():
+                    parts.append((cols[inside], rows[inside],
+                                  coefficients[inside]))
+        cols, rows, coefficients = _canonical(*_concatenate(parts))
+        return rows, cols, coefficients
+
+    def matrix(self):
+        """ Returns the constraint matrix as COO triplets `(rows, cols,
+        coefficients)`, sorted by row and column, without duplicates or
+        zeros.
+        """
+        matrix = self._rows(0, self.nrows)
+        if self._spill is None:
+            self._segments = [matrix] if len(matrix[0]) else []
+        return matrix
+
+    def evaluate(self, values):
+        """ Returns the left hand sides of all constraints for the variable
+        `values`.
+        """
+        rows, cols, coefficients = self.matrix()
+        return np.bincount(rows, coefficients * np.asarray(values)[cols],
+                           minlength=self.nrows)
+
+    def name_map(self):
+        """ Returns the :class:`NameMap` of the names used by :meth:`write`.
+        """
+        return NameMap.from_model(self)
+
+    def write(self, filename, format=None, chunksize=2**18, names=None,
+              cache=None):
+        """ Streams the model to `filename`.
+
+        Variables are named `x<id>` and constraints `c_e_<id>`, `c_u_<id>`
+        or `c_l_<id>` by their sense, as pyomo's solver plugins only report
+        the duals of constraints named like that. The model is
+        written in chunks of `chunksize` rows or columns, so only one chunk
+        of formatted text is held in memory at a time. The
+        :attr:`objective_offset` is written as the coefficient of a column
+        `obj_offset` fixed to one in LP files and as the negated right hand
+        side of the objective in MPS files.
+
+        Parameters
+        ----------
+        filename : str
+            The file to write to. It is compressed with gzip if its name
+            ends with `.gz`.
+        format : str
+            `'lp'` for CPLEX LP or `'mps'` for free MPS format. Guessed from
+            `filename` if not given, defaulting to `'lp'`.
+        chunksize : int
+            The number of rows or columns written at once.
+        names : str (optional)
+            If given, the :class:`NameMap` of the model is dumped to this
+            path, to read solutions back later on.
+        cache : dict (optional)
+            Keeps the formatted chunks of LP files between calls. Chunks
+            whose data didn't change since the last call with the same
+            `cache` and `chunksize` are taken from it instead of being
+            formatted again.
+        """
+        stem = filename[:-3] if filename.endswith('.gz') else filename
+        if format is None:
+            format = 'mps' if stem.lower().endswith('.mps') else 'lp'
+        if format not in ('lp', 'mps'):
+            raise ValueError("Unknown format: {!r}".format(format))
+        if filename.endswith('.gz'):
+            stream = gzip.open(filename, 'wt', compresslevel=6)
+        else:
+            stream = open(filename, 'w')
+        with stream:
+            if format == 'lp':
+                self._write_lp(stream, chunksize, cache)
+            else:
+                self._write_mps(stream, chunksize)
+        if names is not None:
+            self.name_map().dump(names)
+
+    def _write_lp(self, stream, chunksize, cache=None):
+        operators = {'E': '=', 'L': '<=', 'G': '>='}
+
+        def terms(cols, coefficients):
+            return ["{:+} x{}\n".format(v, c)
+                    for c, v in zip(cols.tolist(), coefficients.tolist())]
+
+        def objective(chunk):
+            return "".join(terms(chunk, self.cost[chunk]))
+
+        def quadratic(chunk):
+            return "".join("{:+} x{} ^ 2\n".format(v, c) for c, v in zip(
+                chunk.tolist(), self.quadratic[chunk].tolist()))
+
+        def constraints(start, stop, rows, cols, coefficients):
+            lines = terms(cols, coefficients)
+            bounds = np.searchsorted(rows, np.arange(start, stop + 1))
+            return "".join(
+                "{}{}:\n{}{} {!r}\n\n".format(
+                    _ROW_PREFIX[sense], row,
+                    "".join(lines[low:high]) or "+0 x0\n",
+                    operators[sense], rhs)
+                for row, low, high, sense, rhs in zip(
+                    range(start, stop), bounds[:-1].tolist(),
+                    bounds[1:].tolist(), self.sense[start:stop].tolist(),
+                    self.rhs[start:stop].tolist()))
+
+        def variables(start, stop):
+            lines = []
+            for var, lb, ub in zip(range(start, stop),
+                                   self.lb[start:stop].tolist(),
+                                   self.ub[start:stop].tolist()):
+                if lb == ub:
+                    lines.append(" x{} = {!r}\n".format(var, lb))
+                elif lb == -np.inf and ub == np.inf:
+                    lines.append(" x{} free\n".format(var))
+                elif lb != 0 or ub != np.inf:
+                    lines.append(" {} <= x{} <= {}\n".format(
+                        "-inf" if lb == -np.inf else repr(lb), var,
+                        "+inf" if ub == np.inf else repr(ub)))
+            return "".join(lines)
+
+        stream.write("\\* {} *\\\n\nmin\nobj:\n".format(self.name))
+        costs = np.flatnonzero(self.cost)
+        if not len(costs):
+            stream.write("+0 x0\n")
+        for start in range(0, len(costs), chunksize):
+            chunk = costs[start:start + chunksize]
+            stream.write(_cached(cache, ('obj', start),
+                                 (chunk, self.cost[chunk]),
+                                 lambda: objective(chunk)))
+        if self.objective_offset:
+            # a column fixed to one carries the constant of the objective
+            stream.write("{:+} obj_offset\n".format(
+                float(self.objective_offset)))
+        squares = np.flatnonzero(self.quadratic)
+        if len(squares):
+            stream.write("+ [\n")
+        for start in range(0, len(squares), chunksize):
+            chunk = squares[start:start + chunksize]
+            stream.write(_cached(cache, ('quadratic', start),
+                                 (chunk, self.quadratic[chunk]),
+                                 lambda: quadratic(chunk)))
+        if len(squares):
+            stream.write("] / 2\n")
+
+        stream.write("\ns.t.\n\n")
+        for start in range(0, self.nrows, chunksize):
+            stop = min(start + chunksize, self.nrows)
+            triplets = self._rows(start, stop)
+            stream.write(_cached(
+                cache, ('rows', start),
+                triplets + (self.sense[start:stop], self.rhs[start:stop]),
+                lambda: constraints(start, stop, *triplets)))
+
+        stream.write("bounds\n")
+        for start in range(0, self.nvars, chunksize):
+            stop = min(start + chunksize, self.nvars)
+            stream.write(_cached(
+                cache, ('bounds', start),
+                (np.arange(start, stop), self.lb[start:stop],
+                 self.ub[start:stop]),
+                lambda: variables(start, stop)))
+        if self.objective_offset:
+            stream.write(" obj_offset = 1\n")
+        integers = np.flatnonzero(self.integer)
+        if len(integers):
+            stream.write("general\n")
+        for start in range(0, len(integers), chunksize):
+            stream.write("".join(
+                " x{}\n".format(i)
+                for i in integers[start:start + chunksize].tolist()))
+        stream.write("end\n")
+
+    def _write_mps(self, stream, chunksize):
+        stream.write("NAME {}\nROWS\n N obj\n".format(self.name))
+        for start in range(0, self.nrows, chunksize):
+            stream.write("".join(
+                " {} {}{}\n".format(sense, _ROW_PREFIX[sense], row)
+                for row, sense in enumerate(
+                    self.sense[start:start + chunksize].tolist(), start)))
+
+        stream.write("COLUMNS\n")
+        integer = False
+        for start in range(0, self.nvars, chunksize):
+            stop = min(start + chunksize, self.nvars)
+            rows, cols, coefficients = self._columns(start, stop, chunksize)
+            bounds = np.searchsorted(cols, np.arange(start, stop + 1))
+            prefixes = [_ROW_PREFIX[sense]
+                        for sense in self.sense[rows].tolist()]
+            rows, coefficients = rows.tolist(), coefficients.tolist()
+            lines = []
+            for var, low, high, cost, marked in zip(
+                    range(start, stop), bounds[:-1].tolist(),
+                    bounds[1:].tolist(), self.cost[start:stop].tolist(),
+                    self.integer[start:stop].tolist()):
+                if marked != integer:
+                    lines.append(" MARKER 'MARKER' '{}'\n".format(
+                        'INTORG' if marked else 'INTEND'))
+                    integer = marked
+                if cost or low == high:
+                    lines.append(" x{} obj {!r}\n".format(var, cost))
+                lines.extend(" x{} {}{} {!r}\n".format(var, prefix, row,
+                                                       value)
+                             for prefix, row, value in zip(
+                                 prefixes[low:high], rows[low:high],
+                                 coefficients[low:high]))
+            stream.write("".join(lines))
+        if integer:
+            stream.write(" MARKER 'MARKER' 'INTEND'\n")
+
+        stream.write("RHS\n")
+        if self.objective_offset:
+            # the right hand side of the objective is its negated constant
+            stream.write(" RHS obj {!r}\n".format(
+                -float(self.objective_offset)))
+        for start in range(0, self.nrows, chunksize):
+            rhs = self.rhs[start:start + chunksize]
+            sense = self.sense[start:start + chunksize]
+            stream.write("".join(
+                " RHS {}{} {!r}\n".format(_ROW_PREFIX[kind], row, value)
+                for kind, row, value in zip(
+                    sense[rhs != 0].tolist(),
+                    (np.flatnonzero(rhs) + start).tolist(),
+                    rhs[rhs != 0].tolist())))
+
+        stream.write("BOUNDS\n")
+        for start in range(0, self.nvars, chunksize):
+            lines = []
+            for var, lb, ub, integer in zip(
+                    range(start, start + chunksize),
+                    self.lb[start:start + chunksize].tolist(),
+                    self.ub[start:start + chunksize].tolist(),
+                    self.integer[start:start + chunksize].tolist()):
+                if lb == ub:
+                    lines.append(" FX BND x{} {!r}\n".format(var, lb))
+                    continue
+                if lb == -np.inf and ub == np.inf:
+                    lines.append(" FR BND x{}\n".format(var))
+                    continue
+                if lb == -np.inf:
+                    lines.append(" MI BND x{}\n".format(var))
+                elif lb != 0:
+                    lines.append(" LO BND x{} {!r}\n".format(var, lb))
+                if ub != np.inf:
+                    lines.append(" UP BND x{} {!r}\n".format(var, ub))
+                elif integer:
+                    # some readers bound integer columns by one otherwise
+                    lines.append(" PL BND x{}\n".format(var))
+            stream.write("".join(lines))
+
+        squares = np.flatnonzero(self.quadratic)
+        if len(squares):
+            stream.write("QUADOBJ\n")
+        for start in range(0, len(squares), chunksize):
+            chunk = squares[start:start + chunksize]
+            stream.write("".join(
+                " x{0} x{0} {1!r}\n".format(var, value) for var, value in zip(
+                    chunk.tolist(), self.quadratic[chunk].tolist())))
+        stream.write("ENDATA\n")
+
+
+#: The prefixes of the names of constraints by their sense, following the
+#: names pyomo writes, as its solver plugins skip the duals of all others.
+_ROW_PREFIX = {'E': 'c_e_', 'L': 'c_u_', 'G': 'c_l_'}
+
+
+def _parse_name(name):
+    """ Returns the kind (`'x'` or `'c'`) and the id of a variable or
+    constraint named by :meth:`SparseModel.write`, or None for other names.
+
+    Examples
+    --------
+    >>> _parse_name('x12'), _parse_name('c_l_3'), _parse_name('obj_offset')
+    (('x', 12), ('c', 3), None)
+    """
+    if name[:1] == 'x' and name[1:].isdigit():
+        return 'x', int(name[1:])
+    if name[:4] in ('c_e_', 'c_u_', 'c_l_') and name[4:].isdigit():
+        return 'c', int(name[4:])
+    return None
+
+
+def _cached(cache, key, arrays, render):
+    """ Returns the text produced by `render` for `arrays`, taking it from
+    `cache` if it was rendered from equal arrays before.
+    """
+    if cache is None:
+        return render()
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest = digest.digest()
+    if key in cache and cache[key][0] == digest:
+        return cache[key][1]
+    text = render()
+    cache[key] = (digest, text)
+    return text
+
+
+def _label(key):
+    """ Returns the label of the node `key` or the tuple of labels if `key`
+    is a tuple of nodes.
+    """
+    if isinstance(key, tuple):
+        return tuple(str(k) for k in key)
+    return str(key)
+
+
+class NameMap:
+    """ Maps the names of files written by :meth:`SparseModel.write` back to
+    the families, keys and timesteps of the model.
+
+    Only the layout of every family is stored, so the map stays small
+    regardless of the number of variables and constraints. Keys are
+    represented by their labels.
+
+    Parameters
+    ----------
+    variables, constraints : list
+        The layout of the variable and constraint families as tuples of
+        name, offset, key labels and timesteps (or None).
+
+    Examples
+    --------
+    >>> m = SparseModel()
+    >>> x = m.add_variables('x', ['a', 'b'], timesteps=range(2))
+    >>> names = m.name_map()
+    >>> names.lookup('x3')
+    ('x', 'b', 1)
+    >>> names.unflatten([0, 1, 2, 3])['x']['b']
+    [2, 3]
+    """
+    def __init__(self, variables, constraints):
+        self.families = {'x': [tuple(f) for f in variables],
+                         'c': [tuple(f) for f in constraints]}
+
+    @classmethod
+    def from_model(cls, model):
+        """ Creates the name map of the :class:`SparseModel` `model`.
+        """
+        def layout(families):
+            return [(grid.name, grid.offset, [_label(k) for k in grid.keys],
+                     None if grid.timesteps is None else
+                     grid.timesteps.tolist())
+                    for grid in families.values()]
+        return cls(layout(model.variables), layout(model.constraints))
+
+    def dump(self, path):
+        """ Writes the map to `path` as JSON, compressed if `path` ends with
+        `.gz`.
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'wt') as stream:
+            json.dump({'variables': self.families['x'],
+                       'constraints': self.families['c']}, stream)
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a map written by :meth:`dump`.
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as stream:
+            layout = json.load(stream)
+
+        def restore(families):
+            return [(name, offset,
+                     [tuple(k) if isinstance(k, list) else k for k in keys],
+                     timesteps)
+                    for name, offset, keys, timesteps in families]
+        return cls(restore(layout['variables']),
+                   restore(layout['constraints']))
+
+    def lookup(self, name):
+        """ Returns family, key and timestep (if any) of the variable or
+        constraint called `name`.
+        """
+        parsed = _parse_name(name)
+        if parsed is None:
+            raise KeyError(name)
+        kind, id = parsed
+        families = [f for f in self.families[kind] if f[2]]
+        position = bisect.bisect_right([f[1] for f in families], id) - 1
+        family, offset, keys, timesteps = families[max(position, 0)]
+        key, step = divmod(id - offset, len(timesteps or [None]))
+        if not 0 <= key < len(keys):
+            raise KeyError(name)
+        if timesteps is None:
+            return family, keys[key]
+        return family, keys[key], timesteps[step]
+
+    def unflatten(self, values, kind='x'):
+        """ Splits `values`, indexed by variable (`kind='x'`) or constraint
+        (`kind='c'`) id, into dictionaries keyed by family and key label.
+        """
+        values = np.asarray(values)
+        result = OrderedDict()
+        for family, offset, keys, timesteps in self.families[kind]:
+            width = len(timesteps or [None])
+            block = values[offset:offset + len(keys) * width]
+            if timesteps is None:
+                result[family] = OrderedDict(zip(keys, block.tolist()))
+            else:
+                result[family] = OrderedDict(
+                    zip(keys, block.reshape(-1, width).tolist()))
+        return result
+
+
+class Presolve:
+    """ A :class:`SparseModel` reduced before handing it to a solver.
+
+    Presolving repeatedly
+
+    * folds variables with equal bounds, e.g. fixed flows or flows bounded
+      by zero, into the right hand sides and the objective offset,
+    * drops rows left without variables, after checking that they hold,
+    * turns rows with a single variable into bounds of that variable,
+      which may fix it in turn,
+
+    until nothing changes, and finally drops rows with the same sense and
+    the same coefficients as another row, keeping the tightest right hand
+    side.
+
+    The remaining variables and rows are numbered consecutively in
+    :attr:`model`, whose solutions are expanded to the original variables
+    and rows by :meth:`solution` and :meth:`duals`.
+
+    Parameters
+    ----------
+    model : SparseModel
+        The model to reduce. It is left unchanged.
+    bounds : bool
+        Whether rows with a single variable may be turned into bounds. The
+        duals of such rows are lost, so they should be kept if duals are
+        needed.
+    tolerance : float
+        The violation, relative to the magnitude of the right hand side or
+        bound, up to which dropped rows and crossing bounds are considered
+        to hold.
+
+    Attributes
+    ----------
+    model : SparseModel
+        The reduced model, without families of variables or constraints.
+    columns, rows : numpy.ndarray
+        The original ids of the variables and rows of the reduced model.
+    values : numpy.ndarray
+        The values of the folded variables, indexed by original variable id,
+        which are NaN for the remaining ones.
+
+    Raises
+    ------
+    ValueError
+        If the model is found to be infeasible.
+
+    Examples
+    --------
+    >>> m = SparseModel()
+    >>> x = m.add_variables('x', ['a', 'b', 'c'], ub=[2, 3, 0])
+    >>> rows = m.add_constraints('rows', ['s', 't', 'u'], ['G', 'L', 'G'],
+    ...                          [4, 5, 3])
+    >>> m.add_coefficients(rows['s'], x.ids, 1)
+    >>> m.add_coefficients(rows['t'], x['b'], 2)
+    >>> m.add_coefficients(rows['u'], x.ids, 1)
+    >>> p = Presolve(m)
+    >>> p.columns.tolist(), p.rows.tolist(), p.model.ub.tolist()
+    ([0, 1], [0], [2.0, 2.5])
+    >>> p.solution([2, 2]).tolist()
+    [2.0, 2.0, 0.0]
+    """
+    def __init__(self, model, bounds=True, tolerance=1e-9):
+        rows, cols, coefficients = model.matrix()
+        lb, ub = model.lb.copy(), model.ub.copy()
+        sense, rhs = model.sense, model.rhs.copy()
+        values = np.full(model.nvars, np.nan)
+        active = np.ones(model.nrows, dtype=bool)
+        offset = model.objective_offset
+
+        while True:
+            # fold the variables fixed since the last pass
+            fixed = (lb == ub) & np.isnan(values)
+            if fixed.any():
+                values[fixed] = lb[fixed]
+                offset += float(np.dot(model.cost[fixed], values[fixed]) +
+                                np.dot(model.quadratic[fixed],
+                                       values[fixed] ** 2) / 2)
+                hit = fixed[cols]
+                rhs -= np.bincount(rows[hit], coefficients[hit] *
+                                   values[cols[hit]], minlength=len(rhs))
+                rows, cols = rows[~hit], cols[~hit]
+                coefficients = coefficients[~hit]
+
+            count = np.bincount(rows, minlength=len(rhs))
+            empty = active & (count == 0)
+            slack = tolerance * (1 + np.abs(model.rhs))
+            violated = empty & np.where(
+                sense == 'E', np.abs(rhs) > slack,
+                np.where(sense == 'L', rhs < -slack, rhs > slack))
+            if violated.any():
+                raise ValueError(
+                    "The model is infeasible, as row {} can't hold.".format(
+                        np.flatnonzero(violated)[0]))
+            active &= ~empty
+
+            single = active & (count == 1)
+            if not bounds or not single.any():
+                break
+            hit = single[rows]
+            r, c, a = rows[hit], cols[hit], coefficients[hit]
+            bound = rhs[r] / a
+            lower = (sense[r] == 'E') | ((sense[r] == 'G') == (a > 0))
+            upper = (sense[r] == 'E') | ((sense[r] == 'L') == (a > 0))
+            integer = model.integer[c]
+            np.maximum.at(lb, c[lower], np.where(
+                integer, np.ceil(bound - tolerance), bound)[lower])
+            np.minimum.at(ub, c[upper], np.where(
+                integer, np.floor(bound + tolerance), bound)[upper])
+            crossed = np.flatnonzero(lb > ub)
+            wide = lb[crossed] - ub[crossed] > tolerance * (
+                1 + np.abs(lb[crossed]))
+            if wide.any():
+                raise ValueError(
+                    "The model is infeasible, as the bounds of variable {} "
+                    "cross.".format(crossed[wide][0]))
+            ub[crossed] = lb[crossed]
+            active &= ~single
+            rows, cols = rows[~hit], cols[~hit]
+            coefficients = coefficients[~hit]
+
+        self._drop_duplicates(rows, cols, coefficients, sense, rhs, active,
+                              tolerance)
+        keep = active[rows]
+        rows, cols = rows[keep], cols[keep]
+        coefficients = coefficients[keep]
+
+        self.columns = np.flatnonzero(np.isnan(values))
+        self.rows = np.flatnonzero(active)
+        self.values = values
+        self._active = active
+        # the new ids of the remaining variables and rows
+        column = np.full(model.nvars, -1)
+        column[self.columns] = np.arange(len(self.columns))
+        row = np.full(model.nrows, -1)
+        row[self.rows] = np.arange(len(self.rows))
+
+        reduced = SparseModel()
+        reduced.name = model.name
+        reduced.lb, reduced.ub = lb[self.columns], ub[self.columns]
+        reduced.integer = model.integer[self.columns]
+        reduced.cost = model.cost[self.columns]
+        reduced.quadratic = model.quadratic[self.columns]
+        reduced.sense, reduced.rhs = sense[self.rows], rhs[self.rows]
+        reduced.objective_offset = offset
+        reduced.add_coefficients(row[rows], column[cols], coefficients)
+        self.model = reduced
+
+    @staticmethod
+    def _drop_duplicates(rows, cols, coefficients, sense, rhs, active,
+                         tolerance):
+        """ Deactivates the `active` rows which have the same sense and
+        coefficients as another active row, whose right hand side is
+        tightened to the tightest of them.
+        """
+        if not len(rows):
+            return
+        # rows with equal coefficients have equal sums of them, weighted by
+        # random numbers per column, as the triplets are sorted
+        random_state = np.random.RandomState(0)
+        weights = random_state.uniform(1, 2, (2, int(cols.max()) + 1))
+        count = np.bincount(rows, minlength=len(rhs))
+        hashes = [np.bincount(rows, coefficients * w[cols],
+                              minlength=len(rhs)) for w in weights]
+        candidates = np.flatnonzero(active & (count > 1))
+        if len(candidates) < 2:
+            return
+        order = candidates[np.lexsort(
+            [h[candidates] for h in hashes] +
+            [count[candidates], sense[candidates]])]
+        equal = np.ones(len(order) - 1, dtype=bool)
+        for key in [sense, count] + hashes:
+            equal &= key[order[1:]] == key[order[:-1]]
+        # the position of the first row of each run of equal keys
+        positions = np.arange(len(order))
+        first = np.maximum.accumulate(np.where(
+            np.concatenate([[True], ~equal]), positions, 0))
+        starts = np.searchsorted(rows, np.arange(len(rhs) + 1))
+
+        def row(r):
+            return (cols[starts[r]:starts[r + 1]],
+                    coefficients[starts[r]:starts[r + 1]])
+
+        for position in (np.flatnonzero(equal) + 1).tolist():
+            kept, twin = order[first[position]], order[position]
+            if not all(np.array_equal(x, y)
+                       for x, y in zip(row(kept), row(twin))):
+                continue
+            if sense[kept] == 'E' and abs(rhs[kept] - rhs[twin]) > tolerance:
+                raise ValueError(
+                    "The model is infeasible, as rows {} and {} "
+                    "contradict each other.".format(kept, twin))
+            if sense[kept] == 'L':
+                rhs[kept] = min(rhs[kept], rhs[twin])
+            elif sense[kept] == 'G':
+                rhs[kept] = max(rhs[kept], rhs[twin])
+            active[twin] = False
+
+    def solution(self, values):
+        """ Returns the values of all original variables for the `values`
+        of the variables of the reduced model.
+        """
+        solution = self.values.copy()
+        solution[self.columns] = values
+        return solution
+
+    def duals(self, values):
+        """ Returns the duals of all original rows for the duals `values` of
+        the rows of the reduced model. Dropped rows get a dual of zero.
+        """
+        duals = np.zeros(len(self._active))
+        duals[self.rows] = values
+        return duals
+
+
+# #############################################################################
+#
+# Block builders
+#
+# #############################################################################
+
+def _flow_bounds(f, timesteps, previous=None):
+    """ Returns the lower and upper bounds of the variables of flow `f`.
+
+    If the `previous` value of the flow is given, the flow can only change
+    by its gradients from it in the first timestep.
+    """
+    lb = np.zeros(len(timesteps))
+    ub = np.full(len(timesteps), np.inf)
+    # nothing to set if there is no nominal value
+    if f.nominal_value is None:
+        return lb, ub
+    if f.binary is None:
+        lb = _series(f.min, timesteps) * f.nominal_value
+        ub = _series(f.max, timesteps) * f.nominal_value
+    if previous is not None and len(timesteps):
+        t = timesteps[0]
+        if f.positive_gradient[0] is not None:
+            ub[0] = min(ub[0],
+                        previous + f.positive_gradient[t] * f.nominal_value)
+        if f.negative_gradient[0] is not None:
+            lb[0] = max(lb[0],
+                        previous - f.negative_gradient[t] * f.nominal_value)
+    if f.fixed:
+        value = _series(f.actual_value, timesteps) * f.nominal_value
+        known = ~np.isnan(value)
+        lb[known] = ub[known] = value[known]
+    return lb, ub
+
+
+def _bus(m, group):
+    """ Balance of all inflows and outflows of the buses in `group`, see
+    :class:`.blocks.Bus`.
+    """
+    buses = [n for n in group if n.inputs or n.outputs]
+    edges = ([(n, (i, n), 1) for n in buses for i in n.inputs] +
+             [(n, (n, o), -1) for n in buses for o in n.outputs])
+    balance = m.add_constraints('Bus.balance', buses, 'E', 0, m.TIMESTEPS)
+    if edges:
+        m.add_coefficients(balance.select([e[0] for e in edges]),
+                           m.flow.select([e[1] for e in edges]),
+                           np.outer([e[2] for e in edges], m.tau))
+
+
+def _linear_transformer(m, group):
+    """ Linear relation of the input and the outputs of the transformers in
+    `group`, see :class:`.blocks.LinearTransformer`.
+    """
+    pairs = [(n, o) for n in group for o in n.outputs]
+    relation = m.add_constraints('LinearTransformer.relation', pairs, 'E', 0,
+                                 m.TIMESTEPS)
+    factors = []
+    for n, o in pairs:
+        try:
+            factors.append(_series(n.conversion_factors[o], m.TIMESTEPS))
+        except KeyError:
+            raise ValueError("Error in constraint creation",
+                             "source: {0}, target: {1}".format(n.label,
+                                                               o.label))
+    if pairs:
+        m.add_coefficients(relation.ids,
+                           m.flow.select([(n._input(), n) for n, o in pairs]),
+                           np.array(factors))
+        m.add_coefficients(relation.ids, m.flow.select(pairs), -1)
+
+
+def _storage_balance(m, name, capacity, group, initial=None):
+    """ Storage balance shared by :func:`_storage` and
+    :func:`_investment_storage`.
+
+    Storages found in `initial` start from the capacity given there, and
+    those linked over a period sequence from zero in every period.
+    """
+    initial = initial or {}
+    ts = m.TIMESTEPS
+    loss = _stack(group, 'capacity_loss', ts)
+    rhs = np.zeros(loss.shape)
+    given = np.array([n in initial for n in group], dtype=bool)
+    rhs[given, 0] = [initial[n] * (1 - loss[k, 0])
+                     for k, n in enumerate(group) if given[k]]
+    balance = m.add_constraints(name, group, 'E', rhs, ts)
+    if not group:
+        return
+    m.add_coefficients(balance.ids, capacity.ids, 1)
+    # the given capacities replace the capacity at the last timestep
+    previous = np.where(given[:, None] & (np.arange(len(ts)) == 0), 0,
+                        loss - 1)
+    if m.period_sequence is not None:
+        previous[:, m.first] = 0
+    m.add_coefficients(balance.ids, capacity.ids[:, m.previous], previous)
+    m.add_coefficients(balance.ids,
+                       m.flow.select([(n._input(), n) for n in group]),
+                       -_stack(group, 'inflow_conversion_factor', ts) * m.tau)
+    m.add_coefficients(balance.ids,
+                       m.flow.select([(n, n._output()) for n in group]),
+                       m.tau / _stack(group, 'outflow_conversion_factor', ts))
+
+
+def _link_periods(m, prefix, capacity, group, invest=None):
+    """ Inter-period states of storages linked over the period sequence,
+    see :func:`.blocks._link_periods`.
+
+    The storages are bounded by their nominal capacity, or by the `invest`
+    variables if given. Returns the inter-period states.
+    """
+    ts = m.TIMESTEPS
+    sequence = np.asarray(m.period_sequence)
+    steps = np.arange(len(sequence))
+    starts = np.flatnonzero(m.first)
+    lasts = np.append(starts[1:], len(ts)) - 1
+    period = np.cumsum(m.first) - 1
+    inter = m.add_variables(prefix + '.inter_capacity', group, steps)
+    intra_max = m.add_variables(prefix + '.intra_max', group,
+                                np.arange(len(starts)), lb=-np.inf)
+    intra_min = m.add_variables(prefix + '.intra_min', group,
+                                np.arange(len(starts)), lb=-np.inf)
+
+    for name, sense, bound in (('intra_upper', 'L', intra_max),
+                               ('intra_lower', 'G', intra_min)):
+        rows = m.add_constraints(prefix + '.' + name, group, sense, 0,
+                                 ts).ids
+        if group:
+            m.add_coefficients(rows, capacity.ids, 1)
+            m.add_coefficients(rows, bound.ids[:, period], -1)
+
+    # the decay of the inter-period states over each period of the sequence
+    decay = (np.multiply.reduceat(1 - _stack(group, 'capacity_loss', ts),
+                                  starts, axis=1)[:, sequence]
+             if group else np.ones((0, len(steps))))
+    rows = m.add_constraints(prefix + '.inter_balance', group, 'E', 0,
+                             steps).ids
+    if group:
+        m.add_coefficients(rows, inter.ids[:, np.roll(steps, -1)], 1)
+        m.add_coefficients(rows, inter.ids, -decay)
+        m.add_coefficients(rows, capacity.ids[:, lasts[sequence]], -1)
+
+    # the upper bound holds for the undecayed state and the lower bound for
+    # the state decayed at the end of the period
+    for name, sense, bound, limit, reduce, factor in (
+            ('inter_upper', 'L', intra_max, 'capacity_max', np.minimum, 1),
+            ('inter_lower', 'G', intra_min, 'capacity_min', np.maximum,
+             decay)):
+        limits = (reduce.reduceat(_stack(group, limit, ts), starts,
+                                  axis=1)[:, sequence]
+                  if group else np.zeros((0, len(steps))))
+        if invest is None:
+            rhs = _column([n.nominal_capacity for n in group]) * limits
+        else:
+            rhs = 0
+        rows = m.add_constraints(prefix + '.' + name, group, sense, rhs,
+                                 steps).ids
+        if group:
+            m.add_coefficients(rows, inter.ids, factor)
+            m.add_coefficients(rows, bound.ids[:, sequence], 1)
+            if invest is not None:
+                m.add_coefficients(rows, invest.ids[:, None], -limits)
+    return inter
+
+
+def _storage(m, group):
+    """ Storages without investment, see :class:`.blocks.Storage`.
+    """
+    ts = m.TIMESTEPS
+    linked = m.period_sequence is not None
+    nominal = _column([n.nominal_capacity for n in group])
+    lb = nominal * _stack(group, 'capacity_min', ts)
+    ub = nominal * _stack(group, 'capacity_max', ts)
+    if linked:
+        # intra-period states are bounded via the inter-period ones
+        lb, ub = -np.inf, np.inf
+    else:
+        for k, n in enumerate(group):
+            if n.initial_capacity is not None and n not in m.initial_state:
+                lb[k, -1] = ub[k, -1] = (n.initial_capacity *
+                                         n.nominal_capacity)
+            if n in m.final_state:
+                lb[k, -1] = ub[k, -1] = m.final_state[n]
+    capacity = m.add_variables('Storage.capacity', group, ts, lb, ub)
+    _storage_balance(m, 'Storage.balance', capacity, group, m.initial_state)
+    if linked:
+        inter = _link_periods(m, 'Storage', capacity, group)
+        for n in group:
+            if n.initial_capacity is not None:
+                m.lb[inter[n][0]] = m.ub[inter[n][0]] = (
+                    n.initial_capacity * n.nominal_capacity)
+
+    m.objective_offset += sum(n.nominal_capacity * n.fixed_costs
+                              for n in group if n.fixed_costs is not None)
+    valued = [n for n in group if n in m.final_values]
+    m.add_costs(capacity.select(valued)[:, -1],
+                [-m.final_values[n] for n in valued])
+
+
+def _investment_storage(m, group):
+    """ Storages with an :class:`.Investment` object, see
+    :class:`.blocks.InvestmentStorage`.
+    """
+    ts = m.TIMESTEPS
+    linked = m.period_sequence is not None
+    # intra-period states of linked periods may become negative
+    capacity = m.add_variables('InvestmentStorage.capacity', group, ts,
+                               lb=-np.inf if linked else 0)
+    invest = m.add_variables('InvestmentStorage.invest', group,
+                             ub=[n.investment.maximum for n in group])
+    _storage_balance(m, 'InvestmentStorage.balance', capacity, group)
+    if linked:
+        inter = _link_periods(m, 'InvestmentStorage', capacity, group,
+                              invest)
+
+    initial = [n for n in group if n.initial_capacity is not None]
+    rows = m.add_constraints('InvestmentStorage.initial_capacity', initial,
+                             'E', 0).ids
+    m.add_coefficients(rows, (inter.select(initial)[:, 0] if linked else
+                              capacity.select(initial)[:, -1]), 1)
+    m.add_coefficients(rows, invest.select(initial),
+                       [-n.initial_capacity for n in initial])
+
+    flow_invest = m.variables['InvestmentFlow.invest']
+    rows = m.add_constraints('InvestmentStorage.storage_capacity_inflow',
+                             group, 'E', 0).ids
+    m.add_coefficients(rows, flow_invest.select([(n._input(), n)
+                                                 for n in group]), 1)
+    m.add_coefficients(rows, invest.ids,
+                       [-n.nominal_input_capacity_ratio for n in group])
+    rows = m.add_constraints('InvestmentStorage.storage_capacity_outflow',
+                             group, 'E', 0).ids
+    m.add_coefficients(rows, flow_invest.select([(n, n._output())
+                                                 for n in group]), 1)
+    m.add_coefficients(rows, invest.ids,
+                       [-n.nominal_output_capacity_ratio for n in group])
+
+    for n in group:
+        if n.investment.ep_costs is None:
+            raise ValueError("Missing value for investment costs!")
+    m.add_costs(invest.ids, [n.investment.ep_costs + (n.fixed_costs or 0)
+                             for n in group])
+
+    if linked:
+        # the intra-period states are bounded via the inter-period ones
+        return
+
+    rows = m.add_constraints('InvestmentStorage.max_capacity', group, 'L', 0,
+                             ts).ids
+    m.add_coefficients(rows, capacity.ids, 1)
+    m.add_coefficients(rows, invest.ids[:, None],
+                       -_stack(group, 'capacity_max', ts))
+
+    minimum = [n for n in group if _series(n.capacity_min, ts).sum() > 0]
+    rows = m.add_constraints('InvestmentStorage.min_capacity', minimum, 'G',
+                             0, ts).ids
+    m.add_coefficients(rows, capacity.select(minimum), 1)
+    m.add_coefficients(rows, invest.select(minimum)[:, None],
+                       -_stack(minimum, 'capacity_min', ts))
+
+
+def _flow(m, group):
+    """ Summed limits, gradients and costs of standard flows, see
+    :class:`.blocks.Flow`.
+    """
+    ts = m.TIMESTEPS
+    for limit, sense in (('summed_max', 'L'), ('summed_min', 'G')):
+        flows = [(i, o, f) for i, o, f in group
+                 if getattr(f, limit) is not None and
+                 f.nominal_value is not None]
+        keys = [(i, o) for i, o, f in flows]
+        rows = m.add_constraints(
+            'Flow.' + limit, keys, sense,
+            [getattr(f, limit) * f.nominal_value for i, o, f in flows]).ids
+        m.add_coefficients(rows[:, None], m.flow.select(keys),
+                           m.tau * m.weight)
+
+    later = ~m.first
+    for direction, sign in (('positive', 1), ('negative', -1)):
+        attribute = direction + '_gradient'
+        flows = [(i, o, f) for i, o, f in group
+                 if getattr(f, attribute)[0] is not None]
+        keys = [(i, o) for i, o, f in flows]
+        ub = (_stack([f for i, o, f in flows], attribute, ts) *
+              _column([f.nominal_value for i, o, f in flows]))
+        # flows without a nominal value have unbounded gradients
+        ub[np.isnan(ub)] = np.inf
+        gradient = m.add_variables(direction + '_flow_gradient', keys, ts,
+                                   ub=ub)
+        rows = m.add_constraints('Flow.{}_gradient_constr'.format(direction),
+                                 keys, 'L', 0, ts[later]).ids
+        flow = m.flow.select(keys)
+        m.add_coefficients(rows, flow[:, later], sign)
+        m.add_coefficients(rows, flow[:, m.previous[later]], -sign)
+        m.add_coefficients(rows, gradient.ids[:, later], -1)
+
+    costly = [(i, o, f) for i, o, f in group
+              if f.variable_costs[0] is not None]
+    m.add_costs(m.flow.select([(i, o) for i, o, f in costly]),
+                _stack([f for i, o, f in costly], 'variable_costs', ts) *
+                m.tau * m.weight)
+    m.objective_offset += sum(f.nominal_value * f.fixed_costs
+                              for i, o, f in group
+                              if f.fixed_costs and
+                              f.nominal_value is not None)
+
+
+def _investment_flow(m, group):
+    """ Flows with an :class:`.Investment` object, see
+    :class:`.blocks.InvestmentFlow`.
+    """
+    ts = m.TIMESTEPS
+    keys = [(i, o) for i, o, f in group]
+    flows = [f for i, o, f in group]
+    invest = m.add_variables('InvestmentFlow.invest', keys,
+                             ub=[f.investment.maximum for f in flows])
+
+    def subset(condition):
+        selected = [(k, f) for k, f in zip(keys, flows) if condition(f)]
+        return [k for k, f in selected], [f for k, f in selected]
+
+    for name, sense, attribute, condition in (
+            ('fixed', 'E', 'actual_value', lambda f: f.fixed),
+            ('max', 'L', 'max', lambda f: True),
+            ('min', 'G', 'min',
+             lambda f: _series(f.min, ts).sum() > 0)):
+        selected, selected_flows = subset(condition)
+        rows = m.add_constraints('InvestmentFlow.' + name, selected, sense,
+                                 0, ts).ids
+        m.add_coefficients(rows, m.flow.select(selected), 1)
+        m.add_coefficients(rows, invest.select(selected)[:, None],
+                           -_stack(selected_flows, attribute, ts))
+
+    for limit, sense in (('summed_max', 'L'), ('summed_min', 'G')):
+        selected, selected_flows = subset(
+            lambda f: getattr(f, limit) is not None)
+        rows = m.add_constraints('InvestmentFlow.' + limit, selected, sense,
+                                 0).ids
+        m.add_coefficients(rows[:, None], m.flow.select(selected),
+                           m.tau * m.weight)
+        m.add_coefficients(rows, invest.select(selected),
+                           [-getattr(f, limit) for f in selected_flows])
+
+    for f in flows:
+        if f.investment.ep_costs is None:
+            raise ValueError("Missing value for investment costs!")
+    m.add_costs(invest.ids, [f.investment.ep_costs + (f.fixed_costs or 0)
+                             for f in flows])
+
+
+def _binary_flow(m, group):
+    """ Status, startup and shutdown of flows with a :class:`.BinaryFlow`
+    object, see :class:`.blocks.BinaryFlow`.
+    """
+    ts = m.TIMESTEPS
+    keys = [(i, o) for i, o, f in group]
+    status = m.add_variables('BinaryFlow.status', keys, ts, ub=1,
+                             integer=True)
+
+    flows = [(i, o, f) for i, o, f in group
+             if _series(f.min, ts).sum() > 0]
+    selected = [(i, o) for i, o, f in flows]
+    nominal = _column([f.nominal_value for i, o, f in flows])
+    for name, sense in (('min', 'G'), ('max', 'L')):
+        rows = m.add_constraints('BinaryFlow.' + name, selected, sense, 0,
+                                 ts).ids
+        m.add_coefficients(rows, m.flow.select(selected), 1)
+        m.add_coefficients(rows, status.select(selected),
+                           -_stack([f for i, o, f in flows], name, ts) *
+                           nominal)
+
+    for name, sign in (('startup', 1), ('shutdown', -1)):
+        flows = [(i, o, f) for i, o, f in group
+                 if getattr(f.binary, name + '_costs') is not None]
+        selected = [(i, o) for i, o, f in flows]
+        switch = m.add_variables('BinaryFlow.' + name, selected, ts, ub=1,
+                                 integer=True)
+        rhs = np.zeros((len(flows), len(ts)))
+        rhs[:, m.first] = _column([
+            -sign * m.initial_state.get((i, o), f.binary.initial_status)
+            for i, o, f in flows])
+        rows = m.add_constraints('BinaryFlow.{}_constr'.format(name),
+                                 selected, 'G', rhs, ts).ids
+        m.add_coefficients(rows, switch.ids, 1)
+        m.add_coefficients(rows, status.select(selected), -sign)
+        later = ~m.first
+        m.add_coefficients(rows[:, later],
+                           status.select(selected)[:, m.previous[later]],
+                           sign)
+        m.add_costs(switch.ids,
+                    _column([getattr(f.binary, name + '_costs')
+                             for i, o, f in flows]) * m.weight)
+
+
+def _discrete_flow(m, group):
+    """ Flows forced to integer values, see :class:`.blocks.DiscreteFlow`.
+    """
+    keys = [(i, o) for i, o, f in group]
+    discrete = m.add_variables('DiscreteFlow.discrete_flow', keys,
+                               m.TIMESTEPS, integer=True)
+    rows = m.add_constraints('DiscreteFlow.integer_flow', keys, 'E', 0,
+                             m.TIMESTEPS).ids
+    m.add_coefficients(rows, discrete.ids, 1)
+    m.add_coefficients(rows, m.flow.select(keys), -1)
+
+
+#: Functions emitting the variables, rows and costs of a constraint group,
+#: keyed by the block class the group belongs to.
+BUILDERS = {blocks.Bus: _bus,
+            blocks.LinearTransformer: _linear_transformer,
+            blocks.Storage: _storage,
+            blocks.InvestmentFlow: _investment_flow,
+            blocks.InvestmentStorage: _investment_storage,
+            blocks.Flow: _flow,
+            blocks.BinaryFlow: _binary_flow,
+            blocks.DiscreteFlow: _discrete_flow}
+
+
+class SparseOperationalModel(SparseModel):
+    """ An :class:`.OperationalModel` generated as a sparse matrix.
+
+    The model takes the same arguments as :class:`.OperationalModel` and
+    creates the same variables and constraints, but every block emits its
+    rows for all timesteps at once as coefficient arrays instead of creating
+    one Pyomo expression per row. Use it instead of
+    :class:`.OperationalModel` for large models, where building the Pyomo
+    model takes most of the time and memory.
+
+    Variable and constraint families are named after the Pyomo components
+    they correspond to, e.g. `om.variables['Storage.capacity']` holds the
+    ids of `OperationalModel.Storage.capacity` and `om.flow` those of
+    `OperationalModel.flow`.
+
+    Parameters
+    ----------
+    es : EnergySystem object
+        Object that holds the nodes of an oemof energy system graph
+    constraint_groups : list
+        Additional constraint groups. A builder function taking the model
+        and the group has to be registered for each of them in
+        :const:`BUILDERS`.
+    timeindex : pandas DatetimeIndex
+    timesteps : sequence (optional)
+    timeincrement : float or list of floats (optional)
+    initial_state : dict (optional)
+    final_state : dict (optional)
+    final_values : dict (optional)
+    periods : list of lists (optional)
+    objective_weighting : float or list of floats (optional)
+    period_sequence : list of ints (optional)
+        See :class:`.OperationalModel`.
+    spill : bool or str (optional)
+        Keep the constraint matrix on disk, see :class:`SparseModel`.
+    presolve : bool (optional)
+        Hand the model to the solver reduced by :class:`Presolve`. The
+        solutions are expanded again, so that the results hold all flows.
+        Rows with a single variable are only turned into bounds if no duals
+        are received.
+
+    Attributes
+    ----------
+    presolved : Presolve
+        The reduction of the model handed to the solver last, if it is
+        presolved.
+    """
+    CONSTRAINT_GROUPS = [blocks.Bus, blocks.LinearTransformer,
+                         blocks.Storage, blocks.InvestmentFlow,
+                         blocks.InvestmentStorage, blocks.Flow,
+                         blocks.BinaryFlow, blocks.DiscreteFlow]
+
+    def __init__(self, es, **kwargs):
+        super().__init__(spill=kwargs.get('spill', False))
+
+        self.name = kwargs.get('name', 'SparseOperationalModel')
+        self.es = es
+        self.timeindex = kwargs.get('timeindex', es.timeindex)
+        self.timesteps = kwargs.get('timesteps', range(len(self.timeindex)))
+        self.periods = kwargs.get('periods')
+        if self.periods is not None:
+            self.timesteps = [t for period in self.periods for t in period]
+        if self.timesteps is None:
+            raise ValueError("Missing timesteps!")
+        self.timeincrement = Sequence(kwargs.get(
+            'timeincrement', self.timeindex.freq.nanos / 3.6e12))
+        self.objective_weighting = Sequence(kwargs.get('objective_weighting',
+                                                       1))
+        self.initial_state = kwargs.get('initial_state', {})
+        self.final_state = kwargs.get('final_state', {})
+        self.final_values = kwargs.get('final_values', {})
+        self.period_sequence = _period_sequence(self, kwargs)
+        self._constraint_groups = (type(self).CONSTRAINT_GROUPS +
+                                   kwargs.get('constraint_groups', []))
+        self.duals = None
+        self._receive_duals = False
+        self._presolve = kwargs.get('presolve', False)
+        self.presolved = None
+
+        self.flows = _flows(es)
+
+        self.TIMESTEPS = np.asarray(self.timesteps, dtype=int)
+        self.tau = _series(self.timeincrement, self.TIMESTEPS)
+        self.weight = _series(self.objective_weighting, self.TIMESTEPS)
+        # positions of the previous timesteps, wrapping around at the start
+        # of each period
+        lengths = ([len(period) for period in self.periods]
+                   if self.periods is not None else [len(self.TIMESTEPS)])
+        starts = np.cumsum([0] + lengths[:-1])
+        self.first = np.zeros(len(self.TIMESTEPS), dtype=bool)
+        self.first[starts] = True
+        self.previous = np.arange(len(self.TIMESTEPS)) - 1
+        self.previous[starts] += lengths
+
+        # ######################### FLOW VARIABLE #############################
+        shape = (len(self.flows), len(self.TIMESTEPS))
+        bounds = [_flow_bounds(f, self.TIMESTEPS, self.initial_state.get(f))
+                  for f in self.flows.values()]
+        lb = np.array([b[0] for b in bounds]).reshape(shape)
+        ub = np.array([b[1] for b in bounds]).reshape(shape)
+        self.flow = self.add_variables('flow', self.flows, self.TIMESTEPS,
+                                       lb, ub)
+
+        # ########################### CONSTRAINTS #############################
+        for group in self._constraint_groups:
+            if group not in BUILDERS:
+                raise ValueError(
+                    "No sparse builder for constraint group {}.".format(
+                        group.__name__))
+            members = self.es.groups.get(group)
+            if members is not None:
+                BUILDERS[group](self, members)
+
+        self.solution = np.full(self.nvars, np.nan)
+
+    def _patch(self, name, key, terms, wanted=True):
+        """ Sets the coefficients `terms`, pairs of columns and values, in
+        the rows of the constraint family `name` belonging to `key`.
+
+        If the rows aren't `wanted` anymore, the terms are zeroed, which
+        leaves trivially satisfied rows.
+        """
+        grid = self.constraints.get(name)
+        if grid is None or key not in grid:
+            if wanted:
+                raise ValueError(
+                    "Can't add rows to {} by updating. Please build the "
+                    "model anew.".format(name))
+            return
+        for cols, values in terms:
+            self.set_coefficients(grid[key], cols, values if wanted else 0)
+
+    def _update_initial_state(self, initial_state):
+        """ Replaces the `initial_state` and patches the storage balances,
+        startup and shutdown rows and flow bounds depending on it.
+        """
+        balance = self.constraints.get('Storage.balance')
+        storages = balance.keys if balance is not None else []
+        _check_initial_storages(storages, self.initial_state, initial_state)
+        self.initial_state = dict(initial_state)
+        for n in storages:
+            if n in initial_state:
+                self.update(n)
+        for name, sign in (('startup', 1), ('shutdown', -1)):
+            rows = self.constraints.get('BinaryFlow.{}_constr'.format(name))
+            for key in (rows.keys if rows is not None else []):
+                self.rhs[rows[key][self.first]] = -sign * initial_state.get(
+                    key, self.flows[key].binary.initial_status)
+        for key, f in self.flows.items():
+            if (f.positive_gradient[0] is not None or
+                    f.negative_gradient[0] is not None):
+                self.lb[self.flow[key]], self.ub[self.flow[key]] = (
+                    _flow_bounds(f, self.TIMESTEPS, initial_state.get(f)))
+
+    def update(self, obj=None, initial_state=None, **attributes):
+        r""" Changes `attributes` of `obj` and patches the bounds,
+        coefficients and costs depending on them, so that the model can be
+        solved again without building it anew.
+
+        See :meth:`.OperationalModel.update`. As the rows of the matrix
+        are fixed, a change which requires rows that weren't built, e.g.
+        raising the minimum of an investment flow from zero, raises a
+        ValueError.
+        """
+        if initial_state is not None:
+            self._update_initial_state(initial_state)
+        if obj is None:
+            return
+        _set_attributes(obj, attributes)
+        ts = self.TIMESTEPS
+
+        if isinstance(obj, Flow):
+            for key in [k for k, f in self.flows.items() if f is obj]:
+                flow = self.flow[key]
+                self.lb[flow], self.ub[flow] = _flow_bounds(
+                    obj, ts, self.initial_state.get(obj))
+                if 'variable_costs' in attributes:
+                    costs = (_series(obj.variable_costs, ts) * self.tau *
+                             self.weight)
+                    self.cost[flow] = np.nan_to_num(costs)
+                minimum = _series(obj.min, ts).sum() > 0
+                if obj.investment is not None:
+                    invest = self.variables['InvestmentFlow.invest'][key]
+                    if obj.fixed:
+                        self._patch('InvestmentFlow.fixed', key, [
+                            (invest, -_series(obj.actual_value, ts))])
+                    self._patch('InvestmentFlow.max', key, [
+                        (invest, -_series(obj.max, ts))])
+                    self._patch('InvestmentFlow.min', key, [
+                        (flow, 1), (invest, -_series(obj.min, ts))], minimum)
+                if obj.binary is not None:
+                    status = self.variables['BinaryFlow.status'][key]
+                    for name in ('min', 'max'):
+                        self._patch('BinaryFlow.' + name, key, [
+                            (flow, 1),
+                            (status, -_series(getattr(obj, name), ts) *
+                             obj.nominal_value)], minimum)
+
+        if isinstance(obj, Storage):
+            block = ('Storage' if obj.investment is None else
+                     'InvestmentStorage')
+            capacity = self.variables[block + '.capacity'][obj]
+            loss = _series(obj.capacity_loss, ts)
+            previous = loss - 1
+            if block == 'Storage' and obj in self.initial_state:
+                previous[0] = 0
+                balance = self.constraints['Storage.balance'][obj]
+                self.rhs[balance[0]] = (self.initial_state[obj] *
+                                        (1 - loss[0]))
+            if self.period_sequence is not None:
+                previous[self.first] = 0
+            # with a single timestep the previous capacity is the current one
+            own = self.previous == np.arange(len(ts))
+            self._patch(block + '.balance', obj, [
+                (capacity[self.previous], previous + own)])
+            if self.period_sequence is not None:
+                inter = self.variables[block + '.inter_capacity'][obj]
+                decay = np.multiply.reduceat(1 - loss,
+                                             np.flatnonzero(self.first))
+                steps = np.arange(len(self.period_sequence))
+                self._patch(block + '.inter_balance', obj, [
+                    (inter, (np.roll(steps, -1) == steps) -
+                     decay[self.period_sequence])])
+                self._patch(block + '.inter_lower', obj, [
+                    (inter, decay[self.period_sequence])])
+
+        if isinstance(obj, Investment):
+            for name, keys, nodes in (
+                    ('InvestmentFlow.invest', self.flows,
+                     self.flows.values()),
+                    ('InvestmentStorage.invest', self.es.nodes,
+                     self.es.nodes)):
+                grid = self.variables.get(name)
+                for key, node in zip(keys, nodes):
+                    if grid is not None and key in grid and (
+                            node.investment is obj):
+                        self.cost[grid[key]] = (obj.ep_costs +
+                                                (node.fixed_costs or 0))
+
+    def objective(self):
+        """ Returns the value of the objective for the current solution.
+        """
+        return float(np.dot(self.cost, self.solution) +
+                     np.dot(self.quadratic, self.solution ** 2) / 2 +
+                     self.objective_offset)
+
+    def state(self, t):
+        """ Returns the state of the energy system at timestep `t` after
+        solving, see :meth:`.OperationalModel.state`.
+        """
+        position = int(np.searchsorted(self.TIMESTEPS, t))
+        state = {}
+        grid = self.variables.get('Storage.capacity')
+        for n in (grid.keys if grid is not None else []):
+            state[n] = float(self.solution[grid[n][position]])
+        grid = self.variables.get('BinaryFlow.status')
+        for key in (grid.keys if grid is not None else []):
+            state[key] = round(float(self.solution[grid[key][position]]))
+        for direction in ('positive', 'negative'):
+            grid = self.variables.get(direction + '_flow_gradient')
+            for key in (grid.keys if grid is not None else []):
+                state[self.flows[key]] = float(
+                    self.solution[self.flow[key][position]])
+        return state
+
+    def receive_duals(self):
+        """ Requests the dual values of the constraints from the solver.
+        They are stored in :attr:`duals` and used by :meth:`results`.
+        """
+        self._receive_duals = True
+
+    def relax_problem(self):
+        """ Relaxes integer variables to reals.
+        """
+        self.integer[:] = False
+        return self
+
+    def results(self):
+        """ Returns a nested dictionary of the results of this optimization
+        model, structured like the one returned by
+        :meth:`.OperationalModel.results`.
+        """
+        values = self.solution
+        result = UserDict()
+        result.objective = self.objective()
+        nodes = set(self.es.nodes)
+        for i, o in self.flows:
+
+            result[i] = result.get(i, UserDict())
+            result[i][o] = UserList(values[self.flow[i, o]].tolist())
+            if i not in nodes:
+                continue
+
+            if isinstance(i, Storage):
+                block = ('Storage' if i.investment is None else
+                         'InvestmentStorage')
+                result[i][i] = UserList(values[
+                    self.variables[block + '.capacity'][i]].tolist())
+                if self.period_sequence is not None:
+                    setattr(result[i][i], 'inter_capacity', values[
+                        self.variables[block + '.inter_capacity'][i]
+                    ].tolist())
+
+            if isinstance(self.flows[i, o].investment, Investment):
+                setattr(result[i][o], 'invest', float(values[
+                    self.variables['InvestmentFlow.invest'][i, o]]))
+                if isinstance(i, Storage):
+                    setattr(result[i][i], 'invest', float(values[
+                        self.variables['InvestmentStorage.invest'][i]]))
+
+        # add results of dual variables for balanced buses
+        if self.duals is not None and 'Bus.balance' in self.constraints:
+            balance = self.constraints['Bus.balance']
+            for bus in balance.keys:
+                result[bus] = result.get(bus, UserDict())
+                result[bus][bus] = self.duals[balance[bus]].tolist()
+
+        return result
+
+    def _problem(self):
+        """ Returns the model to write for the solver, which is this model
+        or, if it is presolved, its reduction.
+        """
+        if not self._presolve:
+            return self
+        self.presolved = Presolve(self, bounds=not self._receive_duals)
+        return self.presolved.model
+
+    def load_solution(self, results):
+        """ Stores the variable (and dual) values found in the pyomo solver
+        `results` in :attr:`solution` (and :attr:`duals`).
+
+        If the model is presolved, the `results` belong to the reduced model
+        in :attr:`presolved` and are expanded to the whole model.
+        """
+        problem = self if self.presolved is None else self.presolved.model
+        solution = results.solution(0)
+        self.solution = np.zeros(problem.nvars)
+        for name, data in solution.variable.items():
+            parsed = _parse_name(name)
+            if parsed is not None and parsed[0] == 'x':
+                self.solution[parsed[1]] = data['Value']
+        if self._receive_duals:
+            self.duals = np.zeros(problem.nrows)
+            for name, data in solution.constraint.items():
+                parsed = _parse_name(name)
+                if parsed is not None and parsed[0] == 'c':
+                    self.duals[parsed[1]] = data.get('Dual', np.nan)
+        if self.presolved is not None:
+            self.solution = self.presolved.solution(self.solution)
+            if self._receive_duals:
+                self.duals = self.presolved.duals(self.duals)
+
+    def solve(self, solver='glpk', solver_io='lp', **kwargs):
+        r""" Writes the model to a temporary LP file and solves it.
+
+        Takes the same arguments as :meth:`.OperationalModel.solve`.
+        """
+        session = SolverSession(self, solver, solver_io, warmstart=False,
+                                **kwargs)
+        try:
+            return session.resolve()
+        finally:
+            session.close()
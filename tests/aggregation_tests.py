@@ -0,0 +1,197 @@
+from nose.tools import ok_, eq_, assert_raises
+from collections import UserDict, UserList
+import numpy as np
+import pandas as pd
+
+from oemof.energy_system import EnergySystem as ES
+from oemof.solph import Bus, Flow, Sink, Source, Storage
+from oemof.solph.aggregation import (AdaptiveResolution, METHODS,
+                                     TypicalPeriods)
+from oemof.solph.plumbing import Sequence
+from oemof.solph.sparse import SparseOperationalModel
+import oemof.solph as solph
+
+
+# the type of each of twelve days and the demand profile of each type
+DAYS = [0, 1, 1, 2, 0, 0, 1, 2, 2, 0, 1, 0]
+PROFILES = [[1, 2, 3, 2], [5, 5, 6, 5], [9, 8, 9, 9]]
+
+
+def energy_system():
+    """ Creates an energy system with a demand profile of four timesteps per
+    day and three kinds of days.
+    """
+    es = ES(groupings=solph.GROUPINGS,
+            timeindex=pd.date_range('1/1/2012', periods=4 * len(DAYS),
+                                    freq='H'))
+    bel = Bus(label='el')
+    demand = np.concatenate([PROFILES[d] for d in DAYS])
+    # some noise, to have days which differ in all kinds
+    demand = demand + np.random.RandomState(3).uniform(0, 0.1, len(demand))
+    Source(label='pp', outputs={bel: Flow(nominal_value=20, variable_costs=2,
+                                          summed_max=100)})
+    Storage(label='battery', inputs={bel: Flow()}, outputs={bel: Flow()},
+            nominal_capacity=5)
+    Sink(label='demand', inputs={bel: Flow(actual_value=demand,
+                                           nominal_value=1, fixed=True)})
+    return es
+
+
+class Clustering_Tests:
+
+    def test_that_all_methods_find_separated_clusters(self):
+        random_state = np.random.RandomState(0)
+        truth = np.repeat(np.arange(3), 20)
+        centers = np.array([[0, 0], [10, 0], [0, 10]])
+        features = centers[truth] + random_state.normal(0, 0.5, (60, 2))
+        for method in METHODS.values():
+            labels, representatives = method(features, 3,
+                                             np.random.RandomState(1))
+            eq_(len(set(labels)), 3)
+            for cluster in range(3):
+                eq_(len(set(labels[truth == cluster])), 1)
+            eq_(labels[representatives].tolist(), [0, 1, 2])
+
+
+class TypicalPeriods_Tests:
+
+    def setup(self):
+        self.es = energy_system()
+
+    def test_that_typical_days_are_found(self):
+        for method in METHODS:
+            tp = TypicalPeriods(self.es, 3, period_length=4, method=method,
+                                seed=2)
+            eq_(tp.representatives, sorted(tp.representatives))
+            kinds = [DAYS[p] for p in tp.representatives]
+            eq_(sorted(kinds), [0, 1, 2])
+            eq_(tp.labels.tolist(), [kinds.index(d) for d in DAYS])
+            eq_(tp.weights.tolist(), [DAYS.count(d) for d in kinds])
+
+    def test_building_weighted_models(self):
+        tp = TypicalPeriods(self.es, 3, period_length=4,
+                            model=SparseOperationalModel)
+        sm = tp.build()
+        eq_(sm.TIMESTEPS.tolist(), [t for p in tp.periods() for t in p])
+        nodes = {n.label: n for n in self.es.nodes}
+        flow = sm.flow[nodes['pp'], nodes['el']]
+        weights = np.repeat(tp.weights, 4)
+        eq_(sm.cost[flow].tolist(), (2 * weights).tolist())
+        row = sm.constraints['Flow.summed_max'][nodes['pp'], nodes['el']]
+        rows, cols, coefficients = sm.matrix()
+        eq_(coefficients[rows == row].tolist(), weights.tolist())
+
+    def test_expanding_results(self):
+        tp = TypicalPeriods(self.es, 3, period_length=4)
+        nodes = {n.label: n for n in self.es.nodes}
+        values = UserList(range(12))
+        values.invest = 3
+        results = UserDict({nodes['pp']: UserDict({nodes['el']: values})})
+        results.objective = 5
+        expanded = tp.expand(results)
+        eq_(expanded.objective, 5)
+        flow = expanded[nodes['pp']][nodes['el']]
+        eq_(flow.invest, 3)
+        eq_(list(flow), [t for c in tp.labels
+                         for t in range(4 * c, 4 * c + 4)])
+
+    def test_that_storages_are_linked_over_the_horizon(self):
+        tp = TypicalPeriods(self.es, 3, period_length=4,
+                            model=SparseOperationalModel)
+        sm = tp.build()
+        eq_(sm.period_sequence, tp.labels.tolist())
+        nodes = {n.label: n for n in self.es.nodes}
+        eq_(len(sm.variables['Storage.inter_capacity'][nodes['battery']]),
+            len(DAYS))
+        tp = TypicalPeriods(self.es, 3, period_length=4, link_storages=False,
+                            model=SparseOperationalModel)
+        eq_(tp.build().period_sequence, None)
+
+    def test_expanding_linked_storages(self):
+        tp = TypicalPeriods(self.es, 3, period_length=4)
+        battery = [n for n in self.es.nodes if n.label == 'battery'][0]
+        battery.capacity_loss = Sequence(0.5)
+        values = UserList(range(12))
+        values.inter_capacity = [16 * d for d in range(len(DAYS))]
+        results = UserDict({battery: UserDict({battery: values})})
+        expanded = tp.expand(results)[battery][battery]
+        eq_(expanded.inter_capacity, values.inter_capacity)
+        eq_(list(expanded), [16 * d * 0.5 ** (t + 1) + 4 * c + t
+                             for d, c in enumerate(tp.labels)
+                             for t in range(4)])
+
+    def test_that_invalid_arguments_are_rejected(self):
+        assert_raises(ValueError, TypicalPeriods, self.es, 3, 5)
+        assert_raises(ValueError, TypicalPeriods, self.es, 3, 4,
+                      method='spectral')
+
+
+class AdaptiveResolution_Tests:
+
+    def setup(self):
+        self.es = ES(groupings=solph.GROUPINGS,
+                     timeindex=pd.date_range('1/1/2012', periods=8,
+                                             freq='H'))
+        bel = Bus(label='el')
+        Source(label='pp', outputs={bel: Flow(
+            nominal_value=20, variable_costs=[2, 2, 2, 2, 2, 2, 4, 6],
+            positive_gradient=3)})
+        Storage(label='battery', inputs={bel: Flow()}, outputs={bel: Flow()},
+                nominal_capacity=5, capacity_loss=0.5)
+        Sink(label='demand', inputs={bel: Flow(
+            actual_value=[1, 1, 1, 4, 8, 4, 1, 1], nominal_value=1,
+            fixed=True)})
+        self.nodes = {n.label: n for n in self.es.nodes}
+
+    def test_that_calm_timesteps_are_merged(self):
+        ar = AdaptiveResolution(self.es, tolerance=0.1)
+        eq_(ar.starts.tolist(), [0, 3, 4, 5, 6, 7])
+        eq_(ar.lengths.tolist(), [3, 1, 1, 1, 1, 1])
+        ar = AdaptiveResolution(self.es, tolerance=0.1, max_length=2)
+        eq_(ar.starts.tolist(), [0, 2, 3, 4, 5, 6, 7])
+        eq_(AdaptiveResolution(self.es, tolerance=1).starts.tolist(), [0])
+        assert_raises(ValueError, AdaptiveResolution, self.es, 0.1, 0)
+
+    def test_building_models_on_merged_timesteps(self):
+        ar = AdaptiveResolution(self.es, tolerance=0.5,
+                                model=SparseOperationalModel,
+                                timeincrement=0.5)
+        eq_(ar.starts.tolist(), [0, 4, 5, 7])
+        battery, pp = self.nodes['battery'], self.nodes['pp']
+        loss = battery.capacity_loss
+        sm = ar.build()
+        ok_(battery.capacity_loss is loss)
+        eq_(sm.TIMESTEPS.tolist(), [0, 4, 5, 7])
+        eq_(sm.tau.tolist(), [2, 0.5, 1, 0.5])
+        eq_(sm.cost[sm.flow[pp, self.nodes['el']]].tolist(),
+            [4, 1, 3, 3])
+        ok_(np.allclose(sm.ub[sm.flow[self.nodes['el'],
+                                      self.nodes['demand']]],
+                        [7 / 4, 8, 2.5, 1]))
+        rows, cols, coefficients = sm.matrix()
+        matrix = dict(zip(zip(rows, cols), coefficients))
+        balance = sm.constraints['Storage.balance'][battery]
+        capacity = sm.variables['Storage.capacity'][battery]
+        # the losses are compounded over the merged timesteps
+        eq_([matrix[r, c] for r, c in zip(balance, capacity[sm.previous])],
+            [-0.5 ** 4, -0.5, -0.5 ** 2, -0.5])
+        gradient = sm.variables['positive_flow_gradient'][pp,
+                                                          self.nodes['el']]
+        eq_(sm.ub[gradient].tolist(), [240, 60, 120, 60])
+
+    def test_expanding_results(self):
+        ar = AdaptiveResolution(self.es, tolerance=0.5)
+        pp, el, battery = (self.nodes['pp'], self.nodes['el'],
+                           self.nodes['battery'])
+        flow = UserList([1, 2, 3, 4])
+        flow.invest = 3
+        results = UserDict({pp: UserDict({el: flow}),
+                            battery: UserDict({battery: [4, 2, 0, 2]}),
+                            el: UserDict({el: [8, 1, 4, 2]})})
+        results.objective = 5
+        expanded = ar.expand(results)
+        eq_(expanded.objective, 5)
+        eq_(list(expanded[pp][el]), [1, 1, 1, 1, 2, 3, 3, 4])
+        eq_(expanded[pp][el].invest, 3)
+        eq_(list(expanded[battery][battery]), [2.5, 3, 3.5, 4, 2, 1, 0, 2])
+        eq_(list(expanded[el][el]), [2, 2, 2, 2, 1, 2, 2, 2])
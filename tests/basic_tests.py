@@ -13,7 +13,8 @@ from oemof import energy_system as es
 from oemof.network import Entity
 from oemof.network import Bus, Transformer
 from oemof.network import Bus as NewBus, Node
-from oemof.groupings import Grouping, Nodes, Flows, FlowsWithNodes as FWNs
+from oemof.groupings import (Grouping, Nodes, Flows, FlowsWithNodes as FWNs,
+                             Fused)
 
 
 class EnergySystem_Tests:
@@ -49,6 +50,32 @@ class EnergySystem_Tests:
         self.es.nodes = empty
         ok_(self.es.entities is empty)
 
+    def test_add_many(self):
+        ES = es.EnergySystem(groupings=[type])
+        Node.registry = None
+        buses = [NewBus(label="Bus {}".format(i)) for i in range(3)]
+        ES.add_many(buses)
+        eq_(ES.entities, buses)
+        eq_(ES.groups[NewBus], set(buses))
+
+    def test_bulk_defers_registration_and_grouping(self):
+        ES = es.EnergySystem(groupings=[type])
+        with ES.bulk():
+            bus = NewBus(label="A Bus")
+            node = Node(label="A Node", inputs=[bus])
+            with ES.bulk():
+                inner = NewBus(label="An inner Bus")
+            eq_(ES.entities, [])
+        eq_(ES.entities, [bus, node, inner])
+        eq_(ES._ungrouped, [])
+        eq_(ES.groups[NewBus], set((bus, inner)))
+        ok_(ES.groups["A Node"] is node)
+
+    def test_many_nodes_do_not_exhaust_the_recursion_limit(self):
+        ES = es.EnergySystem()
+        nodes = [Node(label="Node {}".format(i)) for i in range(5000)]
+        eq_(len(ES.groups), len(nodes))
+
     def test_that_None_is_not_a_valid_group(self):
         def by_uid(n):
             if "Not in 'Group'" in n.uid:
@@ -90,6 +117,22 @@ class EnergySystem_Tests:
                      group, len(ES.groups[group]),
                      sorted([e.uid for e in ES.groups[group]])))
 
+    def test_that_groups_are_updated_in_place(self):
+        ES = es.EnergySystem(groupings=[Nodes(key="everything")])
+        first = Entity(uid="first")
+        group = ES.groups["everything"]
+        second = Entity(uid="second")
+        ok_(ES.groups["everything"] is group)
+        eq_(group, set((first, second)))
+
+    def test_that_multiple_new_groups_do_not_share_their_value(self):
+        ES = es.EnergySystem(groupings=[
+            Nodes(key=lambda e: ["All", "Group " + e.uid])])
+        a, b = Entity(uid="a"), Entity(uid="b")
+        eq_(ES.groups["All"], set((a, b)))
+        eq_(ES.groups["Group a"], set((a,)))
+        eq_(ES.groups["Group b"], set((b,)))
+
     def test_grouping_filter_parameter(self):
         g1 = Grouping( key=lambda e: "The Special One",
                        filter=lambda e: "special" in e.uid)
@@ -165,3 +208,33 @@ class EnergySystem_Tests:
         eq_(ES.groups[key], set(((bus, node, flows[0]),
                                  (node, bus, flows[1]))))
 
+    def test_that_FlowsWithNodes_are_fused(self):
+        everything = FWNs(constant_key="everything")
+        inputs = FWNs(key=lambda tuples: "inputs",
+                      filter=lambda stf: stf[1].label == "A Node")
+
+        class Outputs(FWNs):
+            def value(self, tuples):
+                return set(stf for stf in tuples if stf[0].label == "A Node")
+
+        class Unfusable(FWNs):
+            def __call__(self, n, d):
+                super().__call__(n, d)
+
+        ES = es.EnergySystem(groupings=[
+            everything, type, inputs, Outputs(constant_key="outputs"),
+            Unfusable(constant_key="unfused")])
+        fused = [g for g in ES._groupings if isinstance(g, Fused)]
+        eq_(len(fused), 1)
+        eq_(len(fused[0].groupings), 3)
+        eq_(len(ES._groupings), 4)
+        flows = (object(), object())
+        bus = NewBus(label="A Bus")
+        node = Node(label="A Node",
+                    inputs={bus: flows[0]}, outputs={bus: flows[1]})
+        eq_(ES.groups["everything"], set(((bus, node, flows[0]),
+                                          (node, bus, flows[1]))))
+        eq_(ES.groups["inputs"], set(((bus, node, flows[0]),)))
+        eq_(ES.groups["outputs"], set(((node, bus, flows[1]),)))
+        eq_(ES.groups["unfused"], ES.groups["everything"])
+        eq_(ES.groups[Node], set((node,)))
@@ -0,0 +1,220 @@
+from nose.tools import ok_, eq_, assert_raises
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pyomo.environ as po
+
+from oemof.energy_system import EnergySystem as ES
+from oemof.network import Node
+from oemof.solph import (Bus, Flow, Investment, LinearTransformer, Sink,
+                         Source, Storage)
+from oemof.solph.decomposition import (ADMM, Benders, Components, _WORKER,
+                                       _Workers, _add_prices, _fix_investments,
+                                       _investment_duals, _investments,
+                                       _set_investments, _set_prices,
+                                       _subsystem, components)
+from oemof.solph.sparse import SparseOperationalModel
+import oemof.solph as solph
+
+from rolling_tests import dispatch_system
+from sparse_tests import energy_system
+
+
+def _label(task):
+    return task, _WORKER['es'].nodes[task].label
+
+
+class Benders_Tests:
+
+    def setup(self):
+        self.es = energy_system(periods=6)
+        self.nodes = {n.label: n for n in self.es.nodes}
+
+    def test_that_blocks_split_the_horizon(self):
+        bd = Benders(self.es, 4)
+        eq_(bd.blocks, [[0, 1], [2, 3], [4], [5]])
+        eq_(bd.shares.tolist(), [2 / 6, 2 / 6, 1 / 6, 1 / 6])
+        bd = Benders(self.es, [[0, 1], [2, 3, 4, 5]], weights=[3, 1])
+        eq_(bd.shares.tolist(), [0.6, 0.4])
+
+    def test_that_invalid_arguments_are_rejected(self):
+        assert_raises(ValueError, Benders, self.es, 0)
+        assert_raises(ValueError, Benders, self.es, 7)
+        assert_raises(ValueError, Benders, self.es, 2, weights=[1])
+        assert_raises(ValueError, Benders, self.es, 2, objective_weighting=2)
+        assert_raises(ValueError, Benders, dispatch_system(), 2)
+
+    def test_that_investments_are_fixed_by_constraints(self):
+        tank = self.nodes['tank']
+        invest = {key: k for k, (key, _, _) in enumerate(
+            _investments(self.es))}
+        eq_(len(invest), 5)
+
+        sm = SparseOperationalModel(self.es, timesteps=[0, 1, 2])
+        _fix_investments(sm)
+        _set_investments(sm, invest)
+        variables = sm.variables['InvestmentStorage.invest']
+        rows = sm.constraints['InvestmentStorage.fixed_invest']
+        eq_(sm.rhs[rows[tank]], invest[tank])
+        eq_((sm.lb[variables[tank]], sm.ub[variables[tank]]),
+            (-np.inf, np.inf))
+        sm.duals = np.arange(sm.nrows, dtype=float)
+        eq_(_investment_duals(sm)[tank], rows[tank])
+
+        om = solph.OperationalModel(self.es, timesteps=[0, 1, 2])
+        _fix_investments(om)
+        om.receive_duals()
+        _set_investments(om, invest)
+        eq_(om.InvestmentStorage.invest_value[tank].value, invest[tank])
+        eq_(om.InvestmentStorage.invest[tank].bounds, (None, None))
+        for key in invest:
+            block = (om.InvestmentFlow if isinstance(key, tuple) else
+                     om.InvestmentStorage)
+            om.dual[block.fixed_invest[key]] = invest[key] + 1
+        eq_(_investment_duals(om), {key: invest[key] + 1 for key in invest})
+        om.dual[om.InvestmentStorage.fixed_invest[tank]] = None
+        assert_raises(ValueError, _investment_duals, om)
+
+    def test_that_cuts_bound_the_costs_of_the_blocks(self):
+        bd = Benders(self.es, 3)
+        pv, el = self.nodes['pv'], self.nodes['el']
+        tank = self.nodes['tank']
+        invest = {key: 1 for key, _, _ in bd._investments}
+        duals = {key: 0 for key in invest}
+        duals[pv, el] = 3
+        value, slopes = bd._cut(1, 45, duals, invest)
+        # the costs of the investments are 6 for pv, 2 for the boiler and 5
+        # for the tank
+        ok_(np.isclose(value, (45 - 13) / 3))
+        ok_(np.isclose(slopes[pv, el], (3 - 6) / 3))
+        ok_(np.isclose(slopes[tank], -5 / 3))
+
+        bd = Benders(self.es, [[0, 1], [2, 3, 4, 5]], weights=[3, 1])
+        eq_(bd.weightings.tolist(), [5, 2.5])
+        # the model of the first block weights its operational costs of 10
+        # by 5, and the cut counts them for its three occurrences
+        value, slopes = bd._cut(0, 13 + 5 * 10, duals, invest)
+        ok_(np.isclose(value, 3 * 10))
+        value, slopes = bd._cut(1, 13 + 2.5 * 10, duals, invest)
+        ok_(np.isclose(value, 10))
+
+        bd = Benders(self.es, 3)
+        master = bd._master()
+        eq_(len(master.links), 2)
+        eq_(len(master.costs), 3)
+        ok_(all(master.costs[k].lb == 0 for k in master.costs))
+
+
+class Components_Tests:
+
+    def setup(self):
+        self.es = ES(groupings=solph.GROUPINGS,
+                     timeindex=pd.date_range('1/1/2012', periods=3,
+                                             freq='H'))
+        for town in ('a', 'b'):
+            bus = Bus(label=town)
+            Source(label=town + '_boiler', outputs={bus: Flow(
+                nominal_value=5, variable_costs=1)})
+            Sink(label=town + '_demand', inputs={bus: Flow(
+                nominal_value=1, actual_value=[1, 2, 3], fixed=True)})
+        Storage(label='b_tank', inputs={bus: Flow()}, outputs={bus: Flow()},
+                investment=Investment(ep_costs=1))
+        Bus(label='c')
+        self.nodes = {n.label: n for n in self.es.nodes}
+
+    def test_that_components_are_found(self):
+        labels = [[n.label for n in c] for c in components(self.es)]
+        eq_(labels, [['a', 'a_boiler', 'a_demand'],
+                     ['b', 'b_boiler', 'b_demand', 'b_tank'], ['c']])
+        joined = components(self.es, join=[(self.nodes['a_boiler'],
+                                            self.nodes['c'])])
+        eq_([len(c) for c in joined], [4, 4])
+        # only components with flows are solved
+        eq_(len(Components(self.es).components), 2)
+
+    def test_that_components_are_built_as_models_of_their_own(self):
+        component = Components(self.es, processes=1).components[1]
+        subsystem = _subsystem(self.es, component)
+        ok_(Node.registry is self.es)
+        eq_(subsystem.nodes, component)
+        eq_(subsystem.groups[solph.blocks.InvestmentStorage],
+            {self.nodes['b_tank']})
+        sm = SparseOperationalModel(subsystem)
+        eq_(sorted((i.label, o.label) for i, o in sm.flows),
+            [('b', 'b_demand'), ('b', 'b_tank'), ('b_boiler', 'b'),
+             ('b_tank', 'b')])
+        om = solph.OperationalModel(subsystem)
+        eq_(set(om.flows), set(sm.flows))
+
+
+class ADMM_Tests:
+
+    def setup(self):
+        self.es = ES(groupings=solph.GROUPINGS,
+                     timeindex=pd.date_range('1/1/2012', periods=3,
+                                             freq='H'))
+        a, b = Bus(label='a_el'), Bus(label='b_el')
+        Source(label='a_pp', outputs={a: Flow(nominal_value=10,
+                                              variable_costs=1)})
+        Source(label='b_pp', outputs={b: Flow(nominal_value=10,
+                                              variable_costs=3)})
+        LinearTransformer(label='a_line', inputs={a: Flow()},
+                          outputs={b: Flow(nominal_value=4,
+                                           variable_costs=0.1)},
+                          conversion_factors={b: 0.9})
+        Sink(label='b_demand', inputs={b: Flow(
+            nominal_value=1, actual_value=[1, 5, 3], fixed=True)})
+        self.nodes = {n.label: n for n in self.es.nodes}
+
+    def region(self, node):
+        return node.label.split('_')[0]
+
+    def test_that_regions_and_exchanges_are_found(self):
+        admm = ADMM(self.es, self.region)
+        eq_(list(admm.regions), ['a', 'b'])
+        eq_([n.label for n in admm.regions['b']], ['b_el', 'b_pp',
+                                                   'b_demand'])
+        eq_(admm.exchanges, [(self.nodes['a_line'], self.nodes['b_el'])])
+        eq_(admm.processes, min(2, multiprocessing.cpu_count()))
+        regions = {n: self.region(n) for n in self.es.nodes}
+        eq_(ADMM(self.es, regions).exchanges, admm.exchanges)
+
+    def test_that_regions_price_their_copies_of_the_exchanges(self):
+        line, el = self.nodes['a_line'], self.nodes['b_el']
+        region = _subsystem(self.es, ADMM(self.es, self.region).regions['b'])
+        sm = SparseOperationalModel(region)
+        ok_((line, el) in sm.flows)
+        flow = sm.flow[line, el]
+        # the copy is bounded, but priced only by the exchange
+        eq_(sm.ub[flow].tolist(), [4, 4, 4])
+        eq_(sm.cost[flow].tolist(), [0, 0, 0])
+        _add_prices(sm, [(line, el)], 2)
+        _set_prices(sm, {(line, el): np.array([1, 2, 3])})
+        eq_(sm.cost[flow].tolist(), [1, 2, 3])
+        eq_(sm.quadratic[flow].tolist(), [2, 2, 2])
+        eq_(np.count_nonzero(sm.quadratic), 3)
+        sm.solution = np.zeros(sm.nvars)
+        eq_(list(sm.results()[line][el]), [0, 0, 0])
+
+        om = solph.OperationalModel(region)
+        eq_(set(om.flows), set(sm.flows))
+        _add_prices(om, [(line, el)], 2)
+        _set_prices(om, {(line, el): np.array([1, 2, 3])})
+        eq_(om.exchange_price[line, el, 1].value, 2)
+        for t in om.TIMESTEPS:
+            for i, o in om.flows:
+                om.flow[i, o, t].value = 0
+            om.flow[line, el, t].value = 1
+        eq_(po.value(om.objective), 1 + 2 + 3 + 3 * 2 / 2)
+
+    def test_that_workers_keep_to_their_parts(self):
+        parts = list(range(len(self.es.nodes)))
+        workers = _Workers(self.es, SparseOperationalModel, {}, parts,
+                           processes=2)
+        try:
+            eq_(workers.map(_label, parts),
+                [(k, n.label) for k, n in enumerate(self.es.nodes)])
+            assert_raises(IndexError, workers.map, _label, [len(parts)])
+        finally:
+            workers.close()
+        eq_([p.exitcode for p in workers.processes], [0, 0])
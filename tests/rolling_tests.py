@@ -0,0 +1,232 @@
+from nose.tools import ok_, eq_, assert_raises
+from collections import UserDict, UserList
+import numpy as np
+import pandas as pd
+import pyomo.environ as po
+
+from oemof.energy_system import EnergySystem as ES
+from oemof.solph import Bus, BinaryFlow, Flow, Sink, Source, Storage
+from oemof.solph.rolling import (ParallelWindows, RollingHorizon, _Keys,
+                                 _add_boundaries, _boundary_values, _costs,
+                                 _fits, _flatten, _initial_state, _move,
+                                 _nest, _price_boundaries, _restore,
+                                 _stitch, _time_series)
+from oemof.solph.sparse import SparseOperationalModel
+from oemof.solph.plumbing import Sequence
+import oemof.solph as solph
+
+from sparse_tests import assert_equivalent, energy_system
+
+
+def dispatch_system(periods=10):
+    """ Creates an energy system without investments.
+    """
+    es = ES(groupings=solph.GROUPINGS,
+            timeindex=pd.date_range('1/1/2012', periods=periods, freq='H'))
+    bel = Bus(label='el')
+    Source(label='pp', outputs={bel: Flow(
+        nominal_value=10, min=0.5, variable_costs=2,
+        binary=BinaryFlow(startup_costs=5, initial_status=0))})
+    Storage(label='battery', inputs={bel: Flow()}, outputs={bel: Flow()},
+            nominal_capacity=20, initial_capacity=0.5)
+    Storage(label='tank', inputs={bel: Flow()}, outputs={bel: Flow()},
+            nominal_capacity=10)
+    Sink(label='demand', inputs={bel: Flow(
+        actual_value=np.linspace(0, 1, periods), nominal_value=8,
+        fixed=True)})
+    return es
+
+
+class RollingHorizon_Tests:
+
+    def setup(self):
+        self.es = dispatch_system()
+
+    def test_that_committed_timesteps_cover_the_horizon(self):
+        for window, overlap in ((3, 1), (4, 0), (10, 9), (20, 5)):
+            rh = RollingHorizon(self.es, window, overlap)
+            committed = []
+            for timesteps, commit in rh.windows():
+                ok_(len(timesteps) <= window)
+                eq_(timesteps, list(range(timesteps[0],
+                                          timesteps[0] + len(timesteps))))
+                committed.extend(timesteps[:commit])
+            eq_(committed, list(range(10)))
+
+    def test_restricting_the_horizon(self):
+        rh = RollingHorizon(self.es, 4, 2, timesteps=range(3, 9))
+        eq_(list(rh.windows()), [([3, 4, 5, 6], 2), ([5, 6, 7, 8], 4)])
+        eq_(rh.kwargs, {})
+
+    def test_that_invalid_windows_and_investments_are_rejected(self):
+        assert_raises(ValueError, RollingHorizon, self.es, 2, 2)
+        assert_raises(ValueError, RollingHorizon, energy_system(), 2)
+
+    def test_stitching_results(self):
+        nodes = {n.label: n for n in self.es.nodes}
+        pp, el = nodes['pp'], nodes['el']
+        parts = []
+        for start, commit in ((0, 2), (2, 3)):
+            result = UserDict({pp: UserDict({el: UserList(
+                range(start, start + 3))})})
+            result[pp][el].invest = 4
+            result.objective = start
+            parts.append((result, commit))
+        stitched = _stitch(parts)
+        eq_(list(stitched[pp][el]), [0, 1, 2, 3, 4])
+        eq_(stitched[pp][el].invest, 4)
+        eq_(stitched.objectives, [0, 2])
+
+    def test_that_only_costs_of_committed_timesteps_are_counted(self):
+        nodes = {n.label: n for n in self.es.nodes}
+        pp, el, tank = nodes['pp'], nodes['el'], nodes['tank']
+        tank.fixed_costs = 0.5
+        kwargs = {'timesteps': range(4, 8), 'final_values': {tank: 3}}
+        # 5 for the fixed costs, 2 * 2 for flows and 5 for a startup
+        expected = (5, 9)
+
+        sm = SparseOperationalModel(self.es, **kwargs)
+        sm.solution = np.zeros(sm.nvars)
+        sm.solution[sm.flow[pp, el]] = 1
+        sm.solution[sm.variables['BinaryFlow.startup'][pp, el]] = [
+            0, 1, 0, 1]
+        sm.solution[sm.variables['Storage.capacity'][tank]] = 4
+        eq_(_costs(sm, [5, 6]), expected)
+
+        om = solph.OperationalModel(self.es, **kwargs)
+        for var in om.component_data_objects(po.Var):
+            var.value = 0
+        for t in kwargs['timesteps']:
+            om.flow[pp, el, t].value = 1
+            om.BinaryFlow.startup[pp, el, t].value = t % 2
+            om.Storage.capacity[tank, t].value = 4
+        eq_(_costs(om, [5, 6]), expected)
+        eq_(om.flow[pp, el, 7].value, 1)
+
+    def test_that_moved_models_equal_rebuilt_ones(self):
+        nodes = {n.label: n for n in self.es.nodes}
+        pp, el, battery = nodes['pp'], nodes['el'], nodes['battery']
+        pp.outputs[el].variable_costs = Sequence(list(range(10)))
+        pp.outputs[el].binary.shutdown_costs = 1
+        battery.capacity_loss = Sequence([0.1, 0.2] * 5)
+        nodes['tank'].inflow_conversion_factor = Sequence([0.9, 1] * 5)
+        updatable, fixed = _time_series(self.es)
+        eq_(sorted(name for obj, name in updatable),
+            ['actual_value', 'capacity_loss', 'variable_costs'])
+        eq_(len(fixed), 1)
+        originals = {(obj, name): getattr(obj, name)
+                     for obj, name in updatable}
+
+        base, timesteps = [0, 1, 2], [4, 5, 6]
+        ok_(not _fits(SparseOperationalModel(self.es, timesteps=base), base,
+                      [3, 4, 5], {}, fixed))
+        state = {battery: 3, nodes['tank']: 1, (pp, el): 1}
+        om = solph.OperationalModel(self.es, timesteps=base,
+                                    initial_state=_initial_state(self.es))
+        sm = SparseOperationalModel(self.es, timesteps=base,
+                                    initial_state=_initial_state(self.es))
+        ok_(_fits(sm, base, timesteps, {}, fixed))
+        for model in (om, sm):
+            _move(model, originals, base, timesteps, 10)
+            model.update(initial_state=state)
+            _restore(originals)
+        assert_equivalent(om, sm)
+
+        ok_(pp.outputs[el].variable_costs is originals[
+            pp.outputs[el], 'variable_costs'])
+        fresh = SparseOperationalModel(self.es, timesteps=timesteps,
+                                       initial_state=state)
+        for moved, rebuilt in zip(sm.matrix(), fresh.matrix()):
+            eq_(moved.tolist(), rebuilt.tolist())
+        for attribute in ('lb', 'ub', 'rhs', 'cost'):
+            ok_(np.allclose(getattr(sm, attribute),
+                            getattr(fresh, attribute)))
+
+    def test_that_states_are_read_from_solutions(self):
+        nodes = {n.label: n for n in self.es.nodes}
+        kwargs = {'timesteps': range(4, 8),
+                  'initial_state': {nodes['battery']: 3}}
+        sm = SparseOperationalModel(self.es, **kwargs)
+        sm.solution = np.zeros(sm.nvars)
+        sm.solution[sm.variables['Storage.capacity'][nodes['tank']]] = [
+            1, 2, 3, 4]
+        sm.solution[sm.variables['BinaryFlow.status'][
+            nodes['pp'], nodes['el']][1]] = 1
+        state = sm.state(5)
+        eq_(state[nodes['tank']], 2)
+        eq_(state[nodes['battery']], 0)
+        eq_(state[nodes['pp'], nodes['el']], 1)
+
+        om = solph.OperationalModel(self.es, **kwargs)
+        for t in kwargs['timesteps']:
+            om.Storage.capacity[nodes['tank'], t].value = t
+            om.Storage.capacity[nodes['battery'], t].value = 0
+            om.BinaryFlow.status[nodes['pp'], nodes['el'], t].value = 1
+        eq_(om.state(5), {nodes['tank']: 5, nodes['battery']: 0,
+                          (nodes['pp'], nodes['el']): 1})
+
+
+class ParallelWindows_Tests:
+
+    def setup(self):
+        self.es = dispatch_system()
+        self.nodes = {n.label: n for n in self.es.nodes}
+
+    def test_that_windows_split_the_horizon(self):
+        eq_(ParallelWindows(self.es, 3).windows,
+            [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        eq_(ParallelWindows(self.es, 2, timesteps=range(3, 8)).windows,
+            [[3, 4, 5], [6, 7]])
+
+    def test_that_invalid_windows_and_investments_are_rejected(self):
+        assert_raises(ValueError, ParallelWindows, self.es, 0)
+        assert_raises(ValueError, ParallelWindows, self.es, 11)
+        assert_raises(ValueError, ParallelWindows, energy_system(), 2)
+
+    def test_that_states_pass_between_processes(self):
+        pp, el = self.nodes['pp'], self.nodes['el']
+        state = {self.nodes['battery']: 3, (pp, el): 1, pp.outputs[el]: 4}
+        keys = _Keys(self.es)
+        encoded = keys.encode(state)
+        ok_(all(isinstance(k, tuple) and all(
+            isinstance(part, (str, int)) for part in k) for k in encoded))
+        eq_(keys.decode(encoded), state)
+
+    def test_that_results_keep_their_attributes_between_processes(self):
+        battery = self.nodes['battery']
+        capacity = UserList([1, 2])
+        capacity.invest = 3
+        results = UserDict({battery: UserDict({battery: capacity})})
+        keys = _Keys(self.es)
+        nested = _nest(keys.decode(keys.encode(_flatten(results))), 4)
+        eq_(nested.objective, 4)
+        eq_(list(nested[battery][battery]), [1, 2])
+        eq_(nested[battery][battery].invest, 3)
+
+    def test_that_windows_copy_their_states_at_the_boundaries(self):
+        pp, el = self.nodes['pp'], self.nodes['el']
+        battery, tank = self.nodes['battery'], self.nodes['tank']
+        flow = pp.outputs[el]
+        flow.positive_gradient = Sequence(0.2)
+        flow.negative_gradient = Sequence(0.3)
+        flow.binary.shutdown_costs = 1
+        kwargs = {'timesteps': range(4, 8),
+                  'initial_state': {battery: 0, tank: 0, (pp, el): 0}}
+        om = solph.OperationalModel(self.es, **kwargs)
+        sm = SparseOperationalModel(self.es, **kwargs)
+        prices = {('start', battery): 1, ('end', flow): 2,
+                  ('end', (pp, el)): -1}
+        for model in (om, sm):
+            _add_boundaries(model, True, True)
+            _price_boundaries(model, prices, 0)
+        eq_(om.boundaries, sm.boundaries)
+        eq_(set(om.boundaries),
+            {(side, key) for side in ('start', 'end')
+             for key in (battery, tank, (pp, el), flow)})
+        assert_equivalent(om, sm)
+
+        sm.solution = np.arange(sm.nvars, dtype=float)
+        values = _boundary_values(sm)
+        eq_(values['start', battery],
+            sm.variables['Storage.start_capacity'][battery])
+        eq_(values['end', flow], sm.flow[pp, el][-1])
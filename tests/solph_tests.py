@@ -1,8 +1,16 @@
-from nose.tools import ok_, eq_
+from nose.plugins.skip import SkipTest
+from nose.tools import ok_, eq_, assert_raises
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
 
 from oemof.energy_system import EnergySystem as ES
+from oemof.solph import blocks
 from oemof.solph.blocks import InvestmentFlow as IF
 from oemof.solph.network import Investment
+from oemof.solph.plumbing import Sequence
 import oemof.solph as solph
 
 
@@ -38,3 +46,261 @@ class Grouping_Tests:
             ("Expected InvestmentFlow group to be nonempty.\n" +
              "Got: {}").format(self.es.groups.get(IF)))
 
+    def test_removing_and_replacing_nodes_updates_groups(self):
+        b = solph.Bus(label='Bus')
+        source = solph.Source(label='Source', outputs={b: solph.Flow()})
+        sink = solph.Sink(label='Sink', inputs={b: solph.Flow(
+            investment=Investment(ep_costs=500))})
+        ok_(self.es.groups.get(IF))
+
+        self.es.remove(sink)
+        ok_(IF not in self.es.groups)
+        ok_('Sink' not in self.es.groups)
+        eq_(set(b.outputs), set())
+        eq_(self.es.groups[blocks.Flow],
+            set(((source, b, source.outputs[b]),)))
+        eq_(self.es.groups[blocks.Bus], set((b,)))
+
+        new = solph.Source(label='New Source', outputs={b: solph.Flow()})
+        self.es.replace(source, new)
+        eq_(self.es.nodes, [b, new])
+        eq_(self.es.groups[blocks.Flow], set(((new, b, new.outputs[b]),)))
+        eq_(len(self.es.edges), 1)
+
+
+class Sequence_Tests:
+
+    def test_reading_scalar_sequences_does_not_materialise_them(self):
+        s = Sequence(0.5)
+        eq_([s[t] for t in range(8760)], [0.5] * 8760)
+        eq_(s._explicit, {})
+        ok_(s.is_constant)
+
+    def test_that_flow_sequences_are_backed_by_arrays(self):
+        f = solph.Flow(actual_value=[0.1, 0.2], max=(1, 1), nominal_value=2)
+        eq_(type(f.actual_value[1]), float)
+        eq_(list(f.actual_value[0:2] * f.nominal_value), [0.2, 0.4])
+        ok_(f.max.is_constant)
+        ok_(not f.actual_value.is_constant)
+        eq_(f.min.value, 0)
+
+    def test_that_series_are_viewed_positionally_without_copying(self):
+        index = pd.date_range('1/1/2017', periods=3, freq='H')
+        df = pd.DataFrame({'pv': [0.0, 0.5, 0.25]}, index=index)
+        s = Sequence(df['pv'])
+        eq_([s[t] for t in range(3)], [0.0, 0.5, 0.25])
+        ok_(np.shares_memory(s.data, df['pv'].values))
+        with assert_raises(ValueError):
+            s[0] = 1
+        eq_(df['pv'][0], 0.0)
+
+    def test_that_equal_sequences_share_their_data(self):
+        es = ES()
+        profile = pd.Series([0.1, 0.2, 0.3])
+        b = solph.Bus(label='Bus')
+        sources = [solph.Source(label='PV {}'.format(i), outputs={
+            b: solph.Flow(actual_value=profile, max=[1, 1, 1],
+                          variable_costs=[1.0, 1.0, 1.0])})
+            for i in range(3)]
+        flows = [s.outputs[b] for s in sources]
+        ok_(all(np.shares_memory(f.actual_value.data, profile.values)
+                for f in flows))
+        ok_(all(f.max.data is flows[0].max.data for f in flows))
+        ok_(flows[0].max.data is not flows[0].variable_costs.data)
+        # views of the profile aren't interned
+        eq_(len(es.sequences), 2)
+        eq_(es.sequences.saved, 2 * (2 * 8 * 3))
+        flows[1].max[0] = 2
+        eq_((flows[0].max[0], flows[1].max[0]), (1, 2))
+
+    def test_that_views_never_alias_other_buffers(self):
+        es = ES()
+        a, b = np.array([1.0, 2.0]), np.array([1.0, 2.0])
+        first, second = Sequence(a), Sequence(b)
+        a[0] = 50
+        eq_((first[0], second[0]), (50, 1))
+        ok_(a.flags.writeable and b.flags.writeable)
+        eq_(len(es.sequences), 0)
+
+    def test_that_sequences_with_nans_are_interned(self):
+        es = ES()
+        first, second = (Sequence([1, np.nan, 3]) for _ in range(2))
+        ok_(first.data is second.data)
+        eq_(len(es.sequences), 1)
+
+
+class Snapshot_Tests:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_dump_and_restore(self):
+        es = solph.EnergySystem()
+        b = solph.Bus(label='Bus')
+        profile = pd.Series([0.1, 0.2, 0.3])
+        solph.Source(label='Source', outputs={b: solph.Flow(
+            actual_value=profile, nominal_value=5, fixed=True)})
+        solph.LinearTransformer(
+            label='Transformer', inputs={b: solph.Flow()},
+            outputs={b: solph.Flow(variable_costs=[1, 2, 3])},
+            conversion_factors={b: [0.5, 0.6, 0.7]})
+        es.results = {'objective': 42}
+        es.dump(self.directory, 'snapshot.oemof')
+
+        restored = solph.EnergySystem()
+        restored.restore(self.directory, 'snapshot.oemof')
+        eq_([n.label for n in restored.nodes],
+            ['Bus', 'Source', 'Transformer'])
+        eq_(restored.results, {'objective': 42})
+        bus, source, transformer = restored.nodes
+        eq_(len(restored.edges), 3)
+        eq_(set(bus.inputs), set((source, transformer)))
+        actual_value = source.outputs[bus].actual_value
+        ok_(isinstance(actual_value.data, np.memmap))
+        eq_(list(actual_value), [0.1, 0.2, 0.3])
+        eq_(list(transformer.conversion_factors[bus]), [0.5, 0.6, 0.7])
+        eq_(restored.groups[blocks.LinearTransformer], set((transformer,)))
+        eq_(len(restored.groups[blocks.Flow]), 3)
+
+    def test_that_restoring_other_files_fails(self):
+        with open(self.directory + '/garbage.oemof', 'wb') as garbage:
+            garbage.write(b'Not a snapshot.')
+        with assert_raises(ValueError):
+            ES().restore(self.directory, 'garbage.oemof')
+
+
+class NodesFromCSV_Tests:
+
+    def setup(self):
+        path = os.path.join(os.path.dirname(__file__), os.pardir, 'examples',
+                            'solph', 'csv_reader', 'investment_example',
+                            'data')
+        self.files = [os.path.join(path, f)
+                      for f in ('nodes_flows.csv', 'nodes_flows_seq.csv')]
+
+    def test_that_chunked_and_unchunked_reading_agree(self):
+        files = self.files
+        nodes = []
+        for chunksize in (None, 1000):
+            ES(groupings=solph.GROUPINGS)
+            nodes.append(solph.NodesFromCSV(*files, chunksize=chunksize))
+        eq_(sorted(nodes[0]), sorted(nodes[1]))
+        load = [n['REGION1_load'].inputs[n['REGION1_bus_el']].actual_value
+                for n in nodes]
+        eq_(len(load[0]), 8760)
+        eq_(list(load[0]), list(load[1]))
+
+    def test_that_empty_rows_are_dropped_from_chunks(self):
+        directory = tempfile.mkdtemp()
+        try:
+            sequences = os.path.join(directory, 'nodes_flows_seq.csv')
+            with open(self.files[1]) as original:
+                lines = original.readlines()
+            width = lines[0].count(',')
+            with open(sequences, 'w') as padded:
+                for number, line in enumerate(lines):
+                    padded.write(line)
+                    if number >= 5 and number % 400 == 0:
+                        padded.write(',' * width + '\n')
+            ES(groupings=solph.GROUPINGS)
+            nodes = solph.NodesFromCSV(self.files[0], sequences,
+                                       chunksize=300)
+            load = nodes['REGION1_load'].inputs[
+                nodes['REGION1_bus_el']].actual_value
+            eq_(len(load), 8760)
+            ok_(load.data.flags['C_CONTIGUOUS'])
+            ES(groupings=solph.GROUPINGS)
+            original = solph.NodesFromCSV(*self.files)
+            eq_(list(load), list(original['REGION1_load'].inputs[
+                original['REGION1_bus_el']].actual_value))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_caching_scenarios(self):
+        cache = solph.plumbing.ScenarioCache(
+            directory='test_scenario_cache_{}'.format(os.getpid()))
+        try:
+            ES(groupings=solph.GROUPINGS)
+            parsed = solph.NodesFromCSV(*self.files, cache=cache)
+            eq_(len(os.listdir(cache.path)), 1)
+            es = ES(groupings=solph.GROUPINGS)
+            cached = solph.NodesFromCSV(*self.files, cache=cache)
+            eq_(sorted(cached), sorted(parsed))
+            ok_(all(n in es.nodes for n in cached.values()))
+            flow = cached['REGION1_load'].inputs[cached['REGION1_bus_el']]
+            ok_(isinstance(flow.actual_value.data, np.memmap))
+            eq_(list(flow.actual_value), list(
+                parsed['REGION1_load'].inputs[
+                    parsed['REGION1_bus_el']].actual_value))
+            ES(groupings=solph.GROUPINGS)
+            solph.NodesFromCSV(*self.files, chunksize=1000, cache=cache)
+            eq_(len(os.listdir(cache.path)), 2)
+            cache.max_size = 0
+            cache.store('evicted', cached)
+            eq_(os.listdir(cache.path), [])
+        finally:
+            shutil.rmtree(cache.path)
+
+    def test_reading_tables(self):
+        # Convert the CSV files to tables. Columns holding 'seq' markers
+        # have to be string columns.
+        nodes_flows = pd.read_csv(self.files[0])
+        for column in nodes_flows:
+            if nodes_flows[column].isin(['seq']).any():
+                nodes_flows[column] = [None if v != v else str(v)
+                                       for v in nodes_flows[column]]
+        raw = pd.read_csv(self.files[1], header=None, index_col=0, dtype=str)
+        sequences = raw.iloc[5:].dropna(how='all').astype(float)
+        sequences.columns = ['|'.join(raw[c].iloc[:5]) for c in raw]
+        sequences.reset_index(drop=True, inplace=True)
+
+        directory = tempfile.mkdtemp()
+        written = []
+        try:
+            import pyarrow
+            from pyarrow import feather, parquet
+            for table, name in ((nodes_flows, 'nodes_flows'),
+                                (sequences, 'sequences')):
+                parquet.write_table(
+                    pyarrow.Table.from_pandas(table, preserve_index=False),
+                    os.path.join(directory, name + '.parquet'))
+                feather.write_feather(
+                    table, os.path.join(directory, name + '.feather'))
+            written.extend(['.parquet', '.feather'])
+        except ImportError:
+            pass
+        try:
+            import tables
+            nodes_flows.to_hdf(os.path.join(directory, 'nodes_flows.h5'),
+                               'nodes_flows')
+            sequences.to_hdf(os.path.join(directory, 'sequences.h5'),
+                             'sequences', format='table')
+            written.append('.h5')
+        except ImportError:
+            pass
+        if not written:
+            shutil.rmtree(directory)
+            raise SkipTest("Neither pyarrow nor pytables are installed.")
+
+        ES(groupings=solph.GROUPINGS)
+        expected = solph.NodesFromCSV(*self.files)
+
+        def load(nodes):
+            return nodes['REGION1_load'].inputs[nodes['REGION1_bus_el']]
+
+        try:
+            for extension in written:
+                ES(groupings=solph.GROUPINGS)
+                nodes = solph.NodesFromTables(
+                    os.path.join(directory, 'nodes_flows' + extension),
+                    os.path.join(directory, 'sequences' + extension))
+                eq_(sorted(nodes), sorted(expected))
+                eq_(list(load(nodes).actual_value),
+                    list(load(expected).actual_value))
+                eq_(load(nodes).fixed, True)
+                ok_(nodes['REGION1_wind'].investment)
+        finally:
+            shutil.rmtree(directory)
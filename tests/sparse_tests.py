@@ -0,0 +1,587 @@
+from nose.tools import ok_, eq_, assert_raises
+import gzip
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pyomo.environ as po
+from pyomo.opt import ResultsFormat, Solution, SolverResults
+from pyomo.solvers.plugins.solvers.CBCplugin import CBCSHELL
+
+from oemof.energy_system import EnergySystem as ES
+from oemof.solph import (Bus, BinaryFlow, DiscreteFlow, Flow, Investment,
+                         LinearTransformer, Sink, Source, Storage)
+from oemof.solph.sparse import (NameMap, Presolve, SparseModel,
+                                SparseOperationalModel)
+import oemof.solph as solph
+
+
+def energy_system(periods=4):
+    """ Creates an energy system using every constraint group of solph.
+    """
+    es = ES(groupings=solph.GROUPINGS,
+            timeindex=pd.date_range('1/1/2012', periods=periods, freq='H'))
+    bel, bgas, bth = Bus(label='el'), Bus(label='gas'), Bus(label='th')
+
+    def profile(*values):
+        return list(np.resize(values, periods))
+
+    Source(label='rgas', outputs={bgas: Flow(
+        nominal_value=100, summed_max=3, negative_gradient=0.3,
+        positive_gradient=0.4, variable_costs=profile(1, 2, 3, 4))})
+    Source(label='wind', outputs={bel: Flow(
+        nominal_value=10, actual_value=profile(0.1, 0.2, 0.3, 0.4),
+        fixed=True)})
+    Source(label='pv', outputs={bel: Flow(
+        actual_value=profile(0, 0.5, 0.7, 0.1), fixed=True, fixed_costs=1,
+        investment=Investment(ep_costs=5, maximum=100))})
+    Source(label='boiler', outputs={bth: Flow(
+        min=0.1, max=profile(0.9, 0.8, 0.9, 1), summed_min=1, summed_max=5,
+        investment=Investment(ep_costs=2))})
+    LinearTransformer(
+        label='pp', inputs={bgas: Flow()},
+        outputs={bel: Flow(nominal_value=50, min=0.2, variable_costs=1,
+                           binary=BinaryFlow(startup_costs=3,
+                                             shutdown_costs=2,
+                                             initial_status=1)),
+                 bth: Flow(nominal_value=40)},
+        conversion_factors={bel: 0.4, bth: profile(0.5, 0.4, 0.3, 0.5)})
+    Storage(label='battery', inputs={bel: Flow()},
+            outputs={bel: Flow(variable_costs=0.5)}, nominal_capacity=20,
+            initial_capacity=0.5, capacity_loss=0.01,
+            inflow_conversion_factor=0.9,
+            outflow_conversion_factor=profile(0.8, 0.85, 0.8, 0.9),
+            capacity_min=0.1, fixed_costs=2)
+    Storage(label='tank', inputs={bth: Flow()}, outputs={bth: Flow()},
+            investment=Investment(ep_costs=4), initial_capacity=0.2,
+            capacity_min=profile(0, 0.1, 0, 0), fixed_costs=1)
+    Sink(label='demand', inputs={bel: Flow(
+        actual_value=profile(0.5, 0.6, 0.7, 0.8), nominal_value=10,
+        fixed=True)})
+    Sink(label='heat', inputs={bth: Flow(nominal_value=5,
+                                         discrete=DiscreteFlow(),
+                                         fixed_costs=3)})
+    Sink(label='excess', inputs={bel: Flow(variable_costs=profile(1, 0))})
+    return es
+
+
+def pyomo_components(om, grid):
+    """ Yields the Pyomo component data corresponding to every element of
+    the family `grid` together with its id.
+    """
+    component = om
+    for part in grid.name.split('.'):
+        component = getattr(component, part)
+    for key in grid.keys:
+        ids = np.atleast_1d(grid[key])
+        index = key if isinstance(key, tuple) else (key,)
+        timesteps = [None] if grid.timesteps is None else grid.timesteps
+        for i, t in zip(ids, timesteps):
+            full = index if t is None else index + (int(t),)
+            yield component[full[0] if len(full) == 1 else full], i
+
+
+def read_lp(path):
+    """ Reads the constraint matrix from an LP file written by a sparse
+    model.
+    """
+    with open(path) as lp:
+        text = lp.read()
+    constraints = text.split("s.t.")[1].split("bounds")[0]
+    triplets = []
+    for block in constraints.strip().split("\n\n"):
+        lines = block.splitlines()
+        row = int(lines[0][4:-1])
+        for line in lines[1:-1]:
+            value, col = line.split()
+            triplets.append((row, int(col[1:]), float(value)))
+    return triplets
+
+
+def read_mps(path):
+    """ Reads the constraint matrix and the objective from a gzipped MPS
+    file written by a sparse model.
+    """
+    with gzip.open(path, 'rt') as mps:
+        text = mps.read()
+    columns = text.split("COLUMNS\n")[1].split("RHS\n")[0]
+    triplets, costs = [], {}
+    for line in columns.splitlines():
+        col, row, value = line.split()
+        if col == 'MARKER':
+            continue
+        if row == 'obj':
+            costs[int(col[1:])] = float(value)
+        else:
+            triplets.append((int(row[4:]), int(col[1:]), float(value)))
+    return triplets, costs
+
+
+class FakeResults:
+    """ Solver results holding the variable values `x` and the duals `y`
+    of a sparse model.
+    """
+    def __init__(self, x, y=()):
+        self.variable = {'x{}'.format(i): {'Value': v}
+                         for i, v in enumerate(x)}
+        self.constraint = {'c_e_{}'.format(i): {'Dual': v}
+                           for i, v in enumerate(y)}
+
+    def solution(self, index):
+        return self
+
+
+def assert_equivalent(om, sm):
+    """ Checks that every variable, constraint and the objective of the
+    Pyomo model `om` have an equal counterpart in the sparse model `sm` by
+    evaluating both at the same random point.
+    """
+    x = np.random.RandomState(1).uniform(0, 10, sm.nvars)
+    fixed = sm.lb == sm.ub
+    x[fixed] = sm.lb[fixed]
+
+    variables = 0
+    for grid in sm.variables.values():
+        for var, i in pyomo_components(om, grid):
+            variables += 1
+            if var.fixed:
+                ok_(fixed[i])
+                eq_(var.value, x[i])
+                continue
+            eq_((-np.inf if var.lb is None else var.lb,
+                 np.inf if var.ub is None else var.ub),
+                (sm.lb[i], sm.ub[i]))
+            eq_(var.is_integer() or var.is_binary(), sm.integer[i])
+            var.value = x[i]
+    eq_(variables, len(list(om.component_data_objects(po.Var))))
+    eq_(variables, sm.nvars)
+
+    lhs = sm.evaluate(x)
+    rows = 0
+    for grid in sm.constraints.values():
+        for constraint, r in pyomo_components(om, grid):
+            rows += 1
+            body = po.value(constraint.body)
+            lower = po.value(constraint.lower)
+            upper = po.value(constraint.upper)
+            if sm.sense[r] == 'E':
+                eq_(lower, upper)
+                ok_(np.isclose(abs(body - lower),
+                               abs(lhs[r] - sm.rhs[r])))
+                continue
+            slack = upper - body if lower is None else body - lower
+            ok_(np.isclose(slack, lhs[r] - sm.rhs[r] if sm.sense[r] == 'G'
+                           else sm.rhs[r] - lhs[r]))
+    eq_(rows, len(list(om.component_data_objects(po.Constraint))))
+    eq_(rows, sm.nrows)
+
+    ok_(np.isclose(po.value(om.objective),
+                   np.dot(sm.cost, x) + sm.objective_offset))
+
+
+class SparseOperationalModel_Tests:
+
+    def setup(self):
+        self.es = energy_system()
+        self.om = solph.OperationalModel(self.es)
+        self.sm = SparseOperationalModel(self.es)
+
+    def test_that_the_sparse_model_matches_the_pyomo_model(self):
+        assert_equivalent(self.om, self.sm)
+
+    def test_that_windows_with_given_states_match(self):
+        es = energy_system(periods=6)
+        nodes = {n.label: n for n in es.nodes}
+        rgas = nodes['rgas'].outputs[nodes['gas']]
+        kwargs = {'timesteps': range(2, 5),
+                  'initial_state': {nodes['battery']: 7,
+                                    (nodes['pp'], nodes['el']): 0,
+                                    rgas: 50},
+                  'final_state': {nodes['battery']: 3}}
+        assert_equivalent(solph.OperationalModel(es, **kwargs),
+                          SparseOperationalModel(es, **kwargs))
+        kwargs['final_values'] = kwargs.pop('final_state')
+        sm = SparseOperationalModel(es, **kwargs)
+        assert_equivalent(solph.OperationalModel(es, **kwargs), sm)
+        # the flow can only ramp from its previous value
+        eq_((sm.lb[sm.flow[nodes['rgas'], nodes['gas']]][0],
+             sm.ub[sm.flow[nodes['rgas'], nodes['gas']]][0]), (20, 90))
+
+    def test_that_weighted_periods_match(self):
+        es = energy_system(periods=12)
+        kwargs = {'periods': [range(8, 11), range(2, 6), [7]],
+                  'objective_weighting': np.arange(12) % 5 + 1}
+        assert_equivalent(solph.OperationalModel(es, **kwargs),
+                          SparseOperationalModel(es, **kwargs))
+
+    def test_that_storages_linked_over_periods_match(self):
+        es = energy_system(periods=12)
+        kwargs = {'periods': [range(8, 11), range(2, 6), [7]],
+                  'objective_weighting': np.arange(12) % 5 + 1,
+                  'period_sequence': [1, 0, 0, 2, 1]}
+        assert_equivalent(solph.OperationalModel(es, **kwargs),
+                          SparseOperationalModel(es, **kwargs))
+
+    def test_that_lower_bounds_hold_for_decayed_inter_period_states(self):
+        battery = [n for n in self.es.nodes if n.label == 'battery'][0]
+        sm = SparseOperationalModel(self.es, periods=[[0, 1, 2], [3]],
+                                    period_sequence=[0, 1, 0])
+        inter = sm.variables['Storage.inter_capacity'][battery]
+        rows, cols, coefficients = sm.matrix()
+        for name, expected in (('inter_upper', [1, 1, 1]),
+                               ('inter_lower', [0.99 ** 3, 0.99, 0.99 ** 3])):
+            lhs = sm.constraints['Storage.' + name][battery]
+            for row, col, value in zip(lhs, inter, expected):
+                ok_(np.allclose(coefficients[(rows == row) & (cols == col)],
+                                value))
+
+    def test_that_invalid_period_sequences_are_rejected(self):
+        battery = [n for n in self.es.nodes if n.label == 'battery'][0]
+        for kwargs in ({'period_sequence': [0]},
+                       {'periods': [[0, 1]], 'period_sequence': [1]},
+                       {'periods': [[0, 1]], 'period_sequence': []},
+                       {'periods': [[0, 1]], 'period_sequence': [0],
+                        'initial_state': {battery: 1}}):
+            for model in (solph.OperationalModel, SparseOperationalModel):
+                assert_raises(ValueError, model, self.es, **kwargs)
+
+    def test_results_are_structured_like_the_pyomo_results(self):
+        sm = self.sm
+        sm.solution = np.arange(sm.nvars, dtype=float)
+        results = sm.results()
+        nodes = {n.label: n for n in self.es.nodes}
+        tank, th = nodes['tank'], nodes['th']
+        eq_(list(results[tank][th]), sm.flow[tank, th].tolist())
+        eq_(results[tank][tank].invest,
+            sm.variables['InvestmentStorage.invest'][tank])
+        eq_(len(results[nodes['battery']][nodes['battery']]), 4)
+
+    def test_unknown_constraint_groups_are_rejected(self):
+        class Custom:
+            pass
+        assert_raises(ValueError, SparseOperationalModel, self.es,
+                      constraint_groups=[Custom])
+
+    def test_writing_lp_files(self):
+        descriptor, path = tempfile.mkstemp(suffix='.lp')
+        os.close(descriptor)
+        try:
+            self.sm.write(path)
+            with open(path) as lp:
+                lines = lp.read().splitlines()
+        finally:
+            os.remove(path)
+        nodes = {n.label: n for n in self.es.nodes}
+        eq_(sum(1 for l in lines if l.startswith('c')), self.sm.nrows)
+        ok_(' x{} = 1.0'.format(
+            self.sm.flow[nodes['wind'], nodes['el']][0]) in lines)
+
+
+class Writer_Tests:
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.es = energy_system()
+        self.sm = SparseOperationalModel(self.es, spill=self.tmpdir)
+
+    def teardown(self):
+        # dropping the model removes its spilled segments
+        del self.sm
+        shutil.rmtree(self.tmpdir)
+
+    def triplets(self):
+        return list(zip(*(a.tolist() for a in self.sm.matrix())))
+
+    def test_spilled_and_in_memory_matrices_agree(self):
+        ok_(any(name.startswith('oemof-')
+                for name in os.listdir(self.tmpdir)))
+        expected = SparseOperationalModel(self.es).matrix()
+        for spilled, in_memory in zip(self.sm.matrix(), expected):
+            ok_(isinstance(spilled, np.ndarray))
+            eq_(spilled.tolist(), in_memory.tolist())
+
+    def test_streaming_lp_files(self):
+        path = os.path.join(self.tmpdir, 'model.lp')
+        self.sm.write(path, chunksize=7)
+        eq_(read_lp(path), self.triplets())
+
+    def test_reading_duals_with_a_pyomo_plugin(self):
+        # pyomo's plugins only report the duals of rows named like its own
+        path = os.path.join(self.tmpdir, 'model.lp')
+        self.sm.write(path)
+        with open(path) as lp:
+            rows = [l[:-1] for l in lp.read().splitlines()
+                    if l.endswith(':') and l != 'obj:']
+        eq_(len(rows), self.sm.nrows)
+        solution = os.path.join(self.tmpdir, 'model.soln')
+        with open(solution, 'w') as soln:
+            soln.write("Optimal - objective value 1.0\n")
+            soln.writelines("{:7} {} 0 {}\n".format(k, row, int(row[4:]))
+                            for k, row in enumerate(rows))
+            soln.writelines("{:7} x{} {} 0\n".format(k, k, k)
+                            for k in range(self.sm.nvars))
+        cbc = CBCSHELL()
+        cbc._suffixes = ['dual']
+        cbc._soln_file = solution
+        cbc._results_format = ResultsFormat.soln
+        results = SolverResults()
+        results.solution.insert(Solution())
+        # set up by the plugin while reading the log of cbc
+        results.solution(0).objective['__default_objective__'] = {}
+        cbc.process_soln_file(results)
+        self.sm.receive_duals()
+        self.sm.load_solution(results)
+        eq_(self.sm.solution.tolist(), list(range(self.sm.nvars)))
+        eq_(self.sm.duals.tolist(), list(range(self.sm.nrows)))
+
+    def test_streaming_compressed_mps_files(self):
+        path = os.path.join(self.tmpdir, 'model.mps.gz')
+        self.sm.write(path, chunksize=7)
+        triplets, costs = read_mps(path)
+        eq_(sorted(triplets), self.triplets())
+        eq_(costs, {i: c for i, c in enumerate(self.sm.cost.tolist())
+                    if c or i not in {col for _, col, _ in triplets}})
+
+    def test_writing_the_objective_offset(self):
+        offset = float(self.sm.objective_offset)
+        ok_(offset)
+        path = os.path.join(self.tmpdir, 'model.lp')
+        self.sm.write(path, chunksize=7)
+        with open(path) as lp:
+            objective, rest = lp.read().split("s.t.")
+        ok_(objective.endswith("{:+} obj_offset\n\n".format(offset)))
+        ok_(" obj_offset = 1\n" in rest.split("bounds\n")[1])
+        path = os.path.join(self.tmpdir, 'model.mps.gz')
+        self.sm.write(path, chunksize=7)
+        with gzip.open(path, 'rt') as mps:
+            rhs = mps.read().split("RHS\n")[1]
+        ok_(rhs.startswith(" RHS obj {!r}\n".format(-offset)))
+
+    def test_writing_quadratic_objectives(self):
+        nodes = {n.label: n for n in self.es.nodes}
+        flow = self.sm.flow[nodes['wind'], nodes['el']]
+        self.sm.quadratic[flow] = 2
+        path = os.path.join(self.tmpdir, 'model.lp')
+        self.sm.write(path, chunksize=7)
+        with open(path) as lp:
+            objective = lp.read().split("s.t.")[0]
+        eq_(objective.split("+ [\n")[1],
+            "".join("+2.0 x{} ^ 2\n".format(c) for c in flow.tolist()) +
+            "] / 2\n\n")
+        path = os.path.join(self.tmpdir, 'model.mps.gz')
+        self.sm.write(path, chunksize=7)
+        with gzip.open(path, 'rt') as mps:
+            quadobj = mps.read().split("QUADOBJ\n")[1]
+        eq_(quadobj, "".join(" x{0} x{0} 2.0\n".format(c)
+                             for c in flow.tolist()) + "ENDATA\n")
+        self.sm.solution = np.zeros(self.sm.nvars)
+        self.sm.solution[flow] = 3
+        offset = self.sm.objective_offset
+        ok_(np.isclose(self.sm.objective() - offset,
+                       np.dot(self.sm.cost[flow], self.sm.solution[flow]) +
+                       len(flow) * 9))
+
+    def test_cached_writes_only_format_changed_chunks(self):
+        path = os.path.join(self.tmpdir, 'model.lp')
+        cache = {}
+        self.sm.write(path, chunksize=7, cache=cache)
+        before = dict(cache)
+        nodes = {n.label: n for n in self.es.nodes}
+        self.sm.update(nodes['battery'], capacity_loss=0.2)
+        self.sm.write(path, chunksize=7, cache=cache)
+        with open(path) as lp:
+            cached = lp.read()
+        self.sm.write(path, chunksize=7)
+        with open(path) as lp:
+            eq_(cached, lp.read())
+        changed = {key for key in cache if cache[key] is not before[key]}
+        rows = self.sm.constraints['Storage.balance'][nodes['battery']]
+        eq_(changed, {('rows', row - row % 7) for row in rows.tolist()})
+
+    def test_name_maps_translate_names_back(self):
+        path = os.path.join(self.tmpdir, 'model.lp')
+        self.sm.write(path, names=path + '.names.gz')
+        names = NameMap.load(path + '.names.gz')
+        nodes = {n.label: n for n in self.es.nodes}
+        flow = self.sm.flow[nodes['wind'], nodes['el']]
+        eq_(names.lookup('x{}'.format(flow[2])), ('flow', ('wind', 'el'), 2))
+        invest = self.sm.variables['InvestmentStorage.invest'][nodes['tank']]
+        eq_(names.lookup('x{}'.format(invest)),
+            ('InvestmentStorage.invest', 'tank'))
+        balance = self.sm.constraints['Bus.balance'][nodes['th']]
+        eq_(names.lookup('c_e_{}'.format(balance[0])),
+            ('Bus.balance', 'th', 0))
+        values = names.unflatten(np.arange(self.sm.nvars))
+        eq_(values['flow'][('wind', 'el')], flow.tolist())
+
+
+class Update_Tests:
+
+    def setup(self):
+        self.es = energy_system()
+        nodes = {n.label: n for n in self.es.nodes}
+        el, th = nodes['el'], nodes['th']
+        self.changes = [
+            (nodes['rgas'].outputs[nodes['gas']],
+             {'variable_costs': [5, 6, 7, 8]}),
+            (nodes['boiler'].outputs[th], {'min': 0.3, 'max': [1, 0.5] * 2}),
+            (nodes['pv'].outputs[el], {'actual_value': [0.3, 0.2] * 2}),
+            (nodes['pp'].outputs[el], {'min': 0.3, 'max': 0.9}),
+            (nodes['battery'], {'capacity_loss': [0.1, 0.2, 0.1, 0]}),
+            (nodes['tank'].investment, {'ep_costs': 9}),
+            (nodes['wind'].outputs[el], {'actual_value': 0.5})]
+        self.nodes = nodes
+
+    def lp(self, om):
+        """ Returns the blocks of the LP file of `om` as a set, so that LP
+        files can be compared regardless of the order of their rows.
+        """
+        descriptor, path = tempfile.mkstemp(suffix='.lp')
+        os.close(descriptor)
+        try:
+            om.write(path, io_options={'symbolic_solver_labels': True})
+            with open(path) as lp:
+                return set(lp.read().split('\n\n'))
+        finally:
+            os.remove(path)
+
+    def test_updated_models_equal_rebuilt_ones(self):
+        om = solph.OperationalModel(self.es)
+        sm = SparseOperationalModel(self.es, spill=True)
+        for obj, attributes in self.changes:
+            om.update(obj, **attributes)
+            sm.update(obj, **attributes)
+
+        eq_(self.lp(om), self.lp(solph.OperationalModel(self.es)))
+        fresh = SparseOperationalModel(self.es)
+        for updated, rebuilt in zip(sm.matrix(), fresh.matrix()):
+            eq_(updated.tolist(), rebuilt.tolist())
+        for attribute in ('lb', 'ub', 'cost'):
+            eq_(getattr(sm, attribute).tolist(),
+                getattr(fresh, attribute).tolist())
+
+    def test_updated_initial_states_equal_rebuilt_ones(self):
+        nodes = self.nodes
+        battery, pp, el = nodes['battery'], nodes['pp'], nodes['el']
+        rgas = nodes['rgas'].outputs[nodes['gas']]
+        kwargs = {'timesteps': range(1, 4),
+                  'initial_state': {battery: 7, (pp, el): 0, rgas: 50}}
+        state = {battery: 3, (pp, el): 1}
+        om = solph.OperationalModel(self.es, **kwargs)
+        sm = SparseOperationalModel(self.es, **kwargs)
+        om.update(initial_state=state)
+        sm.update(initial_state=state)
+
+        kwargs['initial_state'] = state
+        eq_(self.lp(om), self.lp(solph.OperationalModel(self.es, **kwargs)))
+        fresh = SparseOperationalModel(self.es, **kwargs)
+        for updated, rebuilt in zip(sm.matrix(), fresh.matrix()):
+            eq_(updated.tolist(), rebuilt.tolist())
+        for attribute in ('lb', 'ub', 'rhs'):
+            eq_(getattr(sm, attribute).tolist(),
+                getattr(fresh, attribute).tolist())
+        for model in (om, sm):
+            assert_raises(ValueError, model.update, initial_state={})
+
+    def test_updated_linked_storages_equal_rebuilt_ones(self):
+        kwargs = {'periods': [[0, 1, 2], [3]],
+                  'period_sequence': [0, 1, 1, 0, 1]}
+        om = solph.OperationalModel(self.es, **kwargs)
+        sm = SparseOperationalModel(self.es, **kwargs)
+        for storage in (self.nodes['battery'], self.nodes['tank']):
+            om.update(storage, capacity_loss=[0.1, 0.2, 0.3, 0.4])
+            sm.update(storage, capacity_loss=[0.1, 0.2, 0.3, 0.4])
+
+        eq_(self.lp(om), self.lp(solph.OperationalModel(self.es, **kwargs)))
+        fresh = SparseOperationalModel(self.es, **kwargs)
+        for updated, rebuilt in zip(sm.matrix(), fresh.matrix()):
+            eq_(updated.tolist(), rebuilt.tolist())
+
+    def test_that_rows_vanish_if_minima_are_dropped(self):
+        om = solph.OperationalModel(self.es)
+        sm = SparseOperationalModel(self.es)
+        flow = self.nodes['pp'].outputs[self.nodes['el']]
+        om.update(flow, min=0)
+        sm.update(flow, min=0)
+        eq_(self.lp(om), self.lp(solph.OperationalModel(self.es)))
+        rows = sm.constraints['BinaryFlow.max'][self.nodes['pp'],
+                                                self.nodes['el']]
+        ok_(not np.isin(sm.matrix()[0], rows).any())
+
+    def test_that_structural_changes_are_rejected(self):
+        sm = SparseOperationalModel(self.es)
+        flow = self.nodes['pv'].outputs[self.nodes['el']]
+        assert_raises(ValueError, sm.update, flow, min=0.1)
+        assert_raises(ValueError, sm.update, flow, nominal_value=3)
+        assert_raises(ValueError, sm.update, self.nodes['el'], min=1)
+
+
+class Presolve_Tests:
+
+    def setup(self):
+        self.es = energy_system()
+        self.nodes = {n.label: n for n in self.es.nodes}
+
+    def test_that_fixed_flows_are_folded(self):
+        sm = SparseOperationalModel(self.es)
+        for bounds in (True, False):
+            presolved = Presolve(sm, bounds=bounds)
+            reduced = presolved.model
+            wind = sm.flow[self.nodes['wind'], self.nodes['el']]
+            ok_(not np.isin(wind, presolved.columns).any())
+            eq_(presolved.values[wind].tolist(), [1, 2, 3, 4])
+            # the reduced model agrees with the whole one at any point
+            x = np.random.RandomState(1).uniform(0, 10, reduced.nvars)
+            values = presolved.solution(x)
+            eq_(values[presolved.columns].tolist(), x.tolist())
+            ok_(np.allclose(reduced.evaluate(x) - reduced.rhs,
+                            (sm.evaluate(values) - sm.rhs)[presolved.rows]))
+            ok_(np.isclose(np.dot(reduced.cost, x) + reduced.objective_offset,
+                           np.dot(sm.cost, values) + sm.objective_offset))
+        eq_(presolved.rows.tolist(), list(range(sm.nrows)))
+
+    def test_that_rows_turn_into_bounds(self):
+        m = SparseModel()
+        x = m.add_variables('x', ['a', 'b', 'c'], ub=[9, 9, 0],
+                            integer=[False, True, False])
+        rows = m.add_constraints('rows', ['s', 't', 'u', 'v', 'w', 'y'],
+                                 ['L', 'G', 'E', 'L', 'E', 'L'],
+                                 [5, -7, 4, 6, 4, 5])
+        m.add_coefficients(rows['s'], x['b'], 2)
+        m.add_coefficients(rows['t'], x['b'], -1)
+        m.add_coefficients(rows['u'], x.ids, [1, 1, 3])
+        m.add_coefficients(rows['v'], x.ids, [1, 1, 5])
+        m.add_coefficients(rows['w'], x.ids, [1, 1, 7])
+        m.add_coefficients(rows['y'], x.select(['a', 'b']), 1)
+        presolved = Presolve(m)
+        eq_(presolved.columns.tolist(), [0, 1])
+        eq_(presolved.model.lb.tolist(), [0, 0])
+        # the bounds of integer variables are rounded
+        eq_(presolved.model.ub.tolist(), [9, 2])
+        # duplicates of rows are dropped, keeping the tightest one
+        eq_(presolved.rows.tolist(), [2, 3])
+        eq_(presolved.model.rhs.tolist(), [4, 5])
+        eq_(presolved.duals([1, 2]).tolist(), [0, 0, 1, 2, 0, 0])
+        m.rhs[rows['w']] = 5
+        assert_raises(ValueError, Presolve, m)
+        m.rhs[rows['w']] = 4
+        m.lb[x['b']] = 3
+        assert_raises(ValueError, Presolve, m)
+
+    def test_that_presolved_solutions_are_expanded(self):
+        sm = SparseOperationalModel(self.es, presolve=True)
+        wind, el = self.nodes['wind'], self.nodes['el']
+        reduced = sm._problem()
+        ok_(reduced is sm.presolved.model)
+        values = np.arange(reduced.nvars, dtype=float)
+        sm.load_solution(FakeResults(values))
+        eq_(sm.solution[sm.presolved.columns].tolist(), values.tolist())
+        eq_(sm.results()[wind][el], [1, 2, 3, 4])
+
+        sm.receive_duals()
+        reduced = sm._problem()
+        sm.load_solution(FakeResults(np.zeros(reduced.nvars),
+                                     np.arange(reduced.nrows)))
+        eq_(sm.presolved.rows.tolist(), list(range(sm.nrows)))
+        eq_(sm.duals.tolist(), list(range(sm.nrows)))
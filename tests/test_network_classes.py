@@ -1,9 +1,10 @@
 from traceback import format_exception_only as feo
+import pickle
 
 from nose.tools import assert_raises, eq_, ok_
 
 from oemof.energy_system import EnergySystem as ES
-from oemof.network import Bus, Node, Transformer
+from oemof.network import Bus, Node, Transformer, flow
 
 
 class Node_Tests:
@@ -105,6 +106,48 @@ class Node_Tests:
              "\n  Got: {} instead").format(new.outputs))
 
 
+    def test_that_inputs_and_outputs_are_read_only_views(self):
+        Node.registry = None
+        flow = object()
+        source = Node(label="source")
+        target = Node(label="target", inputs={source: flow})
+        outputs = source.outputs
+        with assert_raises(TypeError):
+            outputs[target] = object()
+        eq_(dict(target.inputs), {source: flow})
+        late = Node(label="late", inputs={source: flow})
+        eq_(set(outputs), set((target, late)),
+            "\n  Views should reflect flows added after their creation.")
+
+
+    def test_removing_flows_and_nodes_from_edges(self):
+        Node.registry = None
+        hub = Node(label="hub")
+        spokes = [Node(label="spoke {}".format(i), inputs={hub: i})
+                  for i in range(10)]
+        edges = hub._edges
+        for spoke in spokes[::2]:
+            edges.remove(hub, spoke)
+        eq_(dict(hub.outputs), {s: i for i, s in enumerate(spokes)
+                                if i % 2})
+        del flow[hub, spokes[1]]
+        eq_(dict(spokes[1].inputs), {})
+        edges.remove_node(hub)
+        eq_(len(edges), 0)
+        eq_(dict(hub.outputs), {})
+
+
+    def test_that_pickled_nodes_keep_their_current_flows(self):
+        Node.registry = None
+        source = Node(label="source")
+        target = Node(label="target", inputs={source: "first"})
+        Node(label="late", inputs={source: "second"})
+        del flow[source, target]
+        copy = pickle.loads(pickle.dumps(source))
+        eq_({n.label: f for n, f in copy.outputs.items()},
+            {"late": "second"})
+
+
 class EnergySystem_Nodes_Integration_Tests:
 
     def setup(self):
@@ -118,3 +161,13 @@ class EnergySystem_Nodes_Integration_Tests:
         Transformer(label='<TF1>', inputs=[b1], outputs=[b2])
         ok_(isinstance(self.es.entities[2], Transformer))
 
+    def test_that_each_energy_system_owns_its_edges(self):
+        b1 = Bus(label='<B1>')
+        Transformer(label='<TF1>', inputs=[b1])
+        other = ES()
+        b2 = Bus(label='<B2>')
+        Transformer(label='<TF2>', inputs=[b2])
+        eq_(len(self.es.edges), 1)
+        eq_(len(other.edges), 1)
+        eq_([(s.label, t.label) for s, t, _ in other.edges],
+            [('<B2>', '<TF2>')])